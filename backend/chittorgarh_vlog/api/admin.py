@@ -1,21 +1,121 @@
-from django.contrib import admin
-from .models import Booking, PDFPurchase, MediaKitDownload
+from django.conf import settings
+from django.contrib import admin, messages
+from . import emails
+from .models import (
+    Booking, PDFPurchase, MediaKitDownload, UploadSession, StoredVideo, IdempotencyRecord, RazorpayWebhookEvent, Task,
+    OutboundEmail,
+)
+
+
+class OutboundEmailInline(admin.TabularInline):
+    model = OutboundEmail
+    fields = ('kind', 'recipients', 'subject', 'status', 'digest', 'attempts', 'last_error', 'sent_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class StalledMailWarning:
+    """Warn on the changelist when queued mail is not being delivered"""
+
+    def changelist_view(self, request, extra_context=None):
+        overdue = emails.stalled().count()
+        if overdue:
+            self.message_user(
+                request,
+                f'{overdue} emails have been waiting to be sent for over {settings.EMAIL_STALE_AFTER // 60} minutes. '
+                f'Is the worker (python manage.py run_tasks) running?',
+                messages.WARNING,
+            )
+        return super().changelist_view(request, extra_context)
 
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
-    list_display = ('booking_id', 'name', 'email', 'plan', 'amount', 'status', 'created_at')
-    list_filter = ('status', 'plan', 'created_at')
-    search_fields = ('name', 'email', 'booking_id')
-    readonly_fields = ('booking_id', 'created_at')
+class BookingAdmin(StalledMailWarning, admin.ModelAdmin):
+    list_display = (
+        'booking_id', 'name', 'email', 'plan', 'amount', 'status', 'payment_verification',
+        'video_duration', 'video_resolution', 'video_codec', 'created_at',
+    )
+    list_filter = ('status', 'payment_verification', 'plan', 'video_codec', 'video_purge_reason', 'created_at')
+    search_fields = ('name', 'email', 'booking_id', 'razorpay_order_id', 'transaction_id')
+    readonly_fields = (
+        'booking_id', 'created_at',
+        'video_duration', 'video_width', 'video_height', 'video_codec', 'video_bitrate',
+        'video_purged_at', 'video_purge_reason', 'payment_verified_at',
+    )
+    raw_id_fields = ('stored_video',)
+    inlines = [OutboundEmailInline]
+
+    @admin.display(description='Resolution', ordering='video_height')
+    def video_resolution(self, obj):
+        if obj.video_width and obj.video_height:
+            return f'{obj.video_width}x{obj.video_height}'
+        return '-'
+
+
+@admin.register(StoredVideo)
+class StoredVideoAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'content_type', 'ref_count', 'created_at', 'last_referenced_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'content_type', 'ref_count', 'created_at', 'last_referenced_at')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('upload_id', 'booking', 'filename', 'mode', 'received_bytes', 'total_size', 'status', 'updated_at')
+    list_filter = ('status', 'mode', 'created_at')
+    search_fields = ('upload_id', 'booking__booking_id', 'filename')
+    readonly_fields = ('upload_id', 'created_at', 'updated_at')
+
+
+@admin.register(RazorpayWebhookEvent)
+class RazorpayWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event', 'order_id', 'payment_id', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event', 'received_at')
+    search_fields = ('event_id', 'order_id', 'payment_id')
+    readonly_fields = ('event_id', 'event', 'order_id', 'payment_id', 'payload', 'received_at', 'processed_at')
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'run_at', 'attempts', 'max_attempts', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name', 'created_at')
+    search_fields = ('name', 'unique_key', 'last_error')
+    readonly_fields = ('attempts', 'last_error', 'locked_by', 'locked_at', 'created_at', 'finished_at')
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(StalledMailWarning, admin.ModelAdmin):
+    list_display = ('kind', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('subject', 'recipients', 'booking__booking_id', 'last_error')
+    raw_id_fields = ('booking', 'pdf_purchase')
+    readonly_fields = ('attempts', 'last_error', 'claimed_at', 'sent_at', 'created_at')
+
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'key', 'client', 'status', 'response_status', 'created_at', 'expires_at')
+    list_filter = ('scope', 'status')
+    search_fields = ('key', 'client')
+    readonly_fields = (
+        'scope', 'key', 'client', 'status', 'response_status', 'response_body', 'request_hash', 'request_size',
+        'created_at', 'expires_at',
+    )
 
 
 @admin.register(PDFPurchase)
-class PDFPurchaseAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'pdf_name', 'amount', 'payment_status', 'downloaded_at', 'created_at')
-    list_filter = ('payment_status', 'created_at', 'downloaded_at')
+class PDFPurchaseAdmin(StalledMailWarning, admin.ModelAdmin):
+    list_display = (
+        'name', 'email', 'pdf_name', 'amount', 'payment_status', 'payment_verification', 'downloaded_at', 'created_at',
+    )
+    list_filter = ('payment_status', 'payment_verification', 'created_at', 'downloaded_at')
     search_fields = ('name', 'email', 'razorpay_order_id', 'razorpay_payment_id')
-    readonly_fields = ('download_token', 'created_at', 'updated_at')
+    readonly_fields = ('download_token', 'payment_verified_at', 'created_at', 'updated_at')
+    inlines = [OutboundEmailInline]
     
     def has_delete_permission(self, request, obj=None):
         # Prevent deletion of payment records for legal/audit purposes
@@ -0,0 +1,138 @@
+"""
+Admission control for video uploads.
+
+Gunicorn runs a handful of sync workers, and a slow upload holds one for as
+long as the client takes to send the body. Left alone, a few concurrent
+uploads occupy every worker and create_order / verify_payment time out
+behind them. Only upload requests (create_booking carrying a video, and
+chunk PUTs) pass through here; everything else, including the payment and
+status endpoints, is never limited, so setting ``UPLOAD_MAX_CONCURRENT``
+below the worker count keeps the rest of the workers free for them.
+
+An upload needs two slots before its body is read:
+
+- a per-process slot (``UPLOAD_MAX_CONCURRENT_PER_PROCESS``), a semaphore
+  that matters for threaded workers;
+- a global slot (``UPLOAD_MAX_CONCURRENT``) across all workers, a cache key
+  ``upload_slot_<n>`` claimed with ``cache.add``. Slots are leases, so a
+  worker killed mid-upload cannot hold one forever. A lease lasts as long as
+  the request body takes to arrive at ``UPLOAD_MIN_RATE`` bytes per second,
+  and at least ``UPLOAD_SLOT_LEASE`` seconds, so a slow upload that is
+  still running never loses its slot to another.
+
+A request that finds no free slot is turned away at once with 503 and
+``Retry-After``. With threaded workers ``UPLOAD_QUEUE_TIMEOUT`` lets it wait
+that many seconds for a slot first; sync workers should not wait, since a
+waiting request holds a worker just like an upload does. Global
+slots and counters live in the default cache, which must be shared between
+workers for the global limit and the metrics to cover the whole node.
+"""
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+SLOT_KEY = 'upload_slot_{}'
+METRIC_KEY = 'upload_admission_{}'
+COUNTERS = ('admitted', 'queued', 'rejected', 'waiting')
+POLL_INTERVAL = 0.1
+
+_process_slots = None
+_process_slots_size = None
+_process_lock = threading.Lock()
+
+
+def _semaphore():
+    """The per-process semaphore, rebuilt if the configured size changed"""
+    global _process_slots, _process_slots_size
+    size = settings.UPLOAD_MAX_CONCURRENT_PER_PROCESS
+    with _process_lock:
+        if _process_slots_size != size:
+            _process_slots = threading.BoundedSemaphore(size)
+            _process_slots_size = size
+        return _process_slots
+
+
+def _bump(name, delta=1):
+    key = METRIC_KEY.format(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, max(delta, 0), timeout=None)
+
+
+class UploadSlot:
+    """A held pair of per-process and global upload slots; release() frees both"""
+
+    def __init__(self, semaphore, index, token):
+        self.semaphore = semaphore
+        self.index = index
+        self.token = token
+
+    def release(self):
+        key = SLOT_KEY.format(self.index)
+        if cache.get(key) == self.token:
+            cache.delete(key)
+        self.semaphore.release()
+
+
+def slot_lease(content_length):
+    """Seconds to hold a slot for a body of ``content_length`` bytes"""
+    return max(settings.UPLOAD_SLOT_LEASE, math.ceil(content_length / settings.UPLOAD_MIN_RATE))
+
+
+def _claim_global_slot(lease):
+    token = uuid.uuid4().hex
+    for index in range(settings.UPLOAD_MAX_CONCURRENT):
+        if cache.add(SLOT_KEY.format(index), token, timeout=lease):
+            return index, token
+    return None
+
+
+def acquire(timeout=None, content_length=0):
+    """Claim an upload slot, waiting up to ``timeout`` seconds; None if none freed up"""
+    if timeout is None:
+        timeout = settings.UPLOAD_QUEUE_TIMEOUT
+    lease = slot_lease(content_length)
+    deadline = time.monotonic() + timeout
+    semaphore = _semaphore()
+    waiting = False
+    try:
+        while True:
+            if semaphore.acquire(blocking=False):
+                claimed = _claim_global_slot(lease)
+                if claimed:
+                    _bump('admitted')
+                    return UploadSlot(semaphore, *claimed)
+                semaphore.release()
+
+            if time.monotonic() >= deadline:
+                _bump('rejected')
+                return None
+            if not waiting:
+                waiting = True
+                _bump('queued')
+                _bump('waiting')
+            time.sleep(POLL_INTERVAL)
+    finally:
+        if waiting:
+            _bump('waiting', -1)
+
+
+def metrics():
+    """Counters plus the uploads currently holding a global slot"""
+    values = cache.get_many([METRIC_KEY.format(name) for name in COUNTERS])
+    slots = cache.get_many([SLOT_KEY.format(index) for index in range(settings.UPLOAD_MAX_CONCURRENT)])
+    return {
+        'in_flight': len(slots),
+        'max_concurrent': settings.UPLOAD_MAX_CONCURRENT,
+        'max_concurrent_per_process': settings.UPLOAD_MAX_CONCURRENT_PER_PROCESS,
+        'queue_depth': max(values.get(METRIC_KEY.format('waiting'), 0), 0),
+        **{name: values.get(METRIC_KEY.format(name), 0) for name in ('admitted', 'queued', 'rejected')},
+    }
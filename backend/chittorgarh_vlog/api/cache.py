@@ -0,0 +1,47 @@
+"""
+Database cache backend with an atomic ``incr()``.
+
+Django's DatabaseCache inherits ``incr()`` from BaseCache, which is a
+``get()`` followed by a ``set()``. Two workers incrementing the same
+counter can both read N and both write N+1. Rate-limit counters and the
+upload admission metrics are incremented from every gunicorn worker, so
+here the read and the write happen in one transaction, with the row
+locked (``SELECT ... FOR UPDATE``) on databases that support it.
+
+Configured as the default cache in settings.py unless ``MEMCACHED_LOCATION``
+is set; memcached's own ``incr`` is atomic already.
+"""
+import base64
+import pickle
+
+from django.core.cache.backends.db import DatabaseCache as BaseDatabaseCache
+from django.db import connections, router, transaction
+from django.utils.timezone import now as tz_now
+
+
+class DatabaseCache(BaseDatabaseCache):
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        lock = ' FOR UPDATE' if connection.features.has_select_for_update else ''
+        now = connection.ops.adapt_datetimefield_value(tz_now().replace(microsecond=0))
+
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {quote_name('value')} FROM {table} "
+                f"WHERE {quote_name('cache_key')} = %s AND {quote_name('expires')} >= %s{lock}",
+                [key, now],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found.")
+            value = pickle.loads(base64.b64decode(connection.ops.process_clob(row[0]).encode())) + delta
+            encoded = base64.b64encode(pickle.dumps(value, self.pickle_protocol)).decode('latin1')
+            cursor.execute(
+                f"UPDATE {table} SET {quote_name('value')} = %s WHERE {quote_name('cache_key')} = %s",
+                [encoded, key],
+            )
+        return value
@@ -0,0 +1,282 @@
+"""
+Outgoing email, delivered by the background worker over one SMTP connection.
+
+Each ``send_mail`` in a view used to open its own SMTP/TLS connection, log
+in, send one message and hang up, so the payment endpoints waited on the
+mail server twice per request. Now:
+
+- ``queue()`` stores the message as an OutboundEmail row, linked to the
+  booking or PDF purchase it is about, and makes sure a ``deliver`` task is
+  queued (api/tasks.py). The request does not talk to the mail server.
+- ``deliver()`` opens one connection and logs in once, then sends every
+  due message through it, ``EMAIL_BATCH_SIZE`` claimed at a time. Results
+  are written back with one UPDATE per batch. A connection the server drops
+  is reopened for the rest of the batch.
+- A message refused with a temporary error (4xx reply, dropped connection,
+  timeout) is retried after ``EMAIL_RETRY_DELAY * 2 ** (attempts - 1)``
+  seconds, up to ``EMAIL_MAX_ATTEMPTS`` sends. A permanent refusal (5xx) is
+  marked failed at once. Status, attempts and the last error of every
+  message show with its booking in the admin.
+- If the server cannot be reached at all, no message is touched and the
+  task itself is retried with backoff.
+
+Notifications to the admin (``notify_admin()``) can be collected into a
+digest instead (``ADMIN_NOTIFICATIONS = 'digest'``). They are stored as
+``held`` and one summary goes out at the next multiple of
+``ADMIN_DIGEST_INTERVAL`` seconds. It lists every held notification and
+carries their full text. Bookings or purchases of at least
+``ADMIN_DIGEST_IMMEDIATE_AMOUNT`` rupees are still announced at once. No
+digest is sent for an interval without news.
+"""
+import logging
+import math
+import smtplib
+import textwrap
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import mail
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import tasks
+from .models import OutboundEmail, Task
+
+
+logger = logging.getLogger(__name__)
+
+# Retries get their own task so a retry hours away never holds back new mail
+DELIVER_KEY = 'emails.deliver'
+RETRY_KEY = 'emails.deliver.retry'
+DIGEST_KEY = 'emails.admin_digest'
+
+
+def queue(subject, message, from_email, recipient_list, booking=None, pdf_purchase=None, kind=''):
+    """Store an email for the worker to send; returns it, or None if there is no recipient"""
+    recipient_list = [address for address in recipient_list if address]
+    if not recipient_list:
+        return None
+    email = OutboundEmail.objects.create(
+        booking=booking,
+        pdf_purchase=pdf_purchase,
+        kind=kind,
+        from_email=from_email or '',
+        recipients=recipient_list,
+        subject=subject,
+        body=message,
+        next_attempt_at=timezone.now(),
+    )
+    tasks.enqueue(deliver, unique_key=DELIVER_KEY)
+    return email
+
+
+def _next_digest_time(now):
+    interval = settings.ADMIN_DIGEST_INTERVAL
+    return datetime.fromtimestamp(math.ceil(now.timestamp() / interval) * interval, tz=dt_timezone.utc)
+
+
+def notify_admin(subject, message, booking=None, pdf_purchase=None, kind=''):
+    """Email ``EMAIL_HOST_USER`` about a booking or purchase, now or in the next digest"""
+    if not settings.EMAIL_HOST_USER:
+        return None
+    record = booking or pdf_purchase
+    threshold = settings.ADMIN_DIGEST_IMMEDIATE_AMOUNT
+    # A fresh instance may still hold the amount as the request's string
+    urgent = threshold and record is not None and Decimal(str(record.amount)) >= threshold
+    if settings.ADMIN_NOTIFICATIONS != 'digest' or urgent:
+        return queue(
+            subject, message, settings.EMAIL_HOST_USER, [settings.EMAIL_HOST_USER],
+            booking=booking, pdf_purchase=pdf_purchase, kind=kind,
+        )
+
+    now = timezone.now()
+    email = OutboundEmail.objects.create(
+        booking=booking,
+        pdf_purchase=pdf_purchase,
+        kind=kind,
+        from_email=settings.EMAIL_HOST_USER,
+        recipients=[settings.EMAIL_HOST_USER],
+        subject=subject,
+        body=message,
+        status='held',
+        next_attempt_at=now,
+    )
+    # Dropped if this interval's digest is already queued
+    tasks.enqueue(send_admin_digest, run_at=_next_digest_time(now), unique_key=DIGEST_KEY)
+    return email
+
+
+def _digest_body(held):
+    bookings = [email.booking for email in held if email.booking_id]
+    purchases = [email.pdf_purchase for email in held if email.pdf_purchase_id]
+    lines = [
+        f'{len(held)} notifications since {timezone.localtime(held[0].created_at):%B %d, %Y at %I:%M %p}',
+        f'Bookings: {len(set(bookings))} (₹{sum(b.amount for b in set(bookings))})',
+        f'PDF purchases: {len(set(purchases))} (₹{sum(p.amount for p in set(purchases))})',
+        '',
+        'SUMMARY',
+    ]
+    for number, email in enumerate(held, 1):
+        lines.append(f'{number}. {timezone.localtime(email.created_at):%I:%M %p}  {email.subject}')
+    lines += ['', 'DETAILS']
+    for number, email in enumerate(held, 1):
+        lines += ['', '═' * 39, f'{number}. {email.subject}', '═' * 39, textwrap.dedent(email.body).strip()]
+    return '\n'.join(lines) + '\n'
+
+
+@tasks.task()
+def send_admin_digest():
+    """Send the held admin notifications as one email; returns it, or None if nothing was held"""
+    with transaction.atomic():
+        held = list(
+            OutboundEmail.objects.select_for_update(of=('self',))
+            .filter(status='held')
+            .select_related('booking', 'pdf_purchase')
+            .order_by('created_at', 'pk')
+        )
+        if not held:
+            return None
+        digest = queue(
+            subject=f'📋 ChittorgarhVlog digest: {len(held)} new notifications',
+            message=_digest_body(held),
+            from_email=settings.EMAIL_HOST_USER,
+            recipient_list=[settings.EMAIL_HOST_USER],
+            kind='admin_digest',
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in held]).update(status='digested', digest=digest)
+    logger.info(f"Queued admin digest of {len(held)} notifications")
+    return digest
+
+
+def _claim(limit, now):
+    """Mark up to ``limit`` due emails as sending for this worker; returns them"""
+    due = OutboundEmail.objects.filter(status='queued', next_attempt_at__lte=now).order_by('next_attempt_at', 'pk')
+    changes = {'status': 'sending', 'claimed_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            emails = list(due.select_for_update(skip_locked=True)[:limit])
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(**changes)
+    else:
+        emails = [
+            email for email in due[:limit]
+            if OutboundEmail.objects.filter(pk=email.pk, status='queued').update(**changes)
+        ]
+    for email in emails:
+        email.status = 'sending'
+        email.claimed_at = now
+        email.attempts += 1
+    return emails
+
+
+def is_transient(error):
+    """Whether a failed send may succeed later"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # Dropped connections and timeouts
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+def _connection_lost(error):
+    # SMTPException is an OSError too; other OSErrors are socket failures. 421: the server is closing
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected) or getattr(error, 'smtp_code', None) == 421
+    return isinstance(error, OSError)
+
+
+def _record_failure(email, error, now):
+    email.last_error = f'{type(error).__name__}: {error}'
+    if is_transient(error) and email.attempts < settings.EMAIL_MAX_ATTEMPTS:
+        email.status = 'queued'
+        email.next_attempt_at = now + timedelta(seconds=settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+    else:
+        email.status = 'failed'
+        logger.error(f"Giving up on email {email.pk} ({email.kind}) to {email.recipients}: {email.last_error}")
+
+
+def _send_batch(smtp, emails):
+    """Send claimed emails one by one over ``smtp``; returns how many were sent"""
+    sent = 0
+    for index, email in enumerate(emails):
+        now = timezone.now()
+        message = mail.EmailMessage(
+            email.subject, email.body, email.from_email or None, email.recipients, connection=smtp,
+        )
+        try:
+            smtp.send_messages([message])
+        except Exception as e:
+            _record_failure(email, e, now)
+            if not _connection_lost(e):
+                continue
+            smtp.close()
+            try:
+                smtp.open()
+            except Exception as e:
+                # Put the rest back; the deliver task is retried
+                for rest in emails[index + 1:]:
+                    _record_failure(rest, e, now)
+                OutboundEmail.objects.bulk_update(emails, ['status', 'last_error', 'next_attempt_at', 'sent_at'])
+                raise
+        else:
+            email.status = 'sent'
+            email.sent_at = now
+            email.last_error = ''
+            sent += 1
+    OutboundEmail.objects.bulk_update(emails, ['status', 'last_error', 'next_attempt_at', 'sent_at'])
+    return sent
+
+
+def requeue_stale(now=None):
+    """Put back emails left 'sending' by a worker that died; they may be sent twice"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    return OutboundEmail.objects.filter(status='sending', claimed_at__lt=cutoff).update(
+        status='queued', next_attempt_at=now,
+    )
+
+
+def stalled(now=None):
+    """Queued emails overdue by more than ``EMAIL_STALE_AFTER``: no worker is delivering mail"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.EMAIL_STALE_AFTER)
+    return OutboundEmail.objects.filter(status='queued', next_attempt_at__lt=cutoff)
+
+
+def _schedule_retries():
+    run_at = OutboundEmail.objects.filter(status='queued').aggregate(Min('next_attempt_at'))['next_attempt_at__min']
+    if run_at is None:
+        return
+    tasks.enqueue(deliver, run_at=run_at, unique_key=RETRY_KEY)
+    # Dropped if a retry was already queued; make sure that one runs no later
+    Task.objects.filter(unique_key=RETRY_KEY, status='queued', run_at__gt=run_at).update(run_at=run_at)
+
+
+@tasks.task()
+def deliver(batch_size=None):
+    """Send every due email over one SMTP connection; returns how many were sent"""
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    requeue_stale()
+    if not OutboundEmail.objects.filter(status='queued', next_attempt_at__lte=timezone.now()).exists():
+        _schedule_retries()
+        return 0
+
+    smtp = mail.get_connection(fail_silently=False)
+    # Raises if the server is unreachable, before any email is claimed
+    smtp.open()
+    sent = 0
+    try:
+        while True:
+            emails = _claim(batch_size, timezone.now())
+            if not emails:
+                break
+            sent += _send_batch(smtp, emails)
+    finally:
+        smtp.close()
+
+    if sent:
+        logger.info(f"Delivered {sent} emails")
+    _schedule_retries()
+    return sent
@@ -0,0 +1,268 @@
+"""
+Razorpay gateway client.
+
+Every Razorpay API call from the views goes through ``gateway()``:
+
+- One pooled ``requests`` session per process, so calls reuse keep-alive
+  TLS connections instead of opening one per request.
+- Connect and read timeouts on every call (``RAZORPAY_CONNECT_TIMEOUT``,
+  ``RAZORPAY_READ_TIMEOUT``), so a slow gateway cannot hold a worker
+  indefinitely.
+- Bounded retries with backoff for GETs on connection errors and 502/503/504.
+  POSTs (creating an order) are only retried when the connection could not
+  be established, because a request that reached Razorpay might have been
+  applied.
+- A circuit breaker: after ``RAZORPAY_BREAKER_THRESHOLD`` consecutive
+  failures, calls fail immediately with GatewayUnavailable for
+  ``RAZORPAY_BREAKER_RESET`` seconds. After that one trial call is let
+  through to probe the gateway. Views turn GatewayUnavailable into a 503.
+- Per-call latency and outcome counters, exposed by ``stats()``.
+
+Signature verification is a local HMAC and never touches the network.
+"""
+import logging
+import threading
+import time
+
+import razorpay
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger(__name__)
+
+# Errors that say the gateway is unhealthy, as opposed to rejecting our request
+GATEWAY_FAILURES = (
+    requests.RequestException,
+    razorpay.errors.ServerError,
+    razorpay.errors.GatewayError,
+    ValueError,  # non-JSON error page from a proxy in front of the gateway
+)
+
+
+class GatewayUnavailable(Exception):
+    """The payment gateway is unreachable, too slow, or the circuit is open"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TimeoutSession(requests.Session):
+    """Session that applies a default (connect, read) timeout to every request"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+        return super().request(method, url, **kwargs)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker, closed -> open -> half-open -> closed"""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise GatewayUnavailable unless a call may go out now"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            retry_after = max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)))
+        raise GatewayUnavailable('Payment gateway is temporarily unavailable', retry_after)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"Razorpay circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+
+class CallStats:
+    """Latency and outcome counters for one kind of gateway call"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, elapsed_ms, failed):
+        self.calls += 1
+        self.failures += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.last_ms = elapsed_ms
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'rejected_by_breaker': self.rejected,
+            'mean_ms': round(self.total_ms / self.calls, 1) if self.calls else None,
+            'max_ms': round(self.max_ms, 1),
+            'last_ms': round(self.last_ms, 1),
+        }
+
+
+class GatewayClient:
+    """Razorpay client with pooling, timeouts, retries and a circuit breaker"""
+
+    def __init__(self, key_id=None, key_secret=None, base_url=None, connect_timeout=None, read_timeout=None,
+                 retries=None, breaker_threshold=None, breaker_reset=None):
+        self.session = TimeoutSession((
+            connect_timeout or settings.RAZORPAY_CONNECT_TIMEOUT,
+            read_timeout or settings.RAZORPAY_READ_TIMEOUT,
+        ))
+        retries = settings.RAZORPAY_RETRIES if retries is None else retries
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            allowed_methods=frozenset(['GET']),
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.2,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.RAZORPAY_POOL_SIZE, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        options = {'base_url': base_url} if base_url else {}
+        self.client = razorpay.Client(
+            session=self.session,
+            auth=(key_id or settings.RAZORPAY_KEY_ID, key_secret or settings.RAZORPAY_KEY_SECRET),
+            **options,
+        )
+        self.breaker = CircuitBreaker(
+            breaker_threshold or settings.RAZORPAY_BREAKER_THRESHOLD,
+            breaker_reset or settings.RAZORPAY_BREAKER_RESET,
+        )
+        self.call_stats = {}
+        self.stats_lock = threading.Lock()
+
+    def _stats(self, name):
+        with self.stats_lock:
+            return self.call_stats.setdefault(name, CallStats())
+
+    def call(self, name, func, *args, **kwargs):
+        """Run one Razorpay SDK call under the breaker, timing it"""
+        stats = self._stats(name)
+        try:
+            self.breaker.before_call()
+        except GatewayUnavailable:
+            with self.stats_lock:
+                stats.rejected += 1
+            raise
+
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except GATEWAY_FAILURES as e:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            with self.stats_lock:
+                stats.record(elapsed_ms, True)
+            self.breaker.record_failure()
+            logger.warning(f"Razorpay {name} failed after {elapsed_ms:.0f}ms: {str(e)}")
+            raise GatewayUnavailable('Payment gateway is temporarily unavailable', self.breaker.reset_timeout)
+        except Exception:
+            # The gateway answered, it just refused this request
+            with self.stats_lock:
+                stats.record((time.monotonic() - started) * 1000, False)
+            self.breaker.record_success()
+            raise
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self.stats_lock:
+            stats.record(elapsed_ms, False)
+        self.breaker.record_success()
+        if elapsed_ms > settings.RAZORPAY_SLOW_CALL_MS:
+            logger.warning(f"Slow Razorpay {name}: {elapsed_ms:.0f}ms")
+        return result
+
+    def create_order(self, amount, currency='INR', receipt=None, notes=None):
+        data = {'amount': amount, 'currency': currency, 'payment_capture': 1}
+        if receipt:
+            data['receipt'] = receipt
+        if notes:
+            data['notes'] = notes
+        return self.call('order.create', self.client.order.create, data=data)
+
+    def fetch_order(self, order_id):
+        return self.call('order.fetch', self.client.order.fetch, order_id)
+
+    def fetch_order_payments(self, order_id):
+        return self.call('order.payments', self.client.order.payments, order_id)
+
+    def fetch_payment(self, payment_id):
+        return self.call('payment.fetch', self.client.payment.fetch, payment_id)
+
+    def list_payments(self, from_ts, to_ts, count=100, skip=0):
+        """One page of payments created between two unix timestamps, newest first"""
+        data = {'from': int(from_ts), 'to': int(to_ts), 'count': count, 'skip': skip}
+        return self.call('payment.all', self.client.payment.all, data)
+
+    def verify_payment_signature(self, params):
+        """Raises razorpay.errors.SignatureVerificationError on a bad signature"""
+        return self.client.utility.verify_payment_signature(params)
+
+    def stats(self):
+        with self.stats_lock:
+            calls = {name: stats.as_dict() for name, stats in self.call_stats.items()}
+        return {'breaker': self.breaker.state, 'consecutive_failures': self.breaker.failures, 'calls': calls}
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def gateway():
+    """The process-wide GatewayClient"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = GatewayClient()
+    return _gateway
+
+
+def reset():
+    """Drop the process-wide client (tests, or after changing settings)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
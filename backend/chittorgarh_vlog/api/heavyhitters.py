@@ -0,0 +1,250 @@
+"""
+Heavy-hitter detection for the public write endpoints.
+
+Per-IP rate limits need a cache entry per client, so a flood from rotating
+addresses fills the cache and the database before any limit trips. This
+module watches the write endpoints (``HeavyHitterMiddleware``) in fixed
+memory per worker instead:
+
+- Every request to a watched endpoint is counted three ways: by client IP,
+  by network (/24 for IPv4, /48 for IPv6) and by User-Agent. The IP is
+  the one our proxy saw (``TRUSTED_PROXY_HOPS``), never an
+  X-Forwarded-For entry the client wrote itself.
+- Each of these streams keeps only ``HEAVY_HITTER_CAPACITY`` counters
+  (Space-Saving top-k). A new key that arrives when all counters are taken
+  replaces the smallest one and inherits its count as possible error.
+  Frequent keys always survive; rare ones come and go. Counts restart every
+  ``HEAVY_HITTER_WINDOW`` seconds; the last finished window is kept for
+  the admin view.
+- A key whose guaranteed count (count minus error) reaches its threshold
+  (``HEAVY_HITTER_THRESHOLDS``, per worker per window) is put on the
+  deny-list for ``HEAVY_HITTER_DENY_SECONDS``.
+
+The deny-list is shared through the cache, so a client flagged by one
+worker is refused by all of them. Each worker checks a local copy, which it
+refreshes from the cache at most every ``HEAVY_HITTER_SYNC_INTERVAL``
+seconds. Checking a request therefore costs no cache or database work.
+Staff can see the top talkers, and deny or allow keys by hand, through
+``/api/top-talkers/``.
+"""
+import ipaddress
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ratelimit import trusted_client_ip
+
+
+DIMENSIONS = ('ip', 'prefix', 'agent')
+DENY_LIST_KEY = 'heavy_hitters_deny_list'
+MAX_AGENT_LENGTH = 200
+
+
+class SpaceSaving:
+    """Approximate top-k counts of a stream in ``capacity`` counters (Metwally et al.)"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, key, weight=1):
+        """Count ``key``; returns its guaranteed count, a lower bound of the true count"""
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = floor + weight
+            self.errors[key] = floor
+        return self.counts[key] - self.errors[key]
+
+    def top(self, n):
+        """The ``n`` largest counters as (key, count, error), largest first"""
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+
+def request_keys(request):
+    """The IP, network and User-Agent a request is counted under"""
+    ip = (trusted_client_ip(request) or '').strip()
+    try:
+        address = ipaddress.ip_address(ip)
+        prefix = str(ipaddress.ip_network(f'{ip}/{24 if address.version == 4 else 48}', strict=False))
+    except ValueError:
+        prefix = ip
+    agent = request.META.get('HTTP_USER_AGENT', '')[:MAX_AGENT_LENGTH] or '-'
+    return {'ip': ip, 'prefix': prefix, 'agent': agent}
+
+
+class HeavyHitterTracker:
+    """Space-Saving counters for each dimension, restarted every ``window`` seconds"""
+
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.window = window
+        self.lock = threading.Lock()
+        self.previous = None
+        self._start(time.time())
+
+    def _start(self, now):
+        self.started = now
+        self.current = {dimension: SpaceSaving(self.capacity) for dimension in DIMENSIONS}
+
+    def _rotate(self, now):
+        if now - self.started >= self.window:
+            self.previous = (self.started, self.current)
+            self._start(now)
+
+    def record(self, keys, now=None):
+        """Count one request; returns {dimension: guaranteed count this window}"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._rotate(now)
+            return {dimension: self.current[dimension].add(keys[dimension]) for dimension in DIMENSIONS}
+
+    def top(self, n, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self._rotate(now)
+            windows = [(self.started, self.current)]
+            if self.previous is not None:
+                windows.append(self.previous)
+            return [
+                {
+                    'started': started,
+                    'top': {
+                        dimension: [
+                            {'value': key, 'count': count, 'error': error}
+                            for key, count, error in counters[dimension].top(n)
+                        ]
+                        for dimension in DIMENSIONS
+                    },
+                }
+                for started, counters in windows
+            ]
+
+
+class DenyList:
+    """Denied (dimension, value) pairs, shared through the cache and checked locally"""
+
+    def __init__(self):
+        self.entries = {}  # (dimension, value) -> expiry timestamp
+        self.synced_at = 0
+        self.lock = threading.Lock()
+
+    def _shared(self, now):
+        entries = cache.get(DENY_LIST_KEY) or {}
+        return {key: expires for key, expires in entries.items() if expires > now}
+
+    def _sync(self, now):
+        if now - self.synced_at >= settings.HEAVY_HITTER_SYNC_INTERVAL:
+            self.entries = self._shared(now)
+            self.synced_at = now
+
+    def match(self, keys, now=None):
+        """The first denied (dimension, value, expires) among ``keys``, or None"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._sync(now)
+            for dimension in DIMENSIONS:
+                expires = self.entries.get((dimension, keys[dimension]))
+                if expires is not None and expires > now:
+                    return dimension, keys[dimension], expires
+        return None
+
+    def _update(self, now, change):
+        # Read-modify-write of one small key; a lost concurrent update is redone on the next hit
+        entries = self._shared(now)
+        change(entries)
+        if len(entries) > settings.HEAVY_HITTER_DENY_MAX:
+            keep = sorted(entries, key=entries.get, reverse=True)[:settings.HEAVY_HITTER_DENY_MAX]
+            entries = {key: entries[key] for key in keep}
+        cache.set(DENY_LIST_KEY, entries, timeout=settings.HEAVY_HITTER_DENY_SECONDS)
+        with self.lock:
+            self.entries = entries
+            self.synced_at = now
+
+    def deny(self, dimension, value, seconds=None, now=None):
+        now = time.time() if now is None else now
+        expires = now + (seconds or settings.HEAVY_HITTER_DENY_SECONDS)
+        with self.lock:
+            self.entries[(dimension, value)] = expires
+        self._update(now, lambda entries: entries.__setitem__((dimension, value), expires))
+        return expires
+
+    def allow(self, dimension, value, now=None):
+        now = time.time() if now is None else now
+        self._update(now, lambda entries: entries.pop((dimension, value), None))
+
+    def as_list(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self._sync(now)
+            entries = sorted(self.entries.items(), key=lambda item: item[1], reverse=True)
+        return [
+            {'kind': dimension, 'value': value, 'expires_in': int(expires - now)}
+            for (dimension, value), expires in entries if expires > now
+        ]
+
+
+_tracker = None
+_deny_list = DenyList()
+_lock = threading.Lock()
+
+
+def tracker():
+    """The process-wide HeavyHitterTracker"""
+    global _tracker
+    if _tracker is None:
+        with _lock:
+            if _tracker is None:
+                _tracker = HeavyHitterTracker(settings.HEAVY_HITTER_CAPACITY, settings.HEAVY_HITTER_WINDOW)
+    return _tracker
+
+
+def deny_list():
+    return _deny_list
+
+
+def check(request, now=None):
+    """Count a request to a watched endpoint; returns the denied (dimension, value, expires) or None"""
+    now = time.time() if now is None else now
+    keys = request_keys(request)
+    denied = _deny_list.match(keys, now)
+    if denied is not None:
+        return denied
+
+    counts = tracker().record(keys, now)
+    for dimension in DIMENSIONS:
+        threshold = settings.HEAVY_HITTER_THRESHOLDS.get(dimension)
+        if threshold and counts[dimension] >= threshold:
+            expires = _deny_list.deny(dimension, keys[dimension], now=now)
+            return dimension, keys[dimension], expires
+    return None
+
+
+def report(n=20):
+    """Top talkers of this worker and the shared deny-list, for the admin view"""
+    return {
+        'worker': os.getpid(),
+        'window_seconds': settings.HEAVY_HITTER_WINDOW,
+        'thresholds': settings.HEAVY_HITTER_THRESHOLDS,
+        'windows': tracker().top(n),
+        'denied': _deny_list.as_list(),
+    }
+
+
+def reset():
+    """Drop this worker's counters and local deny-list copy (tests, or after changing settings)"""
+    global _tracker, _deny_list
+    with _lock:
+        _tracker = None
+        _deny_list = DenyList()
@@ -0,0 +1,116 @@
+"""
+In-process cache of open file descriptors for frequently downloaded files.
+
+The media kit and paid guide PDFs are a handful of small files requested over
+and over. Instead of ``os.path.exists`` plus a fresh ``open()`` per request,
+each worker keeps one read-only descriptor per file and validates it with a
+single ``os.stat``; a changed mtime, size or inode (e.g. the PDF was replaced)
+reopens it.
+
+Responses wrap the shared descriptor in a stream that reads with ``os.pread``
+and never moves the descriptor's file position, so any number of concurrent
+responses can share it. Its ``fileno()`` lets gunicorn hand the response to
+``wsgi.file_wrapper``, which sends it with ``socket.sendfile`` (zero-copy
+``os.sendfile`` on Linux, at explicit offsets) when the connection is not TLS.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.http import FileResponse
+
+
+MAX_HOT_FILES = 32
+READ_BLOCK_SIZE = 64 * 1024
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class HotFile:
+    """An open descriptor for one file plus the stat signature it was opened at"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        st = os.fstat(self.file.fileno())
+        self.signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        self.size = st.st_size
+
+    def stream(self):
+        return HotFileStream(self)
+
+
+class HotFileStream:
+    """Read-only view of a HotFile with its own position.
+
+    ``close()`` only drops the reference; the descriptor stays open in the
+    cache and is closed by garbage collection once it has been replaced and
+    no response uses it any more.
+    """
+
+    def __init__(self, hot_file):
+        self.hot_file = hot_file
+        self.name = hot_file.path
+        self.position = 0
+
+    def fileno(self):
+        if self.hot_file is None:
+            raise ValueError('I/O operation on closed file')
+        return self.hot_file.file.fileno()
+
+    def read(self, size=-1):
+        if self.hot_file is None:
+            raise ValueError('I/O operation on closed file')
+        remaining = self.hot_file.size - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        data = os.pread(self.fileno(), size, self.position)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.hot_file = None
+
+
+def get(path):
+    """Return the cached HotFile for ``path``, reopening it if the file changed.
+
+    Raises FileNotFoundError (or another OSError) if the file cannot be read.
+    """
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    hot_file = _cache.get(path)
+    if hot_file is not None and hot_file.signature == signature:
+        return hot_file
+
+    hot_file = HotFile(path)
+    with _lock:
+        _cache.pop(path, None)
+        while len(_cache) >= MAX_HOT_FILES:
+            # Evict the least recently (re)opened file
+            _cache.pop(next(iter(_cache)))
+        _cache[path] = hot_file
+    return hot_file
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def file_response(path, content_type):
+    """FileResponse for ``path`` served from the hot-file cache when it is enabled"""
+    if not settings.MEDIA_HOT_FILES:
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    hot_file = get(path)
+    response = FileResponse(hot_file.stream(), content_type=content_type)
+    # Fewer, larger reads when the server cannot use sendfile (TLS in gunicorn, runserver)
+    response.block_size = READ_BLOCK_SIZE
+    response['Content-Length'] = str(hot_file.size)
+    return response
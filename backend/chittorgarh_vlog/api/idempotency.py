@@ -0,0 +1,206 @@
+"""
+Idempotency-Key support for the endpoints clients retry on flaky networks.
+
+A client sends ``Idempotency-Key: <unique value>`` with a request and the
+same header with every retry of it. The first request with a key inserts an
+IdempotencyRecord, which claims the key through its unique constraint, and
+runs the view. Its response is then stored on the record for
+``IDEMPOTENCY_TTL_HOURS``. Retries are answered from that record, one
+indexed lookup, without running the view again: no second booking, upload
+or gateway order.
+
+The record also keeps a digest of the first request: method, path, user
+and parsed fields (files by name and size; multipart boundaries differ
+between retries). A request that reuses the key for anything else gets 422
+instead of someone else's response. Keys are also scoped to the client
+that sent them (its user, or its IP for anonymous requests), so one client
+can never be replayed another client's response. Retries of create_booking
+uploads too large to buffer (above ``UPLOAD_TICKET_THRESHOLD``) are
+replayed by UploadAdmissionMiddleware before their body is read, so there
+only the Content-Length is compared; smaller requests, and a retry of
+another size, go through the view, which checks the full digest.
+
+A retry that arrives while the first request is still running waits up to
+``IDEMPOTENCY_WAIT_SECONDS`` for its response, then gets 409 with
+``Retry-After``. Server errors and rate-limit responses are not stored, so
+retrying those runs the request again. A claim whose request died without
+answering is taken over after ``IDEMPOTENCY_IN_FLIGHT_TIMEOUT`` seconds.
+
+    @api_view(['POST'])
+    @idempotent('create_order')
+    def create_order(request): ...
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+from .ratelimit import trusted_client_ip
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def request_key(request):
+    """The request's Idempotency-Key, or '' if it sent none"""
+    return request.META.get(HEADER, '').strip()
+
+
+def request_size(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+def client_identity(request):
+    """Who a request's key belongs to: its user, else the client IP"""
+    # UploadAdmissionMiddleware runs before authentication and has no user yet
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{trusted_client_ip(request)}'
+
+
+def _field(value):
+    # Uploaded files, including StoredVideoUpload, which has no read()
+    if hasattr(value, 'name') and hasattr(value, 'size'):
+        return [value.name, value.size]
+    return value
+
+
+def fingerprint(request):
+    """Digest of what a DRF request asks for, to tell a retry from another request reusing its key"""
+    user = request.user.pk if request.user.is_authenticated else None
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = sorted((name, [_field(value) for value in values]) for name, values in data.lists())
+    payload = json.dumps([request.method, request.path, user, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _mismatch():
+    return JsonResponse({'error': 'This Idempotency-Key was already used for a different request'}, status=422)
+
+
+def _replay(record):
+    response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _is_stale(record, now):
+    if record.expires_at <= now:
+        return True
+    in_flight_for = (now - record.created_at).total_seconds()
+    return record.status == 'in_progress' and in_flight_for > settings.IDEMPOTENCY_IN_FLIGHT_TIMEOUT
+
+
+def replay(scope, key, client, size):
+    """Stored response for a client's completed key whose request had ``size`` bytes, or None"""
+    record = IdempotencyRecord.objects.filter(
+        scope=scope, key=key, client=client, status='completed', expires_at__gt=timezone.now()
+    ).first()
+    if record is None or record.request_size not in (None, size):
+        return None
+    return _replay(record)
+
+
+def claim(scope, key, request):
+    """Claim a key for a new request.
+
+    Returns (record, None) when this request should run, or (None, response)
+    with the replayed response, a 422 if the key belongs to a different
+    request, or a 409 if the first request is still running.
+    """
+    client = client_identity(request)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    scope=scope, key=key, client=client, expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+                )
+            return record, None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyRecord.objects.filter(scope=scope, key=key, client=client).first()
+        if existing is None:
+            continue
+        if _is_stale(existing, now):
+            # Only the request that removes this exact record gets to retry the claim
+            IdempotencyRecord.objects.filter(
+                pk=existing.pk, status=existing.status, created_at=existing.created_at
+            ).delete()
+            continue
+        if existing.status == 'completed':
+            if existing.request_hash and existing.request_hash != fingerprint(request):
+                return None, _mismatch()
+            return None, _replay(existing)
+
+        if time.monotonic() >= deadline:
+            response = JsonResponse(
+                {'error': 'A request with this Idempotency-Key is still being processed'}, status=409
+            )
+            response['Retry-After'] = str(max(1, int(settings.IDEMPOTENCY_WAIT_SECONDS)))
+            return None, response
+        time.sleep(POLL_INTERVAL)
+
+
+def complete(record, response, request):
+    """Store a response for replay, or release the key if it should not be replayed"""
+    storable = (
+        isinstance(response, Response)
+        and response.status_code < 500
+        and response.status_code != 429
+    )
+    if not storable:
+        IdempotencyRecord.objects.filter(pk=record.pk, status='in_progress').delete()
+        return
+    IdempotencyRecord.objects.filter(pk=record.pk).update(
+        status='completed', response_status=response.status_code, response_body=response.data,
+        request_hash=fingerprint(request), request_size=request_size(request),
+    )
+
+
+def idempotent(scope):
+    """Make a DRF view replay its first response to requests reusing an Idempotency-Key"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request_key(request)
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'}, status=400)
+
+            record, response = claim(scope, key, request)
+            if response is not None:
+                return response
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                IdempotencyRecord.objects.filter(pk=record.pk, status='in_progress').delete()
+                raise
+            complete(record, response, request)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired():
+    """Delete records past their TTL; returns how many were removed"""
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
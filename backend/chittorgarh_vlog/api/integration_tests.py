@@ -81,7 +81,7 @@ class APIIntegrationTest(TestCase):
         # Create a mock video file
         mock_video = SimpleUploadedFile(
             name="test_video.mp4",
-            content=b"fake video content",
+            content=b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom' + b"fake video content",
             content_type="video/mp4"
         )
         
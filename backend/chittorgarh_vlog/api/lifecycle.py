@@ -0,0 +1,285 @@
+"""
+Lifecycle management for stored booking videos.
+
+Nothing else ever deletes a booking's video, so without this the video
+volume only grows. One pass (``run()``, the ``prune_videos`` command, or a
+background task queued by the throttled ``maybe_run()`` hook) does, in order:
+
+1. Cleanup: expired upload sessions lose their partial file (or their
+   un-finalized object in direct mode), unreferenced stored videos past a
+   grace period are deleted, and stale scratch files are removed.
+2. Retention: videos of bookings older than their status's retention period
+   (``VIDEO_RETENTION_DAYS``) are purged. ``None`` keeps them indefinitely.
+   By default, paid bookings that are not completed yet are never touched.
+3. High-water mark: if the media volume (local storage) is fuller than
+   ``VIDEO_STORAGE_HIGH_WATER``, or the stored videos use that fraction of
+   ``VIDEO_STORAGE_QUOTA_BYTES``, videos of bookings in
+   ``VIDEO_EVICTABLE_STATUSES`` are purged oldest booking first until usage
+   is back under ``VIDEO_STORAGE_LOW_WATER``.
+
+Purging clears ``Booking.video_file`` and records ``video_purged_at`` and
+``video_purge_reason``. The file itself goes through the video store, so a
+video shared with other bookings stays until its last reference is gone.
+"""
+import logging
+import os
+import shutil
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from . import tasks, uploads, video_store
+from .models import Booking, StoredVideo, UploadSession
+from .storage import local_path
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'video_lifecycle_last_run'
+
+
+class LifecycleReport:
+    """What one pass removed, or would remove with ``dry_run``"""
+
+    def __init__(self):
+        self.expired_sessions = 0
+        self.orphaned_videos = 0
+        self.scratch_files = 0
+        self.retention_purged = []
+        self.pressure_purged = []
+        self.bytes_freed = 0
+
+    def as_dict(self):
+        return {
+            'expired_sessions': self.expired_sessions,
+            'orphaned_videos': self.orphaned_videos,
+            'scratch_files': self.scratch_files,
+            'retention_purged': len(self.retention_purged),
+            'pressure_purged': len(self.pressure_purged),
+            'bytes_freed': self.bytes_freed,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Cleanup
+# ---------------------------------------------------------------------------
+
+def expire_upload_sessions(now, dry_run=False):
+    """Abort active sessions past their expiry and drop what they had uploaded"""
+    # Including sessions whose finalize died with its worker
+    open_sessions = Q(status='active') | Q(status='finalizing', updated_at__lt=now - uploads.FINALIZE_TIMEOUT)
+    expired = UploadSession.objects.filter(open_sessions, expires_at__lte=now)
+    count = 0
+    for session in expired:
+        count += 1
+        if dry_run:
+            continue
+        claimed = UploadSession.objects.filter(open_sessions, pk=session.pk).update(
+            status='aborted', updated_at=now
+        )
+        if not claimed:
+            continue
+        if session.mode == 'direct':
+            # The object may still become a stored video through another session
+            if not uploads.object_in_use(session):
+                video_store.video_storage().delete(session.object_name)
+        else:
+            try:
+                os.remove(uploads.partial_path(session))
+            except FileNotFoundError:
+                pass
+    return count
+
+
+def collect_orphaned_videos(now, dry_run=False):
+    """Delete stored videos no booking references, once past the grace period.
+
+    A video is briefly unreferenced between being stored and attached, so
+    only ones untouched for ``VIDEO_ORPHAN_GRACE_HOURS`` are removed.
+    Returns (count, bytes freed).
+    """
+    cutoff = now - timedelta(hours=settings.VIDEO_ORPHAN_GRACE_HOURS)
+    count, freed = 0, 0
+    for blob in StoredVideo.objects.filter(ref_count=0, last_referenced_at__lt=cutoff):
+        if dry_run:
+            count, freed = count + 1, freed + blob.size
+            continue
+        with transaction.atomic():
+            locked = StoredVideo.objects.select_for_update().filter(pk=blob.pk, ref_count=0).first()
+            if locked is None or locked.bookings.exists():
+                continue
+            name = locked.file.name
+            locked.delete()
+            transaction.on_commit(lambda name=name: video_store.video_storage().delete(name))
+        count, freed = count + 1, freed + blob.size
+    return count, freed
+
+
+def remove_stale_scratch_files(now, dry_run=False):
+    """Remove incoming upload files left behind by interrupted requests"""
+    directory = video_store.scratch_path(video_store.INCOMING_DIR)
+    cutoff = (now - timedelta(hours=settings.VIDEO_ORPHAN_GRACE_HOURS)).timestamp()
+    count = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            count += 1
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Purging booking videos
+# ---------------------------------------------------------------------------
+
+def _reclaimable_bytes(booking, remaining_refs):
+    """Bytes purging this booking's video frees, given references already dropped this pass"""
+    blob = booking.stored_video
+    if blob is None:
+        try:
+            return video_store.video_storage().size(booking.video_file.name)
+        except (FileNotFoundError, OSError):
+            return 0
+    refs = remaining_refs.setdefault(blob.pk, blob.ref_count)
+    remaining_refs[blob.pk] = refs - 1
+    return blob.size if refs <= 1 else 0
+
+
+def purge_video(booking, reason, now=None):
+    """Remove a booking's video and record why; returns False if it had none left"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        locked = Booking.objects.select_for_update().filter(pk=booking.pk).first()
+        if locked is None or not locked.video_file:
+            return False
+        blob_id = locked.stored_video_id
+        name = locked.video_file.name
+        Booking.objects.filter(pk=locked.pk).update(
+            video_file=None, stored_video=None, video_purged_at=now, video_purge_reason=reason
+        )
+        if blob_id:
+            video_store.release(blob_id)
+        elif not Booking.objects.filter(video_file=name).exists():
+            # Video stored before deduplication, owned by this booking alone
+            transaction.on_commit(lambda: video_store.video_storage().delete(name))
+
+    booking.video_file = None
+    booking.stored_video = None
+    booking.video_purged_at = now
+    booking.video_purge_reason = reason
+    logger.info(f"Purged video of booking {booking.booking_id} ({reason})")
+    return True
+
+
+def _with_video():
+    return Booking.objects.exclude(video_file='').exclude(video_file__isnull=True).select_related('stored_video')
+
+
+def apply_retention(now, report, dry_run=False):
+    remaining_refs = {}
+    for booking_status, days in settings.VIDEO_RETENTION_DAYS.items():
+        if days is None:
+            continue
+        expired = _with_video().filter(status=booking_status, created_at__lt=now - timedelta(days=days))
+        for booking in expired.order_by('created_at'):
+            freed = _reclaimable_bytes(booking, remaining_refs)
+            if dry_run or purge_video(booking, 'retention', now):
+                report.retention_purged.append(booking.booking_id)
+                report.bytes_freed += freed
+
+
+def storage_usage():
+    """(used, capacity) pairs the high-water mark applies to"""
+    usage = []
+    root = local_path(video_store.video_storage(), '')
+    if root is not None and os.path.isdir(root):
+        disk = shutil.disk_usage(root)
+        usage.append((disk.used, disk.total))
+    quota = settings.VIDEO_STORAGE_QUOTA_BYTES
+    if quota:
+        stored = StoredVideo.objects.aggregate(total=Sum('size'))['total'] or 0
+        usage.append((stored, quota))
+    return usage
+
+
+def bytes_over_high_water(usage=None):
+    """Bytes to free to get from above the high-water mark down to the low-water mark"""
+    needed = 0
+    for used, capacity in (storage_usage() if usage is None else usage):
+        if capacity and used > capacity * settings.VIDEO_STORAGE_HIGH_WATER:
+            needed = max(needed, int(used - capacity * settings.VIDEO_STORAGE_LOW_WATER))
+    return needed
+
+
+def relieve_storage_pressure(now, report, dry_run=False, needed=None):
+    """Purge the oldest evictable videos until ``needed`` bytes are freed"""
+    needed = bytes_over_high_water() if needed is None else needed
+    if needed <= 0:
+        return
+    min_age = now - timedelta(hours=settings.VIDEO_EVICTION_MIN_AGE_HOURS)
+    candidates = _with_video().filter(
+        status__in=settings.VIDEO_EVICTABLE_STATUSES, created_at__lt=min_age
+    ).exclude(booking_id__in=report.retention_purged).order_by('created_at')
+
+    freed, remaining_refs = 0, {}
+    for booking in candidates.iterator():
+        if freed >= needed:
+            break
+        reclaimable = _reclaimable_bytes(booking, remaining_refs)
+        if dry_run or purge_video(booking, 'disk_pressure', now):
+            report.pressure_purged.append(booking.booking_id)
+            freed += reclaimable
+    report.bytes_freed += freed
+    if freed < needed:
+        logger.warning(
+            f"Video storage above high-water mark: freed {freed} of {needed} bytes, nothing else is evictable"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Entry points
+# ---------------------------------------------------------------------------
+
+def run(now=None, dry_run=False):
+    """Run one full lifecycle pass and return its LifecycleReport"""
+    now = now or timezone.now()
+    report = LifecycleReport()
+    report.expired_sessions = expire_upload_sessions(now, dry_run)
+    report.orphaned_videos, freed = collect_orphaned_videos(now, dry_run)
+    report.bytes_freed += freed
+    report.scratch_files = remove_stale_scratch_files(now, dry_run)
+    apply_retention(now, report, dry_run)
+    relieve_storage_pressure(now, report, dry_run)
+    return report
+
+
+@tasks.task(max_attempts=1)
+def run_pass():
+    """One pass in the background worker; the next upload queues another if this one fails"""
+    report = run()
+    logger.info(f"Video lifecycle pass: {report.as_dict()}")
+
+
+def maybe_run():
+    """Queue a pass if none was queued in the last ``VIDEO_LIFECYCLE_INTERVAL`` seconds.
+
+    Called after new videos are stored, so storage is kept bounded even
+    without a scheduled ``prune_videos``. Returns the queued Task or None.
+    """
+    if not settings.VIDEO_LIFECYCLE_INTERVAL:
+        return None
+    if not cache.add(LOCK_KEY, time.time(), timeout=settings.VIDEO_LIFECYCLE_INTERVAL):
+        return None
+    return tasks.enqueue(run_pass, unique_key='lifecycle.run_pass')
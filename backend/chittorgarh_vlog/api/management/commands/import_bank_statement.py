@@ -0,0 +1,46 @@
+"""
+Verify manual payments against a bank / UPI statement export (see api/statements.py).
+
+    python manage.py import_bank_statement statement.csv
+    python manage.py import_bank_statement may.csv june.csv --dry-run
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from api import statements
+
+
+class Command(BaseCommand):
+    help = 'Match manual payment transaction IDs against bank statement CSVs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='statement.csv')
+        parser.add_argument('--dry-run', action='store_true', help='Report matches without recording them')
+        parser.add_argument('--batch-size', type=int, default=statements.BATCH_SIZE)
+        parser.add_argument('--encoding', default='utf-8-sig')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        for path in options['paths']:
+            try:
+                with open(path, newline='', encoding=options['encoding']) as lines:
+                    report = statements.verify(lines, dry_run=dry_run, batch_size=options['batch_size'])
+            except (OSError, UnicodeDecodeError, statements.StatementError) as e:
+                raise CommandError(f'{path}: {e}')
+
+            verb = 'Would verify' if dry_run else 'Verified'
+            for label, txn_id in report.verified:
+                self.stdout.write(f'{verb} {label} ({txn_id})')
+            for label, txn_id, expected, amount in report.amount_mismatches:
+                self.stdout.write(self.style.WARNING(
+                    f'Amount mismatch for {label} ({txn_id}): statement has ₹{amount}, expected ₹{expected}'
+                ))
+            for label, txn_id in report.duplicates:
+                self.stdout.write(self.style.WARNING(f'{label} claims {txn_id}, already used by another payment'))
+
+            summary = report.as_dict()
+            self.stdout.write(self.style.SUCCESS(
+                f"{path}: {summary['credits']} credits, {verb.lower()} {summary['verified']} manual payments, "
+                f"{summary['amount_mismatches']} amount mismatches, {summary['duplicates']} duplicates, "
+                f"{summary['unclaimed_credits']} credits without a claim, "
+                f"{summary['outstanding']} manual payments still unverified"
+            ))
@@ -0,0 +1,29 @@
+"""
+Process stored Razorpay webhook events (see api/webhooks.py).
+
+    python manage.py process_webhooks            # drain the inbox once, e.g. every minute from cron
+    python manage.py process_webhooks --watch 5  # keep draining, polling every 5 seconds
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import webhooks
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Razorpay webhook events in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--watch', type=float, metavar='SECONDS', default=None,
+                            help='Keep running, polling for new events at this interval')
+
+    def handle(self, *args, **options):
+        while True:
+            handled = webhooks.process_pending(options['batch_size'])
+            if handled or options['watch'] is None:
+                self.stdout.write(f'Processed {handled} webhook events')
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
@@ -0,0 +1,31 @@
+"""
+Apply the stored-video lifecycle rules (see api/lifecycle.py).
+
+    python manage.py prune_videos            # e.g. hourly from cron
+    python manage.py prune_videos --dry-run  # list what would be removed
+"""
+from django.core.management.base import BaseCommand
+
+from api import lifecycle
+
+
+class Command(BaseCommand):
+    help = 'Expire upload leftovers, purge videos past retention and enforce the storage high-water mark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without removing it')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        report = lifecycle.run(dry_run=dry_run)
+
+        verb = 'Would remove' if dry_run else 'Removed'
+        for label, booking_ids in (('retention', report.retention_purged), ('high-water mark', report.pressure_purged)):
+            for booking_id in booking_ids:
+                self.stdout.write(f'{verb} video of {booking_id} ({label})')
+        summary = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['retention_purged']} expired and {summary['pressure_purged']} evicted videos, "
+            f"{summary['orphaned_videos']} unreferenced videos, {summary['expired_sessions']} expired upload sessions "
+            f"and {summary['scratch_files']} scratch files ({summary['bytes_freed'] / (1024 * 1024):.1f} MB)"
+        ))
@@ -0,0 +1,16 @@
+"""
+Delete Idempotency-Key records past their TTL (see api/idempotency.py).
+
+    python manage.py purge_idempotency_keys  # e.g. daily from cron
+"""
+from django.core.management.base import BaseCommand
+
+from api import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency records'))
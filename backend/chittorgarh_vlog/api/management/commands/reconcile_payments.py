@@ -0,0 +1,72 @@
+"""
+Reconcile Razorpay payments with local bookings and PDF purchases (see api/reconcile.py).
+
+    python manage.py reconcile_payments                     # the last day, e.g. nightly from cron
+    python manage.py reconcile_payments --days 31 --dry-run # what a month's pass would fix
+    python manage.py reconcile_payments --since 2024-05-01 --until 2024-06-01
+"""
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import reconcile
+from api.gateway import GatewayUnavailable
+
+
+def _datetime(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date: {value} (use YYYY-MM-DD or an ISO timestamp)')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = 'Mark pending bookings and PDF purchases paid when Razorpay captured their payment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Start of the window (default: --days before --until)')
+        parser.add_argument('--until', help='End of the window (default: now)')
+        parser.add_argument('--days', type=float, default=1, help='Window length when --since is not given')
+        parser.add_argument('--page-size', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Report mismatches without fixing them')
+        parser.add_argument('--no-email', action='store_true', help="Don't send confirmation emails for fixed bookings")
+
+    def handle(self, *args, **options):
+        until = _datetime(options['until']) if options['until'] else timezone.now()
+        since = _datetime(options['since']) if options['since'] else until - timedelta(days=options['days'])
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        dry_run = options['dry_run']
+        started = time.monotonic()
+        try:
+            report = reconcile.reconcile(
+                since, until, dry_run=dry_run, notify=not options['no_email'], page_size=options['page_size']
+            )
+        except GatewayUnavailable as e:
+            raise CommandError(e.message)
+        elapsed = time.monotonic() - started
+
+        verb = 'Would mark' if dry_run else 'Marked'
+        for booking_id in report.fixed_bookings:
+            self.stdout.write(f'{verb} booking {booking_id} paid')
+        for purchase_id in report.fixed_purchases:
+            self.stdout.write(f'{verb} PDF purchase {purchase_id} paid')
+        for payment_id, order_id, expected, amount in report.amount_mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'Amount mismatch on {order_id}: payment {payment_id} is {amount} paise, expected {expected}'
+            ))
+        for payment_id in report.unmatched:
+            self.stdout.write(f'No booking or PDF purchase for payment {payment_id}')
+
+        summary = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {summary['payments']} payments ({summary['captured']} captured, {summary['pages']} pages) "
+            f"in {elapsed:.1f}s: {summary['already_recorded']} already recorded, "
+            f"{verb.lower()} {summary['fixed_bookings']} bookings and {summary['fixed_purchases']} PDF purchases paid, "
+            f"{summary['amount_mismatches']} amount mismatches, {summary['unmatched']} unmatched, "
+            f"{summary['still_pending']} bookings still unpaid"
+        ))
@@ -0,0 +1,55 @@
+"""
+Run queued background tasks (see api/tasks.py).
+
+    python manage.py run_tasks            # keep running, polling every second
+    python manage.py run_tasks --once     # run what is due and exit, e.g. from cron
+
+Start as many workers as needed; they never run the same task twice at once.
+"""
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import tasks
+
+
+# How often a running worker requeues lost tasks and deletes old ones, in seconds
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll', type=float, metavar='SECONDS', default=1.0,
+                            help='How long to sleep when no task is due')
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Finish the current task on SIGTERM (deploys) instead of abandoning it to the lease
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        worker = tasks.worker_name()
+        maintained_at = 0
+        while not self.stopping:
+            if time.monotonic() - maintained_at >= MAINTENANCE_INTERVAL:
+                requeued = tasks.requeue_stale()
+                purged = tasks.purge_finished()
+                if requeued or purged:
+                    self.stdout.write(f'Requeued {requeued} stale tasks, purged {purged} finished tasks')
+                maintained_at = time.monotonic()
+
+            ran = tasks.run_pending(options['batch_size'], worker, max_batches=1)
+            if ran:
+                self.stdout.write(f'Ran {ran} tasks')
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll'])
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,245 @@
+"""
+Serving of user-uploaded media with HTTP range and conditional request support.
+
+Replaces ``django.views.static.serve`` for ``/media/`` so players can seek
+inside a video and interrupted downloads resume where they stopped instead
+of restarting from byte zero:
+
+* ``Range`` requests get 206 responses, with ``multipart/byteranges`` for
+  several ranges and 416 for unsatisfiable ones.
+* ``If-None-Match`` / ``If-Modified-Since`` get 304, and ``If-Range`` is honoured.
+* Videos in the content-addressed store get a strong ETag from the digest of
+  their stored bytes; other files get a weak ETag from mtime and size.
+
+With ``MEDIA_OFFLOAD_MODE`` set, file views only authorize the request and
+hand the transfer to the front proxy (``X-Accel-Redirect`` for nginx,
+``X-Sendfile`` for Apache/lighttpd), which then serves ranges and
+conditional requests itself without holding a Python worker.
+
+When media lives in a remote storage (``MEDIA_STORAGE=s3``) these views
+redirect to a short-lived presigned URL instead, and the bucket serves the
+bytes, ranges included.
+"""
+import mimetypes
+import os
+import posixpath
+import secrets
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from . import hotfiles
+from .models import StoredVideo
+from .storage import local_path
+from .uploads import PARTIAL_UPLOAD_DIR
+from .video_store import BLOB_DIR, INCOMING_DIR
+
+
+COPY_BUFFER_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+# Work-in-progress upload files are never served
+PRIVATE_PREFIXES = (f'{PARTIAL_UPLOAD_DIR}/', f'{INCOMING_DIR}/')
+
+
+def offload_response(full_path, content_type):
+    """Response that asks the front proxy to send ``full_path``, or None when offloading is off"""
+    mode = settings.MEDIA_OFFLOAD_MODE
+    if not mode:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if mode == 'nginx':
+        name = os.path.relpath(full_path, settings.MEDIA_ROOT)
+        if name.startswith(os.pardir):
+            raise ValueError(f'{full_path} is outside MEDIA_ROOT and cannot be offloaded')
+        prefix = settings.MEDIA_OFFLOAD_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f'{prefix}/{name.replace(os.sep, "/")}')
+    elif mode == 'sendfile':
+        response['X-Sendfile'] = full_path
+    else:
+        raise ValueError(f'Unknown MEDIA_OFFLOAD_MODE {mode!r}')
+    return response
+
+
+def media_url(name):
+    """URL of a stored file on this site's /media/ route, which works for every storage backend"""
+    return settings.MEDIA_URL + filepath_to_uri(name)
+
+
+def file_response(name, content_type, filename=None):
+    """Send a whole stored file as a download.
+
+    Local files go through the front proxy when offloading is enabled and
+    through the hot-file cache otherwise; remote files are a redirect to a
+    presigned URL. Raises FileNotFoundError if the file does not exist.
+    """
+    full_path = local_path(default_storage, name)
+    if full_path is None:
+        if not default_storage.exists(name):
+            raise FileNotFoundError(name)
+        parameters = {'response-content-type': content_type}
+        if filename:
+            parameters['response-content-disposition'] = f'attachment; filename="{filename}"'
+        return HttpResponseRedirect(
+            default_storage.url(name, expire=settings.MEDIA_DOWNLOAD_URL_EXPIRY, parameters=parameters)
+        )
+
+    response = offload_response(full_path, content_type)
+    if response is None:
+        response = hotfiles.file_response(full_path, content_type)
+    elif not os.path.isfile(full_path):
+        raise FileNotFoundError(full_path)
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def parse_range_header(header, size):
+    """Parse a ``Range`` header into a list of inclusive (start, end) pairs.
+
+    Returns None when the header should be ignored (missing, malformed, not
+    bytes, or too many ranges) and [] when no range is satisfiable.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # Suffix range: the last N bytes
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(0, size - length), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else None
+        except ValueError:
+            return None
+        if end is not None and start > end:
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+
+def _iter_file_range(path, start, end):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = fh.read(min(COPY_BUFFER_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
+def _iter_multipart(path, ranges, parts, boundary):
+    for (start, end), part_header in zip(ranges, parts):
+        yield part_header
+        yield from _iter_file_range(path, start, end)
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def media_etag(name, st):
+    """Strong ETag for stored videos, weak mtime/size ETag for anything else"""
+    if name.startswith(f'{BLOB_DIR}/'):
+        digest = posixpath.splitext(posixpath.basename(name))[0]
+        content_sha256 = StoredVideo.objects.filter(sha256=digest).values_list('content_sha256', flat=True).first()
+        if content_sha256:
+            return f'"{content_sha256}"'
+    return f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only a strong validator may be used with If-Range
+        return not etag.startswith('W/') and if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(last_modified) <= if_range_date
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a stored file with Range and conditional GET support"""
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith(PRIVATE_PREFIXES) or name.split('/')[0] in ('.', '..'):
+        raise Http404('File not found')
+    try:
+        full_path = local_path(default_storage, name)
+        if full_path is None:
+            return HttpResponseRedirect(default_storage.url(name, expire=settings.MEDIA_DOWNLOAD_URL_EXPIRY))
+        st = os.stat(full_path)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404('File not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('File not found')
+
+    response = offload_response(full_path, mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+    if response is not None:
+        return response
+
+    etag = media_etag(name, st)
+    last_modified = st.st_mtime
+    size = st.st_size
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        ranges = None
+        if _if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+        if ranges is None:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(_iter_file_range(full_path, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            boundary = secrets.token_hex(16)
+            parts = [
+                (
+                    f'\r\n--{boundary}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+                ).encode()
+                for start, end in ranges
+            ]
+            length = sum(len(p) for p in parts) + sum(end - start + 1 for start, end in ranges)
+            length += len(f'\r\n--{boundary}--\r\n')
+            response = StreamingHttpResponse(
+                _iter_multipart(full_path, ranges, parts, boundary),
+                status=206,
+                content_type=f'multipart/byteranges; boundary={boundary}',
+            )
+            response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
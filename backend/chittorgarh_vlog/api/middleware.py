@@ -0,0 +1,172 @@
+"""
+Middleware for the booking API.
+"""
+import math
+import time
+
+from django.http import JsonResponse
+from django.conf import settings
+from django.urls import Resolver404, resolve, reverse
+
+from . import admission, heavyhitters, idempotency
+from .tickets import TicketError, redeem_ticket, release_ticket
+from .upload_handlers import MULTIPART_OVERHEAD
+from .video import MAX_VIDEO_SIZE
+
+
+class UploadAdmissionMiddleware:
+    """Accept or refuse a create_booking upload from its headers alone.
+
+    Runs before anything reads the body, so an oversized request, or a large
+    one that did not pass the pre-flight check, is answered immediately
+    instead of after the whole video has been received. Small bodies (a
+    booking without a video) need no ticket.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = reverse('create_booking')
+        return self._path
+
+    def __call__(self, request):
+        if request.method == 'POST' and request.path_info == self.path:
+            replayed = self.replay(request)
+            if replayed is not None:
+                return replayed
+            rejection = self.check(request)
+            if rejection is not None:
+                return rejection
+        return self.get_response(request)
+
+    def replay(self, request):
+        """Answer a retry of an upload that already created its booking without reading the video.
+
+        Only bodies above UPLOAD_TICKET_THRESHOLD are matched on headers
+        alone; smaller ones reach the view, which compares the whole request.
+        """
+        key = idempotency.request_key(request)
+        size = idempotency.request_size(request)
+        if not key or size <= settings.UPLOAD_TICKET_THRESHOLD:
+            return None
+        return idempotency.replay('create_booking', key, idempotency.client_identity(request), size)
+
+    def check(self, request):
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid Content-Length header'}, status=400)
+
+        if content_length > MAX_VIDEO_SIZE + MULTIPART_OVERHEAD:
+            return JsonResponse({'error': 'Video file size too large. Maximum size is 500MB'}, status=413)
+        if content_length <= settings.UPLOAD_TICKET_THRESHOLD:
+            return None
+
+        ticket = request.META.get('HTTP_X_UPLOAD_TICKET') or request.GET.get('ticket')
+        if not ticket:
+            return JsonResponse(
+                {'error': 'Run the booking pre-flight check before uploading a video'}, status=428
+            )
+        try:
+            redeem_ticket(ticket, content_length)
+        except TicketError as e:
+            return JsonResponse({'error': e.message}, status=e.status_code)
+        # Handed back by UploadConcurrencyMiddleware if no upload slot is free
+        request.upload_ticket = ticket
+        return None
+
+
+class UploadConcurrencyMiddleware:
+    """Hold an upload slot (api/admission.py) for the whole of each upload request.
+
+    Applies to chunk PUTs and to create_booking requests large enough to
+    carry a video. Runs after UploadAdmissionMiddleware, so requests it
+    refuses never take a slot. Requests that get no slot are refused with 503
+    and ``Retry-After`` before their body is read, and their upload ticket
+    stays valid for the retry; all other requests pass straight through.
+    """
+
+    UPLOAD_VIEWS = {('POST', 'create_booking'), ('PUT', 'upload_chunk')}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_upload(self, request):
+        if request.method not in ('POST', 'PUT'):
+            return False
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return False
+        if (request.method, url_name) not in self.UPLOAD_VIEWS:
+            return False
+        if url_name == 'create_booking':
+            try:
+                return int(request.META.get('CONTENT_LENGTH') or 0) > settings.UPLOAD_TICKET_THRESHOLD
+            except ValueError:
+                return False
+        return True
+
+    def __call__(self, request):
+        if not self.is_upload(request):
+            return self.get_response(request)
+
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        slot = admission.acquire(content_length=content_length)
+        if slot is None:
+            if getattr(request, 'upload_ticket', None):
+                release_ticket(request.upload_ticket)
+            response = JsonResponse(
+                {'error': 'Too many uploads in progress. Please retry shortly.'}, status=503
+            )
+            response['Retry-After'] = str(settings.UPLOAD_RETRY_AFTER)
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            slot.release()
+
+
+class HeavyHitterMiddleware:
+    """Refuse requests to the public write endpoints from denied clients (api/heavyhitters.py).
+
+    Runs before any view, session or database work. Each request to a
+    watched endpoint is also counted, and a client that crosses a threshold
+    is denied from that request on.
+    """
+
+    WATCHED_VIEWS = {
+        ('POST', 'create_booking'),
+        ('POST', 'create_pdf_purchase'),
+        ('POST', 'track_mediakit_download'),
+    }
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_watched(self, request):
+        if request.method != 'POST':
+            return False
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return False
+        return (request.method, url_name) in self.WATCHED_VIEWS
+
+    def __call__(self, request):
+        if self.is_watched(request):
+            denied = heavyhitters.check(request)
+            if denied is not None:
+                response = JsonResponse(
+                    {'error': 'Too many requests from your network. Please try again later.'}, status=429
+                )
+                response['Retry-After'] = str(max(1, math.ceil(denied[2] - time.time())))
+                return response
+        return self.get_response(request)
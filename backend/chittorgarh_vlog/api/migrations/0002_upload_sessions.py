@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:03
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaKitDownload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('pdf_name', models.CharField(max_length=200)),
+                ('file_size_mb', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.CharField(blank=True, max_length=500)),
+                ('downloaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Media Kit Download',
+                'verbose_name_plural': 'Media Kit Downloads',
+                'ordering': ['-downloaded_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PDFPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('email', models.EmailField(max_length=254)),
+                ('phone', models.CharField(max_length=15)),
+                ('pdf_name', models.CharField(default='chittorgarh-guide.pdf', max_length=200)),
+                ('amount', models.IntegerField(default=9)),
+                ('razorpay_order_id', models.CharField(max_length=200, unique=True)),
+                ('razorpay_payment_id', models.CharField(blank=True, max_length=200, null=True)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('download_token', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('downloaded_at', models.DateTimeField(blank=True, null=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'PDF Purchase',
+                'verbose_name_plural': 'PDF Purchases',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='payment_method',
+            field=models.CharField(default='razorpay', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='transaction_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='contact',
+            field=models.CharField(max_length=15, validators=[api.models.validate_contact]),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='name',
+            field=models.CharField(max_length=100, validators=[api.models.validate_name]),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='video_file',
+            field=models.FileField(blank=True, null=True, upload_to='uploaded_videos/', validators=[api.models.validate_video_file]),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.CharField(editable=False, max_length=40, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('total_size', models.BigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('received_bytes', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('completed', 'Completed'), ('aborted', 'Aborted')], default='active', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('expires_at', models.DateTimeField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='api.booking')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_stored_videos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='video_bitrate',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Bits per second', null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='video_codec',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='video_duration',
+            field=models.FloatField(blank=True, help_text='Seconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='video_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='video_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_booking_video_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedvideo',
+            name='content_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
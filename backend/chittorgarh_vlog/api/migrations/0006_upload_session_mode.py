@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_stored_video_content_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='mode',
+            field=models.CharField(choices=[('chunked', 'Chunked'), ('direct', 'Direct to storage')], default='chunked', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='object_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_upload_session_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='video_purge_reason',
+            field=models.CharField(blank=True, choices=[('retention', 'Retention period ended'), ('disk_pressure', 'Storage high-water mark')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='video_purged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_booking_video_purge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='razorpay_order_amount',
+            field=models.PositiveIntegerField(blank=True, help_text='Paise', null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='razorpay_order_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='pdfpurchase',
+            name='order_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
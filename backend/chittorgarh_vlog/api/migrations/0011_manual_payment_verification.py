@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_razorpay_webhook_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='payment_verification',
+            field=models.CharField(blank=True, choices=[('unverified', 'Awaiting statement'), ('verified', 'Verified'), ('amount_mismatch', 'Amount mismatch'), ('duplicate', 'Transaction ID already used')], db_index=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='payment_verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pdfpurchase',
+            name='payment_verification',
+            field=models.CharField(blank=True, choices=[('unverified', 'Awaiting statement'), ('verified', 'Verified'), ('amount_mismatch', 'Amount mismatch'), ('duplicate', 'Transaction ID already used')], db_index=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='pdfpurchase',
+            name='payment_verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='pdfpurchase',
+            name='razorpay_payment_id',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_upload_session_finalizing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='request_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='request_size',
+            field=models.BigIntegerField(blank=True, help_text='Content-Length', null=True),
+        ),
+    ]
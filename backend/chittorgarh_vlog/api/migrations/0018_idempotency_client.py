@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_idempotency_request_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencyrecord',
+            name='unique_idempotency_key_per_scope',
+        ),
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='client',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencyrecord',
+            constraint=models.UniqueConstraint(fields=('scope', 'client', 'key'), name='unique_idempotency_key_per_client'),
+        ),
+    ]
@@ -2,19 +2,16 @@ from django.db import models
 import uuid
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from .video import video_file_error
 
 
 def validate_video_file(value):
     """Custom validator for video file uploads"""
     if value:
-        allowed_types = ['video/mp4', 'video/mpeg', 'video/quicktime', 'video/x-msvideo']
-        if value.content_type not in allowed_types:
-            raise ValidationError(f'Video file type not supported. Allowed types: {allowed_types}')
-
-        # Check file size (limit to 500MB)
-        max_size = 500 * 1024 * 1024  # 500MB
-        if value.size > max_size:
-            raise ValidationError('Video file size too large. Maximum size is 500MB')
+        error = video_file_error(value)
+        if error:
+            raise ValidationError(error)
 
 
 def validate_name(value):
@@ -30,6 +27,35 @@ def validate_contact(value):
         raise ValidationError('Contact number must be 10-15 digits')
 
 
+# Outcome of checking a manual (UPI/bank) payment against imported statements (see api/statements.py)
+PAYMENT_VERIFICATION_CHOICES = [
+    ('unverified', 'Awaiting statement'),
+    ('verified', 'Verified'),
+    ('amount_mismatch', 'Amount mismatch'),
+    ('duplicate', 'Transaction ID already used'),
+]
+
+
+class StoredVideo(models.Model):
+    """Content-addressed video file shared by every booking that uploaded the same bytes"""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='uploaded_videos/sha256/')
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100)
+    # Digest of the bytes on disk; differs from sha256 once the file is remuxed for faststart
+    content_sha256 = models.CharField(max_length=64, blank=True)
+
+    # Number of bookings whose video_file points at this file
+    ref_count = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_referenced_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+
 class Booking(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -37,17 +63,43 @@ class Booking(models.Model):
         ('completed', 'Completed'),
     ]
 
+    PURGE_REASON_CHOICES = [
+        ('retention', 'Retention period ended'),
+        ('disk_pressure', 'Storage high-water mark'),
+    ]
+
     booking_id = models.CharField(max_length=20, unique=True, editable=False)
     name = models.CharField(max_length=100, validators=[validate_name])
     email = models.EmailField()
     contact = models.CharField(max_length=15, validators=[validate_contact])
     # Store uploaded video file path (saved to local container)
     video_file = models.FileField(upload_to='uploaded_videos/', blank=True, null=True, validators=[validate_video_file])
+    # Deduplicated store entry backing video_file (see api/video_store.py)
+    stored_video = models.ForeignKey(
+        StoredVideo, on_delete=models.PROTECT, related_name='bookings', blank=True, null=True
+    )
+    # Video metadata probed at upload time (see api/pipeline.py)
+    video_duration = models.FloatField(blank=True, null=True, help_text='Seconds')
+    video_width = models.PositiveIntegerField(blank=True, null=True)
+    video_height = models.PositiveIntegerField(blank=True, null=True)
+    video_codec = models.CharField(max_length=20, blank=True)
+    video_bitrate = models.PositiveBigIntegerField(blank=True, null=True, help_text='Bits per second')
+    # Set when the lifecycle manager removed the video (see api/lifecycle.py)
+    video_purged_at = models.DateTimeField(blank=True, null=True)
+    video_purge_reason = models.CharField(max_length=20, choices=PURGE_REASON_CHOICES, blank=True)
     plan = models.CharField(max_length=50)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, default='razorpay')
-    transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    transaction_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    payment_verification = models.CharField(
+        max_length=20, choices=PAYMENT_VERIFICATION_CHOICES, blank=True, db_index=True
+    )
+    payment_verified_at = models.DateTimeField(blank=True, null=True)
+    # Open Razorpay order, reused by create_order until it expires or the amount changes
+    razorpay_order_id = models.CharField(max_length=100, blank=True, db_index=True)
+    razorpay_order_amount = models.PositiveIntegerField(blank=True, null=True, help_text='Paise')
+    razorpay_order_expires_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
@@ -59,6 +111,172 @@ class Booking(models.Model):
         return f"{self.name} - {self.booking_id}"
 
 
+class UploadSession(models.Model):
+    """Upload of a booking video, either chunked through the API or direct to storage"""
+
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        # A finalize request is hashing and attaching the video
+        ('finalizing', 'Finalizing'),
+        ('completed', 'Completed'),
+        ('aborted', 'Aborted'),
+    ]
+
+    MODE_CHOICES = [
+        ('chunked', 'Chunked'),
+        ('direct', 'Direct to storage'),
+    ]
+
+    upload_id = models.CharField(max_length=40, unique=True, editable=False)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='upload_sessions')
+
+    # Declared by the client when the session is opened
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+
+    # Contiguous number of bytes written to the partial file so far
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    # Optional SHA-256 announced by the client, verified on finalize
+    sha256 = models.CharField(max_length=64, blank=True)
+
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default='chunked')
+    # Direct uploads: storage name the client PUTs the video to
+    object_name = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def save(self, *args, **kwargs):
+        if not self.upload_id:
+            self.upload_id = f'UP-{uuid.uuid4().hex.upper()}'
+        super().save(*args, **kwargs)
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    @property
+    def next_chunk(self):
+        return self.received_bytes // self.chunk_size
+
+    def __str__(self):
+        return f"{self.upload_id} - {self.booking.booking_id} ({self.received_bytes}/{self.total_size})"
+
+
+class RazorpayWebhookEvent(models.Model):
+    """Inbox of Razorpay webhook deliveries, processed in batches by api/webhooks.py"""
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+
+    # X-Razorpay-Event-Id; Razorpay redelivers an event under the same id
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=50)
+    order_id = models.CharField(max_length=100, blank=True, db_index=True)
+    payment_id = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['received_at']
+
+    def __str__(self):
+        return f"{self.event} {self.event_id} ({self.status})"
+
+
+class IdempotencyRecord(models.Model):
+    """First response to a request carrying an Idempotency-Key, replayed to its retries"""
+
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    # View the key was used with; the same key may be reused on another endpoint
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    # Who sent it (user pk or client IP); another client's key never matches
+    client = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    # What the first request asked for; a reuse of the key for anything else is refused
+    request_hash = models.CharField(max_length=64, blank=True)
+    request_size = models.BigIntegerField(blank=True, null=True, help_text='Content-Length')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'client', 'key'], name='unique_idempotency_key_per_client'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.status})"
+
+
+class Task(models.Model):
+    """Background job run by ``manage.py run_tasks``; see api/tasks.py"""
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    # Dotted path of a function registered with @tasks.task
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Higher runs first among tasks that are due
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    # At most one queued task per non-empty key; a second enqueue is dropped
+    unique_key = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-priority', 'run_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_at'], name='task_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['unique_key'],
+                condition=models.Q(status='queued') & ~models.Q(unique_key=''),
+                name='unique_queued_task_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
 class PDFPurchase(models.Model):
     """Model for paid PDF downloads (₹9 Chittorgarh Guide)"""
     
@@ -73,7 +291,14 @@ class PDFPurchase(models.Model):
     
     # Razorpay Integration
     razorpay_order_id = models.CharField(max_length=200, unique=True)
-    razorpay_payment_id = models.CharField(max_length=200, blank=True, null=True)
+    # "manual_<transaction id>" for manual payments
+    razorpay_payment_id = models.CharField(max_length=200, blank=True, null=True, db_index=True)
+    payment_verification = models.CharField(
+        max_length=20, choices=PAYMENT_VERIFICATION_CHOICES, blank=True, db_index=True
+    )
+    payment_verified_at = models.DateTimeField(blank=True, null=True)
+    # Until then a repeat checkout with the same details reuses this order
+    order_expires_at = models.DateTimeField(null=True, blank=True)
     payment_status = models.CharField(
         max_length=20,
         choices=[
@@ -125,4 +350,51 @@ class MediaKitDownload(models.Model):
         verbose_name_plural = 'Media Kit Downloads'
     
     def __str__(self):
-        return f"{self.pdf_name} - {self.downloaded_at.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"{self.pdf_name} - {self.downloaded_at.strftime('%Y-%m-%d %H:%M')}"
+
+class OutboundEmail(models.Model):
+    """Email queued for, or past, delivery by the background worker; see api/emails.py"""
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        # Admin notifications collected for the next digest (ADMIN_NOTIFICATIONS = 'digest')
+        ('held', 'Held for digest'),
+        ('digested', 'Sent in digest'),
+    ]
+
+    # What the email is about, so its delivery shows up with the record
+    booking = models.ForeignKey(
+        Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='emails'
+    )
+    pdf_purchase = models.ForeignKey(
+        PDFPurchase, on_delete=models.SET_NULL, null=True, blank=True, related_name='emails'
+    )
+    # e.g. 'booking_paid_customer', 'manual_payment_admin'
+    kind = models.CharField(max_length=50, blank=True, db_index=True)
+
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # The digest email a held notification went out in
+    digest = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='digested')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind or 'email'} to {', '.join(self.recipients)} ({self.status})"
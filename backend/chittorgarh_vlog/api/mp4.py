@@ -0,0 +1,216 @@
+"""
+Minimal reader and faststart rewriter for the ISO base media file format
+(MP4 / QuickTime MOV).
+
+Boxes are walked by seeking from header to header, so probing a video only
+reads the few hundred bytes of ``moov`` metadata it needs and never touches
+the sample data in ``mdat``, however large the file is.
+"""
+import hashlib
+import io
+import struct
+
+
+class MP4Error(ValueError):
+    """The file is not a well-formed MP4/MOV box structure"""
+
+
+def iter_boxes(fh, start, end):
+    """Yield (type, offset, header_size, size) for each box between two offsets"""
+    offset = start
+    while offset + 8 <= end:
+        fh.seek(offset)
+        header = fh.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large = fh.read(8)
+            if len(large) < 8:
+                raise MP4Error('Truncated 64-bit box header')
+            size = struct.unpack('>Q', large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset  # box extends to the end of its parent / file
+        if size < header_size or offset + size > end:
+            raise MP4Error(f'Invalid size for box {box_type!r} at offset {offset}')
+        yield box_type, offset, header_size, size
+        offset += size
+
+
+def find_box(fh, start, end, box_type):
+    """Return (offset, header_size, size) of the first child box of a type, or None"""
+    for found_type, offset, header_size, size in iter_boxes(fh, start, end):
+        if found_type == box_type:
+            return offset, header_size, size
+    return None
+
+
+def find_path(fh, start, end, path):
+    """Follow a list of nested box types, e.g. [b'mdia', b'minf', b'stbl']"""
+    box = None
+    for box_type in path:
+        box = find_box(fh, start, end, box_type)
+        if box is None:
+            return None
+        offset, header_size, size = box
+        start, end = offset + header_size, offset + size
+    return box
+
+
+def read_payload(fh, box, limit=None):
+    offset, header_size, size = box
+    fh.seek(offset + header_size)
+    length = size - header_size
+    return fh.read(length if limit is None else min(length, limit))
+
+
+def _parse_mvhd(payload):
+    version = payload[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', payload[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', payload[12:20])
+    return timescale, duration
+
+
+def _parse_tkhd_dimensions(payload):
+    # Width and height are 16.16 fixed point at the end of the box
+    matrix_end = 76 if payload[0] == 0 else 88
+    if len(payload) < matrix_end + 8:
+        return None, None
+    width, height = struct.unpack('>II', payload[matrix_end:matrix_end + 8])
+    return width >> 16, height >> 16
+
+
+def _parse_track(fh, trak):
+    offset, header_size, size = trak
+    start, end = offset + header_size, offset + size
+
+    hdlr = find_path(fh, start, end, [b'mdia', b'hdlr'])
+    handler = read_payload(fh, hdlr, 12)[8:12] if hdlr else b''
+
+    codec = None
+    stsd = find_path(fh, start, end, [b'mdia', b'minf', b'stbl', b'stsd'])
+    if stsd:
+        payload = read_payload(fh, stsd, 16)
+        if len(payload) >= 16 and struct.unpack('>I', payload[4:8])[0] > 0:
+            codec = payload[12:16].decode('latin-1').strip()
+
+    width = height = None
+    tkhd = find_box(fh, start, end, b'tkhd')
+    if tkhd:
+        width, height = _parse_tkhd_dimensions(read_payload(fh, tkhd, 96))
+
+    return handler, codec, width, height
+
+
+def probe(fh, file_size):
+    """Extract duration, dimensions, video codec and average bitrate from an MP4/MOV file.
+
+    Returns a dict, or raises MP4Error if the file has no readable ``moov``.
+    """
+    moov = find_box(fh, 0, file_size, b'moov')
+    if moov is None:
+        raise MP4Error('No moov box found')
+    offset, header_size, size = moov
+    start, end = offset + header_size, offset + size
+
+    mvhd = find_box(fh, start, end, b'mvhd')
+    if mvhd is None:
+        raise MP4Error('No mvhd box found')
+    timescale, duration_units = _parse_mvhd(read_payload(fh, mvhd, 32))
+    duration = duration_units / timescale if timescale else None
+
+    info = {
+        'duration': duration,
+        'width': None,
+        'height': None,
+        'video_codec': '',
+        'bitrate': int(file_size * 8 / duration) if duration else None,
+    }
+    for box_type, box_offset, box_header, box_size in iter_boxes(fh, start, end):
+        if box_type != b'trak':
+            continue
+        handler, codec, width, height = _parse_track(fh, (box_offset, box_header, box_size))
+        if handler == b'vide':
+            info['video_codec'] = codec or ''
+            info['width'], info['height'] = width, height
+            break
+    return info
+
+
+# Boxes on the path from moov down to the chunk offset tables
+_OFFSET_TABLE_PARENTS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _offset_table_entries(fh, start, end):
+    """Yield (position, width) of every stco/co64 entry inside a moov payload"""
+    for box_type, offset, header_size, size in iter_boxes(fh, start, end):
+        payload = offset + header_size
+        if box_type in _OFFSET_TABLE_PARENTS:
+            yield from _offset_table_entries(fh, payload, offset + size)
+        elif box_type in (b'stco', b'co64'):
+            fh.seek(payload + 4)
+            count = struct.unpack('>I', fh.read(4))[0]
+            width = 4 if box_type == b'stco' else 8
+            if payload + 8 + count * width > offset + size:
+                raise MP4Error(f'{box_type!r} entry count exceeds the box size')
+            for index in range(count):
+                yield payload + 8 + index * width, width
+
+
+def _copy_range(src, dst, start, length, digest):
+    src.seek(start)
+    while length > 0:
+        block = src.read(min(COPY_BUFFER_SIZE, length))
+        if not block:
+            raise MP4Error('Unexpected end of file while copying')
+        dst.write(block)
+        digest.update(block)
+        length -= len(block)
+
+
+def faststart(src, dst, file_size):
+    """Rewrite ``src`` into ``dst`` with the moov box moved in front of mdat.
+
+    Chunk offsets in every stco/co64 table are shifted by the size of moov,
+    and all other boxes are copied through in order with a fixed-size buffer,
+    so memory use is bounded by the moov box rather than the file. Returns
+    the SHA-256 hex digest of the written file, or None (writing nothing)
+    if the file already starts playing without the whole download.
+    """
+    boxes = list(iter_boxes(src, 0, file_size))
+    types = [box[0] for box in boxes]
+    if b'moov' not in types or b'mdat' not in types:
+        raise MP4Error('File has no moov or mdat box')
+    moov_index, mdat_index = types.index(b'moov'), types.index(b'mdat')
+    if moov_index < mdat_index:
+        return None
+
+    _, moov_offset, moov_header, moov_size = boxes[moov_index]
+    insert_at = boxes[mdat_index][1]
+    src.seek(moov_offset)
+    moov = bytearray(src.read(moov_size))
+
+    # Everything between the insertion point and the old moov moves down by moov_size
+    view = io.BytesIO(bytes(moov))
+    for position, width in _offset_table_entries(view, moov_header, moov_size):
+        fmt = '>I' if width == 4 else '>Q'
+        chunk_offset = struct.unpack_from(fmt, moov, position)[0]
+        if insert_at <= chunk_offset < moov_offset:
+            chunk_offset += moov_size
+            if width == 4 and chunk_offset > 0xFFFFFFFF:
+                raise MP4Error('Shifted chunk offset does not fit in stco')
+            struct.pack_into(fmt, moov, position, chunk_offset)
+
+    digest = hashlib.sha256()
+    _copy_range(src, dst, 0, insert_at, digest)
+    dst.write(moov)
+    digest.update(moov)
+    for box_type, offset, header_size, size in boxes[mdat_index:]:
+        if offset != moov_offset:
+            _copy_range(src, dst, offset, size, digest)
+    return digest.hexdigest()
@@ -0,0 +1,166 @@
+"""
+Payment state changes shared by the browser verify views and the Razorpay webhook.
+
+Either path may confirm a payment first, or both at once. The status change
+is a transition in api/transitions.py, a conditional UPDATE, so exactly one
+of them applies it and sends the confirmation emails; the other sees the
+payment as already recorded.
+"""
+import logging
+import secrets
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+from . import emails
+from .media import media_url
+from .transitions import booking_status, pdf_payment_status
+
+
+logger = logging.getLogger(__name__)
+
+
+def mark_booking_paid(booking, payment_id='', base_url=None):
+    """Move a pending booking to payment_received and send the confirmation emails.
+
+    ``base_url`` is the site root the video link in the admin email is built
+    on (defaults to ``BACKEND_URL``). Returns False if the booking was no
+    longer pending, in which case nothing is changed or sent.
+    """
+    changes = {'transaction_id': payment_id} if payment_id else {}
+    if not booking_status.apply(booking, 'pay', **changes):
+        return False
+
+    logger.info(f"Payment verified and booking updated: {booking.booking_id}")
+    send_booking_paid_emails(booking, base_url)
+    return True
+
+
+def send_booking_paid_emails(booking, base_url=None):
+    """Congratulate the customer and ask the admin to post the video"""
+    try:
+        from django.utils.html import escape
+        from datetime import datetime, timedelta
+        
+        # Calculate expected go-live time (within 24 hours)
+        now = datetime.now()
+        go_live_time = now + timedelta(hours=24)
+        go_live_formatted = go_live_time.strftime("%B %d, %Y at %I:%M %p")
+        
+        # 1. Send Congratulations Email to Customer
+        if booking.email and settings.EMAIL_HOST_USER:
+            sanitized_booking_id = escape(booking.booking_id)
+            customer_email_message = f"""
+🎉 CONGRATULATIONS! 🎉
+
+Dear {booking.name},
+
+Thank you for choosing ChittorgarhVlog! Your payment has been successfully received.
+
+═══════════════════════════════════════
+📋 ORDER DETAILS
+═══════════════════════════════════════
+• Booking ID: {sanitized_booking_id}
+• Plan: {booking.plan}
+• Amount Paid: ₹{booking.amount}
+• Payment Status: ✅ CONFIRMED
+• Order Date: {now.strftime("%B %d, %Y at %I:%M %p")}
+
+═══════════════════════════════════════
+📅 WHEN WILL YOUR VIDEO GO LIVE?
+═══════════════════════════════════════
+Your story/post will be published on our official Instagram page:
+📸 @chittorgarhvlog
+
+Expected Go-Live Time: {go_live_formatted}
+(Within 24 hours of payment confirmation)
+
+You will receive a notification once your content is live!
+
+═══════════════════════════════════════
+📞 NEED HELP?
+═══════════════════════════════════════
+• WhatsApp: +91 63775 95978
+• Email: narendrakumar9664@gmail.com
+• Instagram: @chittorgarh_vlog
+
+Thank you for trusting ChittorgarhVlog to share your story with Chittorgarh!
+
+Warm regards,
+Team ChittorgarhVlog
+"""
+            emails.queue(
+                subject=f'🎉 Congratulations! Your Order #{sanitized_booking_id} is Confirmed - ChittorgarhVlog',
+                message=customer_email_message,
+                from_email=settings.EMAIL_HOST_USER,
+                recipient_list=[booking.email],
+                booking=booking,
+                kind='booking_paid_customer',
+            )
+        
+        # 2. Send to Admin (You)
+        if settings.EMAIL_HOST_USER:
+            video_url = "No video uploaded"
+            if booking.video_file:
+                # Generate full download URL
+                video_url = urljoin(base_url or settings.BACKEND_URL, media_url(booking.video_file.name))
+            
+            emails.notify_admin(
+                subject=f'💰 New Booking: {booking.name} - ₹{booking.amount}',
+                message=f"""
+                New Booking Received!
+                
+                Name: {booking.name}
+                Email: {booking.email}
+                Phone: {booking.contact}
+                Plan: {booking.plan}
+                Amount: ₹{booking.amount}
+                
+                ----------------------------------------
+                VIDEO DOWNLOAD LINK (kept until the booking is completed, then up to {settings.VIDEO_RETENTION_DAYS['completed']} days after booking):
+                {video_url}
+                ----------------------------------------
+                
+                ACTION REQUIRED:
+                1. Download the video immediately
+                2. Post on @chittorgarhvlog by {go_live_formatted}
+                3. Send confirmation to customer
+                
+                If the video is missing or link is broken, contact the user immediately via WhatsApp: {booking.contact}
+                """,
+                booking=booking,
+                kind='booking_paid_admin',
+            )
+            
+    except Exception as email_error:
+        logger.warning(f"Failed to send confirmation email: {str(email_error)}")
+
+
+def mark_pdf_purchase_paid(purchase, payment_id):
+    """Complete a pending PDF purchase and issue its one-time download token.
+
+    Returns the purchase's download token, whether this call or an earlier
+    one completed it.
+    """
+    download_token = secrets.token_urlsafe(32)
+    if not pdf_payment_status.apply(
+        purchase, 'pay', razorpay_payment_id=payment_id, download_token=download_token
+    ):
+        purchase.refresh_from_db()
+        return purchase.download_token
+
+    logger.info(f"PDF payment verified: {purchase.id}")
+
+    # Send confirmation email (optional)
+    try:
+        emails.queue(
+            subject='Chittorgarh Guide - Download Ready',
+            message=f'Thank you for your purchase! Your download is ready.',
+            from_email=settings.EMAIL_HOST_USER,
+            recipient_list=[purchase.email],
+            pdf_purchase=purchase,
+            kind='pdf_ready',
+        )
+    except Exception:
+        pass  # Don't fail if email fails
+    return download_token
@@ -0,0 +1,131 @@
+"""
+Post-upload processing for booking videos.
+
+Each stage is a callable taking the booking whose video was just attached.
+Stages run in order; a failing stage is logged and never fails the upload.
+``after_upload()`` runs the cheap stages in the request and leaves the ones
+that rewrite the whole file to the background worker (api/tasks.py).
+"""
+import logging
+import os
+import tempfile
+
+from django.core.files import File
+
+from .models import Booking, StoredVideo
+from .storage import local_path
+from .video_store import INCOMING_DIR, scratch_path
+from . import mp4, tasks
+
+
+logger = logging.getLogger(__name__)
+
+MP4_TYPES = ('video/mp4', 'video/quicktime')
+
+
+def _remote_faststart(storage, name):
+    """Remux a file in remote storage via local scratch space and upload it over the original"""
+    scratch_dir = scratch_path(INCOMING_DIR)
+    os.makedirs(scratch_dir, exist_ok=True)
+    with storage.open(name, 'rb') as src, tempfile.TemporaryFile(dir=scratch_dir) as dst:
+        digest = mp4.faststart(src, dst, storage.size(name))
+        if digest is not None:
+            storage.save(name, File(dst, name=name))
+    return digest
+
+
+def make_faststart(booking):
+    """Move the moov box in front of mdat so the video plays while downloading.
+
+    Phones often write moov at the end of the file, which means a player must
+    fetch the whole file before it can start. The stored file is rewritten
+    once, in a single streaming pass, and shared by every booking using it.
+    """
+    blob = booking.stored_video
+    if blob is None or blob.content_type not in MP4_TYPES:
+        return
+
+    storage = blob.file.storage
+    path = local_path(storage, blob.file.name)
+    if path is None:
+        digest = _remote_faststart(storage, blob.file.name)
+        if digest is None:
+            return
+    else:
+        temp_path = f'{path}.faststart'
+        try:
+            with open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+                digest = mp4.faststart(src, dst, os.path.getsize(path))
+            if digest is None:
+                return
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    StoredVideo.objects.filter(pk=blob.pk).update(content_sha256=digest)
+    blob.content_sha256 = digest
+    logger.info(f"Remuxed stored video {blob.sha256[:12]} for faststart playback")
+
+def probe_metadata(booking):
+    """Store duration, resolution, codec and bitrate on the booking.
+
+    Only MP4/MOV videos are probed; the parser seeks through the box
+    structure, so this reads a few KB regardless of the file size.
+    """
+    if booking.stored_video and booking.stored_video.content_type not in MP4_TYPES:
+        return
+
+    storage = booking.video_file.storage
+    size = storage.size(booking.video_file.name)
+    with storage.open(booking.video_file.name, 'rb') as fh:
+        info = mp4.probe(fh, size)
+
+    values = {
+        'video_duration': info['duration'],
+        'video_width': info['width'],
+        'video_height': info['height'],
+        'video_codec': info['video_codec'],
+        'video_bitrate': info['bitrate'],
+    }
+    Booking.objects.filter(pk=booking.pk).update(**values)
+    for field, value in values.items():
+        setattr(booking, field, value)
+
+
+POST_UPLOAD_STAGES = [
+    make_faststart,
+    probe_metadata,
+]
+
+# Stages that read only a few KB of the video, cheap enough for a request that
+# must not move the whole file through the worker (direct-to-storage uploads)
+METADATA_STAGES = [
+    probe_metadata,
+]
+
+
+def run_post_upload_pipeline(booking, stages=None):
+    """Run the post-upload stages (all of them by default) for a freshly attached video"""
+    if not booking.video_file:
+        return
+    for stage in POST_UPLOAD_STAGES if stages is None else stages:
+        try:
+            stage(booking)
+        except Exception as e:
+            logger.warning(f"Post-upload stage {stage.__name__} failed for booking {booking.booking_id}: {str(e)}")
+
+
+@tasks.task()
+def remux_video(booking_pk):
+    """Faststart a booking's video in the worker; a failure is retried with backoff"""
+    booking = Booking.objects.select_related('stored_video').filter(pk=booking_pk).first()
+    if booking is not None and booking.video_file:
+        make_faststart(booking)
+
+
+def after_upload(booking, metadata_only=False):
+    """Probe a freshly attached video now and queue its remux unless ``metadata_only``"""
+    run_post_upload_pipeline(booking, METADATA_STAGES)
+    if not metadata_only:
+        remux_video.delay(booking_pk=booking.pk)
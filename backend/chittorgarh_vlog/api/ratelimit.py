@@ -0,0 +1,163 @@
+"""
+Shared rate limiting for the views and DRF throttling.
+
+Limits are kept in the default cache, which settings.py points at a store
+shared by all gunicorn workers (the database, or memcached). Each worker
+no longer keeps its own LocMemCache, so a client no longer gets one full
+allowance per worker.
+
+``hit()`` is a sliding-window counter, a close approximation of a token
+bucket that holds ``limit`` requests and refills over ``window`` seconds:
+
+- Each (scope, client) pair has one integer counter per fixed window. It is
+  bumped with the cache's atomic ``incr()``, so concurrent requests cannot
+  lose increments. Only the first request of a window also needs an ``add()``.
+- The request is allowed while ``previous * (1 - elapsed) + current`` stays
+  within the limit, where ``elapsed`` is the fraction of the current window
+  gone by. There is no burst of 2x the limit at a window boundary, as there
+  would be with plain fixed windows.
+- The previous window is closed, so its count never changes again. Each
+  process remembers it in a bounded LRU (``RATE_LIMIT_LOCAL_KEYS`` entries).
+  A request therefore usually costs one cache round-trip.
+- Counters expire two windows after they start. A client costs two small
+  integers in the cache, where DRF's own throttles keep a list of up to
+  ``limit`` timestamps per client.
+
+``check_rate_limit()`` in views.py and the DRF throttles configured in
+``REST_FRAMEWORK['DEFAULT_THROTTLE_CLASSES']`` both go through ``hit()``.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import throttling
+
+
+RateLimitResult = namedtuple('RateLimitResult', 'allowed count retry_after')
+
+_previous_counts = OrderedDict()
+_previous_lock = threading.Lock()
+
+
+def get_client_ip(request):
+    """Get the real client IP address from request"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0]
+    else:
+        ip = request.META.get('REMOTE_ADDR')
+    return ip
+
+
+def trusted_client_ip(request):
+    """The client address recorded by our own proxies, which the client cannot forge.
+
+    Each of the ``TRUSTED_PROXY_HOPS`` proxies in front of the app appends
+    the address it received the request from to X-Forwarded-For, so only
+    that many entries from the end are trustworthy; anything before them
+    came from the client.
+    """
+    hops = settings.TRUSTED_PROXY_HOPS
+    forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+    if hops and forwarded:
+        return forwarded[-min(hops, len(forwarded))]
+    return request.META.get('REMOTE_ADDR')
+
+
+def _key(scope, ident, window, index):
+    return f'rl:{scope}:{ident}:{window}:{index}'
+
+
+def _increment(key, timeout):
+    """Atomically add one to a counter, creating it if needed; returns the new count"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=timeout):
+            return 1
+        # Another request created it first
+        return cache.incr(key)
+
+
+def _previous_count(key):
+    with _previous_lock:
+        if key in _previous_counts:
+            _previous_counts.move_to_end(key)
+            return _previous_counts[key]
+    count = cache.get(key, 0)
+    with _previous_lock:
+        _previous_counts[key] = count
+        while len(_previous_counts) > settings.RATE_LIMIT_LOCAL_KEYS:
+            _previous_counts.popitem(last=False)
+    return count
+
+
+def hit(scope, ident, limit, window, now=None):
+    """Count one request by ``ident`` against ``limit`` per ``window`` seconds"""
+    now = time.time() if now is None else now
+    window = int(window)
+    index, offset = divmod(now, window)
+    elapsed = offset / window
+
+    count = _increment(_key(scope, ident, window, int(index)), timeout=2 * window)
+    previous = _previous_count(_key(scope, ident, window, int(index) - 1))
+    weight = 1 - elapsed
+    estimate = previous * weight + count
+    if estimate <= limit:
+        return RateLimitResult(True, estimate, None)
+
+    if count > limit:
+        # Even without the previous window this one is over; wait for the next
+        retry_after = window - offset
+    else:
+        # Wait until enough of the previous window has slid out
+        retry_after = (1 - (limit - count) / previous) * window - offset
+    return RateLimitResult(False, estimate, max(1, math.ceil(retry_after)))
+
+
+def reset():
+    """Forget remembered counts of closed windows (tests)"""
+    with _previous_lock:
+        _previous_counts.clear()
+
+
+class SharedRateMixin:
+    """Make a DRF SimpleRateThrottle count through ``hit()``"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        result = hit(self.scope, self.key, self.num_requests, self.duration)
+        self.retry_after = result.retry_after
+        return result.allowed
+
+    def get_ident(self, request):
+        # The same client address check_rate_limit() uses; a forged X-Forwarded-For cannot rotate it
+        return trusted_client_ip(request)
+
+    def wait(self):
+        return self.retry_after
+
+
+class AnonRateThrottle(SharedRateMixin, throttling.AnonRateThrottle):
+    """``anon`` rate for unauthenticated requests, by client IP"""
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserRateThrottle(SharedRateMixin, throttling.UserRateThrottle):
+    """``user`` rate for authenticated requests, by user; anonymous ones are left to AnonRateThrottle"""
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user-{request.user.pk}'
+        return None
@@ -0,0 +1,159 @@
+"""
+In-memory Razorpay API server for tests and local development.
+
+Implements the part of the Razorpay REST API the gateway client uses:
+creating and fetching orders and listing and fetching payments (with
+``from``/``to``/``count``/``skip`` paging, newest first). Requests must
+use the configured key pair as HTTP basic auth.
+
+    standin = RazorpayStandIn(key_id='rzp_test', key_secret='secret').start()
+    order = standin.create_order(99900)
+    standin.capture(order['id'])
+    GatewayClient(base_url=standin.base_url, key_id='rzp_test', key_secret='secret')
+    standin.stop()
+"""
+import base64
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+MAX_PAGE_SIZE = 100
+
+
+class RazorpayStandIn:
+    """A threaded HTTP server holding orders and payments in dicts"""
+
+    def __init__(self, key_id='rzp_test', key_secret='test-secret', host='127.0.0.1', port=0):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.orders = {}
+        self.payments = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        handler = type('RazorpayStandInHandler', (_RazorpayRequestHandler,), {'standin': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _id(self, prefix):
+        return f'{prefix}_{next(self._ids):014d}'
+
+    def create_order(self, amount, currency='INR', receipt=None, created_at=None):
+        order = {
+            'id': self._id('order'),
+            'entity': 'order',
+            'amount': amount,
+            'amount_paid': 0,
+            'currency': currency,
+            'receipt': receipt,
+            'status': 'created',
+            'created_at': int(created_at or time.time()),
+        }
+        with self.lock:
+            self.orders[order['id']] = order
+        return order
+
+    def capture(self, order_id, amount=None, created_at=None, status='captured'):
+        """Record a payment against an order, as if the customer had paid it"""
+        with self.lock:
+            order = self.orders[order_id]
+            payment = {
+                'id': self._id('pay'),
+                'entity': 'payment',
+                'amount': order['amount'] if amount is None else amount,
+                'currency': order['currency'],
+                'status': status,
+                'order_id': order_id,
+                'method': 'upi',
+                'created_at': int(created_at or time.time()),
+            }
+            self.payments[payment['id']] = payment
+            if status == 'captured':
+                order.update(status='paid', amount_paid=payment['amount'])
+        return payment
+
+
+class _RazorpayRequestHandler(BaseHTTPRequestHandler):
+    standin = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, code, description):
+        self._send(status, {'error': {'code': code, 'description': description}})
+
+    def _authorized(self):
+        standin = self.standin
+        expected = base64.b64encode(f'{standin.key_id}:{standin.key_secret}'.encode()).decode()
+        return self.headers.get('Authorization', '') == f'Basic {expected}'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        parts = urlsplit(self.path)
+        self.standin.requests.append((self.command, parts.path))
+        if not self._authorized():
+            return self._error(401, 'BAD_REQUEST_ERROR', 'The api key provided is invalid')
+
+        segments = parts.path.strip('/').split('/')
+        if segments[:1] != ['v1'] or len(segments) < 2:
+            return self._error(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+        resource, rest = segments[1], segments[2:]
+        query = dict(parse_qsl(parts.query))
+
+        if resource == 'orders' and self.command == 'POST' and not rest:
+            data = json.loads(body or b'{}')
+            return self._send(200, self.standin.create_order(data.get('amount'), data.get('currency', 'INR'), data.get('receipt')))
+        if resource in ('orders', 'payments') and self.command == 'GET':
+            items = self.standin.orders if resource == 'orders' else self.standin.payments
+            if rest:
+                with self.standin.lock:
+                    item = items.get(rest[0])
+                if item is None:
+                    return self._error(400, 'BAD_REQUEST_ERROR', 'The id provided does not exist')
+                return self._send(200, item)
+            return self._send(200, self._collection(items, query))
+        return self._error(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+
+    do_GET = do_POST = _dispatch
+
+    def _collection(self, items, query):
+        try:
+            start = int(query.get('from', 0))
+            end = int(query.get('to', 2 ** 31))
+            count = min(int(query.get('count', 10)), MAX_PAGE_SIZE)
+            skip = int(query.get('skip', 0))
+        except ValueError:
+            count, skip, start, end = 0, 0, 0, 0
+        with self.standin.lock:
+            matching = [item for item in items.values() if start <= item['created_at'] <= end]
+        matching.sort(key=lambda item: (item['created_at'], item['id']), reverse=True)
+        page = matching[skip:skip + count]
+        return {'entity': 'collection', 'count': len(page), 'items': page}
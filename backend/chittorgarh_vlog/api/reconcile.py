@@ -0,0 +1,179 @@
+"""
+Reconcile Razorpay payments against local bookings and PDF purchases.
+
+A payment can be captured while the browser never reaches the verify view
+and the webhook is lost or misconfigured. The booking then stays ``pending``
+although the customer paid. ``reconcile()`` (the ``reconcile_payments``
+command) finds those:
+
+- Pages through the gateway's payments for a time window,
+  ``RAZORPAY_RECONCILE_PAGE_SIZE`` per request (100 is Razorpay's maximum).
+- Per page, looks up the bookings and purchases for all captured payments
+  with one ``razorpay_order_id__in`` query each. Both columns are indexed.
+- Marks the pending ones paid with one ``bulk_update`` per model, inside a
+  transaction that re-selects them as still pending. A record the verify
+  view or a webhook completes meanwhile is left alone.
+
+A payment whose amount differs from the order we created is reported, not
+applied. Fixed bookings get the usual confirmation emails once the
+transaction commits.
+"""
+import logging
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .gateway import gateway
+from .models import Booking, PDFPurchase
+from .payments import send_booking_paid_emails
+from .transitions import booking_status, pdf_payment_status
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileReport:
+    """What one reconciliation pass found, and fixed unless ``dry_run``"""
+
+    def __init__(self, since, until):
+        self.since = since
+        self.until = until
+        self.pages = 0
+        self.payments = 0
+        self.captured = 0
+        self.already_recorded = 0
+        self.fixed_bookings = []
+        self.fixed_purchases = []
+        self.amount_mismatches = []
+        self.unmatched = []
+        self.still_pending = 0
+
+    def as_dict(self):
+        return {
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'pages': self.pages,
+            'payments': self.payments,
+            'captured': self.captured,
+            'already_recorded': self.already_recorded,
+            'fixed_bookings': len(self.fixed_bookings),
+            'fixed_purchases': len(self.fixed_purchases),
+            'amount_mismatches': len(self.amount_mismatches),
+            'unmatched': len(self.unmatched),
+            'still_pending': self.still_pending,
+        }
+
+
+def iter_payment_pages(client, since, until, page_size=None):
+    """Yield lists of gateway payments created in [since, until], newest first"""
+    page_size = page_size or settings.RAZORPAY_RECONCILE_PAGE_SIZE
+    skip = 0
+    while True:
+        page = client.list_payments(since.timestamp(), until.timestamp(), count=page_size, skip=skip)
+        items = page.get('items') or []
+        if items:
+            yield items
+        if len(items) < page_size:
+            return
+        skip += len(items)
+
+
+def _booking_paise(booking):
+    return booking.razorpay_order_amount or int(booking.amount * 100)
+
+
+def _reconcile_page(payments, report, dry_run, seen):
+    """Match one page of payments; returns the bookings marked paid"""
+    captured = {}
+    for payment in payments:
+        if payment.get('status') != 'captured' or not payment.get('order_id') or payment['id'] in seen:
+            continue
+        seen.add(payment['id'])
+        captured.setdefault(payment['order_id'], payment)
+    report.captured += len(captured)
+    if not captured:
+        return []
+
+    bookings = {b.razorpay_order_id: b for b in Booking.objects.filter(razorpay_order_id__in=captured)}
+    purchases = {p.razorpay_order_id: p for p in PDFPurchase.objects.filter(razorpay_order_id__in=captured)}
+
+    booking_payments, purchase_payments = {}, {}
+    for order_id, payment in captured.items():
+        record = bookings.get(order_id) or purchases.get(order_id)
+        if record is None:
+            report.unmatched.append(payment['id'])
+            continue
+        if isinstance(record, Booking):
+            pending, expected, target = record.status == 'pending', _booking_paise(record), booking_payments
+        else:
+            pending, expected, target = record.payment_status == 'pending', record.amount * 100, purchase_payments
+        if not pending:
+            report.already_recorded += 1
+        elif payment.get('amount') != expected:
+            report.amount_mismatches.append((payment['id'], order_id, expected, payment.get('amount')))
+        else:
+            target[record.pk] = payment['id']
+
+    if dry_run:
+        report.fixed_bookings.extend(b.booking_id for b in bookings.values() if b.pk in booking_payments)
+        report.fixed_purchases.extend(p.pk for p in purchases.values() if p.pk in purchase_payments)
+        return []
+
+    # The 'pay' transitions of api/transitions.py, applied in bulk
+    booking_sources, booking_target = booking_status.transitions['pay']
+    purchase_sources, purchase_target = pdf_payment_status.transitions['pay']
+    with transaction.atomic():
+        stuck_bookings = list(
+            Booking.objects.select_for_update().filter(pk__in=booking_payments, status__in=booking_sources)
+        )
+        for booking in stuck_bookings:
+            booking.status = booking_target
+            booking.transaction_id = booking_payments[booking.pk]
+        Booking.objects.bulk_update(stuck_bookings, ['status', 'transaction_id'])
+
+        now = timezone.now()
+        stuck_purchases = list(
+            PDFPurchase.objects.select_for_update().filter(pk__in=purchase_payments, payment_status__in=purchase_sources)
+        )
+        for purchase in stuck_purchases:
+            purchase.payment_status = purchase_target
+            purchase.razorpay_payment_id = purchase_payments[purchase.pk]
+            purchase.download_token = secrets.token_urlsafe(32)
+            purchase.updated_at = now
+        PDFPurchase.objects.bulk_update(
+            stuck_purchases, ['payment_status', 'razorpay_payment_id', 'download_token', 'updated_at']
+        )
+
+    # Anything dropped between the lookup and the lock was recorded by another path
+    report.already_recorded += len(booking_payments) - len(stuck_bookings)
+    report.already_recorded += len(purchase_payments) - len(stuck_purchases)
+    report.fixed_bookings.extend(booking.booking_id for booking in stuck_bookings)
+    report.fixed_purchases.extend(purchase.pk for purchase in stuck_purchases)
+    return stuck_bookings
+
+
+def reconcile(since=None, until=None, dry_run=False, notify=True, page_size=None, client=None):
+    """Reconcile payments created in [since, until] (default: the last day); returns a ReconcileReport"""
+    until = until or timezone.now()
+    since = since or until - timedelta(days=1)
+    client = client or gateway()
+    report = ReconcileReport(since, until)
+
+    seen, fixed = set(), []
+    for payments in iter_payment_pages(client, since, until, page_size):
+        report.pages += 1
+        report.payments += len(payments)
+        fixed.extend(_reconcile_page(payments, report, dry_run, seen))
+
+    pending = Booking.objects.filter(status='pending', created_at__range=(since, until)).exclude(razorpay_order_id='')
+    report.still_pending = pending.count() - (len(report.fixed_bookings) if dry_run else 0)
+
+    if fixed:
+        logger.info(f"Reconciliation marked {len(fixed)} bookings paid")
+    if notify:
+        for booking in fixed:
+            send_booking_paid_emails(booking)
+    return report
@@ -0,0 +1,207 @@
+"""
+In-memory S3-compatible server for tests and local development.
+
+Implements the subset of the S3 REST API that S3Storage uses (PUT with
+optional SHA-256 checksum, GET with Range, HEAD and DELETE of objects,
+path-style addressing) and checks every
+request's Signature Version 4, either from the Authorization header or from
+a presigned URL, so signing mistakes fail here the way they would on S3.
+
+    standin = S3StandIn(access_key='test', secret_key='secret')
+    standin.start()
+    ... AWS_S3_ENDPOINT_URL = standin.endpoint_url ...
+    standin.stop()
+"""
+import base64
+import hashlib
+import re
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from .storage import ALGORITHM, sigv4_signature
+
+
+_AUTH_RE = re.compile(r'Credential=([^,]+), SignedHeaders=([^,]+), Signature=([0-9a-f]+)')
+
+
+class StoredObject:
+    def __init__(self, data, content_type, checksum_sha256=None):
+        self.data = data
+        self.content_type = content_type
+        self.checksum_sha256 = checksum_sha256
+        self.last_modified = datetime.now(dt_timezone.utc)
+        self.etag = f'"{hashlib.md5(data).hexdigest()}"'
+
+
+class S3StandIn:
+    """A threaded HTTP server holding objects in a dict keyed by (bucket, key)"""
+
+    def __init__(self, access_key='test', secret_key='test-secret', region='us-east-1', host='127.0.0.1', port=0):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.objects = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        handler = type('S3StandInHandler', (_S3RequestHandler,), {'standin': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def keys(self, bucket):
+        with self.lock:
+            return sorted(key for b, key in self.objects if b == bucket)
+
+
+class _S3RequestHandler(BaseHTTPRequestHandler):
+    standin = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- helpers -----------------------------------------------------------
+
+    def _send(self, status, body=b'', headers=None, include_body=True):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if include_body and body:
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>'.encode()
+        self._send(status, body, {'Content-Type': 'application/xml'}, include_body=self.command != 'HEAD')
+
+    def _target(self):
+        path = urlsplit(self.path).path
+        bucket, _, key = unquote(path).lstrip('/').partition('/')
+        return bucket, key
+
+    def _authorized(self):
+        standin = self.standin
+        parts = urlsplit(self.path)
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        query = dict(params)
+
+        if 'X-Amz-Signature' in query:
+            credential = query.get('X-Amz-Credential', '')
+            signed_headers = query.get('X-Amz-SignedHeaders', '').split(';')
+            signature = query['X-Amz-Signature']
+            date = query.get('X-Amz-Date', '')
+            payload_hash = 'UNSIGNED-PAYLOAD'
+            params = [(k, v) for k, v in params if k != 'X-Amz-Signature']
+            try:
+                issued = datetime.strptime(date, '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc)
+                expires = issued + timedelta(seconds=int(query.get('X-Amz-Expires', '0')))
+            except ValueError:
+                return False
+            if datetime.now(dt_timezone.utc) > expires:
+                return False
+        else:
+            match = _AUTH_RE.search(self.headers.get('Authorization', ''))
+            if not match or not self.headers.get('Authorization', '').startswith(ALGORITHM):
+                return False
+            credential, signed_headers, signature = match.groups()
+            signed_headers = signed_headers.split(';')
+            date = self.headers.get('x-amz-date', '')
+            payload_hash = self.headers.get('x-amz-content-sha256', '')
+
+        if credential.split('/')[0] != standin.access_key:
+            return False
+        headers = {name: self.headers.get(name, '') for name in signed_headers}
+        expected, _, _ = sigv4_signature(
+            standin.secret_key, standin.region, date, self.command, parts.path, params, headers, payload_hash
+        )
+        return expected == signature
+
+    def _dispatch(self):
+        self.standin.requests.append((self.command, self.path, dict(self.headers)))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not self._authorized():
+            return self._error(403, 'SignatureDoesNotMatch')
+        bucket, key = self._target()
+        if not bucket or not key:
+            return self._error(400, 'InvalidRequest')
+        getattr(self, f'_do_{self.command.lower()}')(bucket, key, body)
+
+    do_GET = do_HEAD = do_PUT = do_DELETE = _dispatch
+
+    # -- operations --------------------------------------------------------
+
+    def _do_put(self, bucket, key, body):
+        checksum = self.headers.get('x-amz-checksum-sha256')
+        if checksum and checksum != base64.b64encode(hashlib.sha256(body).digest()).decode():
+            return self._error(400, 'BadDigest')
+        obj = StoredObject(body, self.headers.get('Content-Type', 'application/octet-stream'), checksum)
+        with self.standin.lock:
+            self.standin.objects[(bucket, key)] = obj
+        self._send(200, headers={'ETag': obj.etag})
+
+    def _do_delete(self, bucket, key, body):
+        with self.standin.lock:
+            self.standin.objects.pop((bucket, key), None)
+        self._send(204)
+
+    def _do_head(self, bucket, key, body):
+        self._do_get(bucket, key, body, include_body=False)
+
+    def _do_get(self, bucket, key, body, include_body=True):
+        with self.standin.lock:
+            obj = self.standin.objects.get((bucket, key))
+        if obj is None:
+            return self._error(404, 'NoSuchKey')
+
+        query = dict(parse_qsl(urlsplit(self.path).query))
+        headers = {
+            'Content-Type': query.get('response-content-type', obj.content_type),
+            'ETag': obj.etag,
+            'Last-Modified': format_datetime(obj.last_modified, usegmt=True),
+            'Accept-Ranges': 'bytes',
+        }
+        if 'response-content-disposition' in query:
+            headers['Content-Disposition'] = query['response-content-disposition']
+        if obj.checksum_sha256 and self.headers.get('x-amz-checksum-mode') == 'ENABLED':
+            headers['x-amz-checksum-sha256'] = obj.checksum_sha256
+
+        size = len(obj.data)
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and self.command == 'GET':
+            start, end = match.groups()
+            if not start:
+                start, end = max(0, size - int(end)), size - 1
+            else:
+                start, end = int(start), min(int(end) if end else size - 1, size - 1)
+            if start >= size:
+                return self._send(416, headers={'Content-Range': f'bytes */{size}'})
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            return self._send(206, obj.data[start:end + 1], headers)
+
+        if not include_body:
+            # Report the real object size without sending it
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            return
+        self._send(200, obj.data, headers)
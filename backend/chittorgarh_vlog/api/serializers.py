@@ -1,13 +1,22 @@
 from rest_framework import serializers
 from .models import Booking
+from .video import video_file_error
 import re
 
 
 class BookingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Booking
-        fields = ['name', 'email', 'contact', 'video_file', 'plan', 'amount', 'booking_id', 'status', 'created_at']
-        read_only_fields = ['booking_id', 'status', 'created_at']
+        fields = [
+            'name', 'email', 'contact', 'video_file', 'plan', 'amount', 'booking_id', 'status', 'created_at',
+            'video_duration', 'video_width', 'video_height', 'video_codec', 'video_bitrate',
+            'video_purged_at', 'video_purge_reason',
+        ]
+        read_only_fields = [
+            'booking_id', 'status', 'created_at',
+            'video_duration', 'video_width', 'video_height', 'video_codec', 'video_bitrate',
+            'video_purged_at', 'video_purge_reason',
+        ]
 
     def validate_name(self, value):
         # Validate name format to prevent XSS and injection
@@ -32,13 +41,7 @@ class BookingSerializer(serializers.ModelSerializer):
 
     def validate_video_file(self, value):
         if value:
-            # Check file type
-            allowed_types = ['video/mp4', 'video/mpeg', 'video/quicktime', 'video/x-msvideo']
-            if value.content_type not in allowed_types:
-                raise serializers.ValidationError(f"Video file type not supported. Allowed types: {allowed_types}")
-
-            # Check file size (limit to 500MB)
-            max_size = 500 * 1024 * 1024  # 500MB
-            if value.size > max_size:
-                raise serializers.ValidationError("Video file size too large. Maximum size is 500MB")
-        return value
\ No newline at end of file
+            error = video_file_error(value)
+            if error:
+                raise serializers.ValidationError(error)
+        return value
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Booking
+from . import video_store
+
+
+@receiver(post_delete, sender=Booking)
+def release_booking_video(sender, instance, **kwargs):
+    """Drop the deleted booking's reference to its stored video"""
+    if instance.stored_video_id:
+        video_store.release(instance.stored_video_id)
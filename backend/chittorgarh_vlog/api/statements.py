@@ -0,0 +1,204 @@
+"""
+Verify manual (UPI / bank transfer) payments against bank statement exports.
+
+``submit_manual_payment`` and ``submit_pdf_manual_payment`` accept the
+transaction ID the customer typed and mark the record
+``payment_verification='unverified'``. ``verify()`` (the
+``import_bank_statement`` command) checks those against a statement CSV:
+
+- The CSV is read row by row. The header row is found by its column names
+  (UTR / reference number and credit / amount, in the spellings the common
+  Indian banks and UPI apps use), so preamble lines above it are skipped.
+- Credits are handled ``batch_size`` at a time. Each batch is a dict of
+  transaction ID to amount. The bookings and PDF purchases claiming those
+  IDs are fetched with one indexed ``__in`` query per model, and their new
+  verification states are written with one UPDATE per state. The work
+  follows the statement's size, not the number of outstanding payments.
+
+A claim whose amount differs from the credit is flagged ``amount_mismatch``.
+A second claim on a transaction ID that already verified another record is
+flagged ``duplicate``. Claims not on the statement stay ``unverified`` for
+the next import. Booking and purchase statuses are not changed; the admin
+acts on the flags.
+"""
+import csv
+import logging
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.utils import timezone
+
+from .models import Booking, PDFPurchase
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Rows searched for the header before giving up on a file
+MAX_PREAMBLE_ROWS = 50
+
+TRANSACTION_COLUMNS = {
+    'utr', 'utr no', 'utr number', 'upi ref no', 'upi ref', 'upi transaction id', 'transaction id',
+    'txn id', 'transaction ref no', 'reference no', 'reference number', 'ref no', 'chq ref no',
+}
+AMOUNT_COLUMNS = {
+    'credit', 'credit amount', 'credit amt', 'cr amount', 'deposit', 'deposit amt', 'deposit amount', 'amount',
+}
+
+
+class StatementError(ValueError):
+    """The file does not look like a statement we can read"""
+
+
+def normalize_transaction_id(value):
+    """Transaction IDs compare without whitespace and case"""
+    return ''.join(str(value).split()).upper()
+
+
+def _column_name(value):
+    for char in './_-()':
+        value = value.replace(char, ' ')
+    return ' '.join(value.lower().split())
+
+
+def _amount(value):
+    value = value.replace(',', '').replace('₹', '').replace('INR', '').strip()
+    if value.upper().endswith('CR'):
+        value = value[:-2].strip()
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+
+def iter_credits(lines):
+    """Yield (transaction_id, amount) for each credit in a statement CSV.
+
+    ``lines`` is any iterable of text lines, e.g. a file opened with
+    ``newline=''``; it is consumed lazily.
+    """
+    reader = csv.reader(lines)
+    for row in islice(reader, MAX_PREAMBLE_ROWS):
+        header = [_column_name(cell) for cell in row]
+        txn_column = next((i for i, name in enumerate(header) if name in TRANSACTION_COLUMNS), None)
+        # Prefer a dedicated credit column over a signed "amount" column
+        amount_columns = sorted(
+            (i for i, name in enumerate(header) if name in AMOUNT_COLUMNS), key=lambda i: header[i] == 'amount'
+        )
+        if txn_column is not None and amount_columns:
+            break
+    else:
+        raise StatementError('No transaction ID and credit amount columns found')
+
+    amount_column = amount_columns[0]
+    for row in reader:
+        if len(row) <= max(txn_column, amount_column):
+            continue
+        txn_id = normalize_transaction_id(row[txn_column])
+        amount = _amount(row[amount_column])
+        if txn_id and amount is not None and amount > 0:
+            yield txn_id, amount
+
+
+class StatementReport:
+    """What one import verified or flagged, or would with ``dry_run``"""
+
+    def __init__(self):
+        self.credits = 0
+        self.repeated_credits = 0
+        self.unclaimed_credits = 0
+        self.verified = []
+        self.amount_mismatches = []
+        self.duplicates = []
+        self.outstanding = 0
+
+    def as_dict(self):
+        return {
+            'credits': self.credits,
+            'repeated_credits': self.repeated_credits,
+            'unclaimed_credits': self.unclaimed_credits,
+            'verified': len(self.verified),
+            'amount_mismatches': len(self.amount_mismatches),
+            'duplicates': len(self.duplicates),
+            'outstanding': self.outstanding,
+        }
+
+
+def _claims(transaction_ids):
+    """Manual-payment records claiming any of ``transaction_ids``, by transaction ID, oldest first"""
+    claims = {}
+    for booking in Booking.objects.filter(transaction_id__in=transaction_ids).exclude(payment_verification=''):
+        claims.setdefault(booking.transaction_id, []).append((booking, booking.amount, booking.booking_id))
+    manual_ids = [f'manual_{txn_id}' for txn_id in transaction_ids]
+    for purchase in PDFPurchase.objects.filter(razorpay_payment_id__in=manual_ids).exclude(payment_verification=''):
+        txn_id = purchase.razorpay_payment_id[len('manual_'):]
+        claims.setdefault(txn_id, []).append((purchase, Decimal(purchase.amount), f'PDF purchase {purchase.pk}'))
+    for records in claims.values():
+        records.sort(key=lambda claim: claim[0].created_at)
+    return claims
+
+
+def _verify_batch(credits, report, dry_run):
+    """Check one batch of {transaction_id: amount}; returns how many unverified claims it settled"""
+    claims = _claims(list(credits))
+    updates = {}  # (model, verification state) -> primary keys
+    resolved = 0
+    for txn_id, amount in credits.items():
+        records = claims.get(txn_id)
+        if not records:
+            report.unclaimed_credits += 1
+            continue
+        owner = next((record for record, _, _ in records if record.payment_verification == 'verified'), None)
+        for record, expected, label in records:
+            if record is owner or record.payment_verification == 'duplicate':
+                continue
+            if owner is None and expected == amount:
+                owner, state = record, 'verified'
+                report.verified.append((label, txn_id))
+            elif owner is not None:
+                state = 'duplicate'
+                report.duplicates.append((label, txn_id))
+            else:
+                state = 'amount_mismatch'
+                report.amount_mismatches.append((label, txn_id, expected, amount))
+            if record.payment_verification == 'unverified':
+                resolved += 1
+            if record.payment_verification != state:
+                updates.setdefault((type(record), state), []).append(record.pk)
+
+    if dry_run:
+        return resolved
+    now = timezone.now()
+    for (model, state), pks in updates.items():
+        model.objects.filter(pk__in=pks).update(payment_verification=state, payment_verified_at=now)
+    return resolved
+
+
+def verify(lines, dry_run=False, batch_size=BATCH_SIZE):
+    """Check outstanding manual payments against a statement CSV; returns a StatementReport"""
+    report = StatementReport()
+    seen, resolved = set(), 0
+    credits = iter_credits(lines)
+    while True:
+        rows = list(islice(credits, batch_size))
+        if not rows:
+            break
+        batch = {}
+        for txn_id, amount in rows:
+            if txn_id in seen:
+                report.repeated_credits += 1
+                continue
+            seen.add(txn_id)
+            batch[txn_id] = amount
+        report.credits += len(rows)
+        if batch:
+            resolved += _verify_batch(batch, report, dry_run)
+
+    report.outstanding = (
+        Booking.objects.filter(payment_verification='unverified').count()
+        + PDFPurchase.objects.filter(payment_verification='unverified').count()
+        - (resolved if dry_run else 0)
+    )
+    if not dry_run:
+        logger.info(f"Statement import verified {len(report.verified)} manual payments")
+    return report
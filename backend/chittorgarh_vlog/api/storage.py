@@ -0,0 +1,290 @@
+"""
+Storage backends for uploaded media.
+
+``MEDIA_STORAGE=filesystem`` keeps videos and PDFs under MEDIA_ROOT with
+Django's FileSystemStorage, which only the node holding the volume can see.
+``MEDIA_STORAGE=s3`` uses S3Storage below: every node reads and writes the
+same S3-compatible bucket (AWS S3, MinIO, ...), so the backend can run on
+more than one node.
+
+S3Storage talks to the S3 REST API directly over ``requests`` and signs each
+request with AWS Signature Version 4. Downloads are served by redirecting to
+presigned URLs, and reads are ranged GETs behind a read-ahead buffer, so
+seeking through an MP4's boxes only fetches what is needed. Clients can
+also upload straight to the bucket with a presigned PUT (``presigned_upload``).
+
+Code that needs a real file on disk (rename-into-place, hot files, proxy
+offload) asks ``local_path()`` first and falls back to the Storage API when
+the file is not local.
+"""
+import base64
+import hashlib
+import hmac
+import io
+import mimetypes
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+ALGORITHM = 'AWS4-HMAC-SHA256'
+READ_AHEAD_SIZE = 64 * 1024
+MAX_PRESIGN_EXPIRY = 7 * 24 * 3600  # SigV4 limit
+
+
+class S3Error(Exception):
+    """An S3 request failed with an unexpected status"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def local_path(storage, name):
+    """Filesystem path of a stored file, or None if the storage is not local"""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Signature Version 4
+# ---------------------------------------------------------------------------
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def amz_date(now=None):
+    return (now or datetime.now(dt_timezone.utc)).strftime('%Y%m%dT%H%M%SZ')
+
+
+def canonical_query(params):
+    return '&'.join(
+        f'{quote(str(key), safe="~")}={quote(str(value), safe="~")}'
+        for key, value in sorted(params)
+    )
+
+
+def sigv4_signature(secret_key, region, date, method, path, params, headers, payload_hash, service='s3'):
+    """Return (signature, credential scope, signed header list) for one request.
+
+    ``path`` is the URI-encoded path as sent on the wire, ``params`` a list of
+    (key, value) query pairs and ``headers`` the lowercase headers to sign.
+    """
+    signed_headers = ';'.join(sorted(headers))
+    canonical_request = '\n'.join([
+        method,
+        path,
+        canonical_query(params),
+        ''.join(f'{key}:{" ".join(str(headers[key]).split())}\n' for key in sorted(headers)),
+        signed_headers,
+        payload_hash,
+    ])
+    scope = f'{date[:8]}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        ALGORITHM, date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+    key = _hmac(f'AWS4{secret_key}'.encode(), date[:8])
+    for part in (region, service, 'aws4_request'):
+        key = _hmac(key, part)
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest(), scope, signed_headers
+
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable read-only view of an object, fetched with ranged GETs"""
+
+    def __init__(self, storage, name, size):
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        data = self.storage.read_range(self.name, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@deconstructible
+class S3Storage(Storage):
+    """Storage in an S3-compatible bucket, addressed path-style.
+
+    Saving a name that already exists overwrites it: stored video names are
+    content addresses and catalog PDFs keep fixed names.
+    """
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None, access_key=None,
+                 secret_key=None, url_expiry=None, timeout=None):
+        self.bucket = bucket or settings.AWS_S3_BUCKET
+        self.region = region or settings.AWS_S3_REGION
+        self.endpoint_url = (
+            endpoint_url or settings.AWS_S3_ENDPOINT_URL or f'https://s3.{self.region}.amazonaws.com'
+        ).rstrip('/')
+        self.access_key = access_key or settings.AWS_ACCESS_KEY_ID
+        self.secret_key = secret_key or settings.AWS_SECRET_ACCESS_KEY
+        self.url_expiry = url_expiry or settings.AWS_S3_URL_EXPIRY
+        self.timeout = timeout or settings.AWS_S3_TIMEOUT
+        self.host = urlsplit(self.endpoint_url).netloc
+        self.session = requests.Session()
+
+    def _path(self, name):
+        return quote(f'/{self.bucket}/{name}', safe='/~')
+
+    def _request(self, method, name, headers=None, data=None, expected=(200,), stream=False):
+        path = self._path(name)
+        date = amz_date()
+        headers = dict(headers or {})
+        signed = {
+            'host': self.host,
+            'x-amz-content-sha256': UNSIGNED_PAYLOAD,
+            'x-amz-date': date,
+            **{key.lower(): value for key, value in headers.items() if key.lower().startswith('x-amz-')},
+        }
+        signature, scope, signed_headers = sigv4_signature(
+            self.secret_key, self.region, date, method, path, [], signed, UNSIGNED_PAYLOAD
+        )
+        headers.update({
+            'x-amz-content-sha256': UNSIGNED_PAYLOAD,
+            'x-amz-date': date,
+            'Authorization': (
+                f'{ALGORITHM} Credential={self.access_key}/{scope}, '
+                f'SignedHeaders={signed_headers}, Signature={signature}'
+            ),
+        })
+        response = self.session.request(
+            method, f'{self.endpoint_url}{path}', headers=headers, data=data, timeout=self.timeout, stream=stream
+        )
+        if response.status_code == 404 and 404 not in expected:
+            response.close()
+            raise FileNotFoundError(name)
+        if response.status_code not in expected:
+            # A streamed body may be the whole object; don't download it for an error message
+            detail = '' if stream else f': {response.text[:200]}'
+            response.close()
+            raise S3Error(f'S3 {method} {name} failed with {response.status_code}{detail}', response.status_code)
+        return response
+
+    def _head(self, name):
+        return self._request('HEAD', name)
+
+    def read_range(self, name, start, end):
+        # A 200 means the endpoint ignored the Range and is sending the whole object
+        response = self._request('GET', name, headers={'Range': f'bytes={start}-{end}'}, expected=(206,), stream=True)
+        return response.content
+
+    def _open(self, name, mode='rb'):
+        if set(mode) - set('rb'):
+            raise ValueError('S3Storage files can only be opened for reading; use save() to write')
+        size = self.size(name)
+        reader = io.BufferedReader(S3RangeReader(self, name, size), buffer_size=READ_AHEAD_SIZE)
+        file = File(reader, name)
+        file.size = size
+        return file
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        body = getattr(content, 'file', None) or content
+        headers = {
+            'Content-Length': str(content.size),
+            'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        }
+        self._request('PUT', name, headers=headers, data=body)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def delete(self, name):
+        self._request('DELETE', name, expected=(200, 204, 404))
+
+    def exists(self, name):
+        return self._request('HEAD', name, expected=(200, 404)).status_code == 200
+
+    def size(self, name):
+        return int(self._head(name).headers['Content-Length'])
+
+    def get_modified_time(self, name):
+        return parsedate_to_datetime(self._head(name).headers['Last-Modified'])
+
+    def checksum_sha256(self, name):
+        """Hex SHA-256 the bucket verified when the object was uploaded, or None"""
+        response = self._request('HEAD', name, headers={'x-amz-checksum-mode': 'ENABLED'})
+        checksum = response.headers.get('x-amz-checksum-sha256')
+        return base64.b64decode(checksum).hex() if checksum else None
+
+    def _presign(self, method, name, expire=None, headers=None, parameters=None):
+        path = self._path(name)
+        date = amz_date()
+        expire = min(int(expire or self.url_expiry), MAX_PRESIGN_EXPIRY)
+        signed = {'host': self.host, **{key.lower(): value for key, value in (headers or {}).items()}}
+        params = [
+            ('X-Amz-Algorithm', ALGORITHM),
+            ('X-Amz-Credential', f'{self.access_key}/{date[:8]}/{self.region}/s3/aws4_request'),
+            ('X-Amz-Date', date),
+            ('X-Amz-Expires', str(expire)),
+            ('X-Amz-SignedHeaders', ';'.join(sorted(signed))),
+            *(parameters or {}).items(),
+        ]
+        signature, _, _ = sigv4_signature(
+            self.secret_key, self.region, date, method, path, params, signed, UNSIGNED_PAYLOAD
+        )
+        params.append(('X-Amz-Signature', signature))
+        return f'{self.endpoint_url}{path}?{canonical_query(params)}'
+
+    def url(self, name, expire=None, parameters=None):
+        """Presigned GET URL, optionally overriding response headers via ``parameters``"""
+        return self._presign('GET', name, expire, parameters=parameters)
+
+    def presigned_upload(self, name, content_type, size, sha256, expire=None):
+        """Presigned PUT that only accepts exactly ``size`` bytes hashing to ``sha256``.
+
+        Content-Length and the x-amz-checksum-sha256 header are part of the
+        signature and the bucket verifies the checksum, so any other body is
+        rejected by storage itself. Returns { method, url, headers }; the
+        client must send exactly these headers.
+        """
+        headers = {
+            'Content-Length': str(size),
+            'Content-Type': content_type,
+            'x-amz-checksum-sha256': base64.b64encode(bytes.fromhex(sha256)).decode(),
+        }
+        return {'method': 'PUT', 'url': self._presign('PUT', name, expire, headers=headers), 'headers': headers}
@@ -0,0 +1,200 @@
+"""
+Background tasks stored in the database.
+
+Emails, video remuxing and storage bookkeeping used to run inside the
+request. They are now tasks: a request handler enqueues one with a single
+INSERT (``some_task.delay(...)``) and returns, and ``manage.py run_tasks``
+runs them in a separate process. No broker is needed. A task enqueued
+inside a transaction becomes visible to workers only when it commits.
+
+    @tasks.task(max_attempts=5)
+    def send_receipt(booking_pk):
+        ...
+
+    send_receipt.delay(booking_pk=booking.pk)                  # as soon as possible
+    tasks.enqueue(send_receipt, {'booking_pk': 1}, delay=600)  # in ten minutes
+
+- A task is a registered function and JSON keyword arguments. Due tasks run
+  highest ``priority`` first, then oldest ``run_at``.
+- Workers claim batches with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+  database supports it (Postgres), so they never wait on each other's rows.
+  Elsewhere (SQLite) each row is claimed with a conditional UPDATE from
+  ``queued`` to ``running``, which only one worker can win.
+- A task that raises is retried after ``TASK_RETRY_DELAY * 2 ** (attempts - 1)``
+  seconds (at most ``TASK_RETRY_MAX_DELAY``), until it has run ``max_attempts``
+  times; then it is marked ``failed`` with its last error.
+- A task ``running`` longer than ``TASK_LEASE_SECONDS`` belongs to a worker
+  that died; ``requeue_stale()`` puts it back in the queue. Tasks must
+  therefore be safe to run twice.
+- ``unique_key`` keeps at most one queued task per key: enqueueing again
+  while one waits is a no-op (the INSERT is dropped by a partial unique
+  index). Used for work that covers everything pending when it runs, such
+  as processing the webhook inbox.
+"""
+import logging
+import os
+import random
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+from .transitions import update_if
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(max_attempts=None, priority=0, retry_delay=None):
+    """Register a function as a task; adds ``.delay(**kwargs)`` to enqueue it with these defaults"""
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts or settings.TASK_MAX_ATTEMPTS
+        func.priority = priority
+        func.retry_delay = retry_delay or settings.TASK_RETRY_DELAY
+        func.delay = lambda **kwargs: enqueue(func, kwargs)
+        _registry[func.task_name] = func
+        return func
+    return decorator
+
+
+def resolve(name):
+    """The registered task function called ``name``, or None"""
+    if name not in _registry:
+        try:
+            import_string(name)
+        except ImportError:
+            return None
+    return _registry.get(name)
+
+
+def enqueue(func, kwargs=None, delay=None, run_at=None, priority=None, unique_key=''):
+    """Queue a call of task ``func``; returns the Task (unsaved if ``unique_key`` was already queued)"""
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    task = Task(
+        name=func.task_name,
+        kwargs=kwargs or {},
+        priority=func.priority if priority is None else priority,
+        run_at=run_at,
+        max_attempts=func.max_attempts,
+        unique_key=unique_key,
+    )
+    if unique_key:
+        Task.objects.bulk_create([task], ignore_conflicts=True)
+    else:
+        task.save()
+    return task
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claimed(tasks, worker, now):
+    for task in tasks:
+        task.status = 'running'
+        task.locked_by = worker
+        task.locked_at = now
+        task.attempts += 1
+    return tasks
+
+
+def claim(limit, worker=None, now=None):
+    """Mark up to ``limit`` due tasks as running for ``worker``; returns them"""
+    worker = worker or worker_name()
+    now = now or timezone.now()
+    due = Task.objects.filter(status='queued', run_at__lte=now).order_by('-priority', 'run_at', 'pk')
+    changes = {'status': 'running', 'locked_by': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            tasks = list(due.select_for_update(skip_locked=True)[:limit])
+            Task.objects.filter(pk__in=[task.pk for task in tasks]).update(**changes)
+        return _claimed(tasks, worker, now)
+
+    # Without SKIP LOCKED, workers may pick the same candidates; the UPDATE decides
+    tasks = [task for task in due[:limit] if Task.objects.filter(pk=task.pk, status='queued').update(**changes)]
+    return _claimed(tasks, worker, now)
+
+
+def _retry_delay(func, attempts):
+    delay = min((func.retry_delay if func else settings.TASK_RETRY_DELAY) * 2 ** (attempts - 1),
+                settings.TASK_RETRY_MAX_DELAY)
+    # Spread retries of tasks that failed together, e.g. while SMTP was down
+    return delay * random.uniform(0.9, 1.1)
+
+
+def _fail(task, func, error, now):
+    owned = {'status': 'running', 'locked_by': task.locked_by}
+    if task.attempts < task.max_attempts:
+        try:
+            with transaction.atomic():
+                if update_if(task, owned, status='queued', locked_by='', locked_at=None, last_error=error,
+                             run_at=now + timedelta(seconds=_retry_delay(func, task.attempts))):
+                    return
+        except IntegrityError:
+            # The same unique_key was queued again meanwhile; that run covers this one
+            pass
+    update_if(task, owned, status='failed', finished_at=now, last_error=error)
+
+
+def execute(task):
+    """Run one claimed task and record the outcome; returns True if it succeeded"""
+    func = resolve(task.name)
+    try:
+        if func is None:
+            raise LookupError(f'Unknown task {task.name}')
+        func(**task.kwargs)
+    except Exception as e:
+        logger.error(f"Task {task.name} #{task.pk} failed (attempt {task.attempts}/{task.max_attempts}): {str(e)}")
+        _fail(task, func, f'{type(e).__name__}: {e}', timezone.now())
+        return False
+    update_if(task, {'status': 'running', 'locked_by': task.locked_by},
+              status='done', finished_at=timezone.now(), last_error='')
+    return True
+
+
+def run_pending(batch_size=None, worker=None, max_batches=None):
+    """Run due tasks batch by batch until none are left; returns how many ran.
+
+    A task that fails is retried after its backoff, not again within this call.
+    """
+    batch_size = batch_size or settings.TASK_BATCH_SIZE
+    worker = worker or worker_name()
+    ran, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        tasks = claim(batch_size, worker)
+        if not tasks:
+            break
+        for task in tasks:
+            execute(task)
+        ran += len(tasks)
+        batches += 1
+    return ran
+
+
+def requeue_stale(now=None):
+    """Put back tasks running for longer than the lease, whose worker died; returns how many were requeued"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    requeued = 0
+    for task in Task.objects.filter(status='running', locked_at__lt=cutoff):
+        _fail(task, resolve(task.name), f'Worker {task.locked_by} did not finish the task', now)
+        requeued += task.status == 'queued'
+    return requeued
+
+
+def purge_finished(now=None):
+    """Delete done tasks older than ``TASK_KEEP_DAYS``; failed ones stay for inspection"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=settings.TASK_KEEP_DAYS)
+    deleted, _ = Task.objects.filter(status='done', finished_at__lt=cutoff).delete()
+    return deleted
@@ -1,17 +1,117 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
 from django.urls import reverse
+from django.utils import timezone
 from django.conf import settings
-from .models import Booking
+from . import (
+    admission, emails, gateway, heavyhitters, hotfiles, lifecycle, ratelimit, reconcile, statements, tasks, uploads,
+    video_store, views, webhooks,
+)
+from .gateway import GatewayClient, GatewayUnavailable
+from .heavyhitters import DenyList, SpaceSaving
+from .media import serve_media
+from .middleware import UploadAdmissionMiddleware
+from .models import Booking, IdempotencyRecord, PDFPurchase, RazorpayWebhookEvent, StoredVideo, Task, UploadSession
+from .mp4 import faststart, find_box, find_path, probe, read_payload
+from .payments import mark_booking_paid
+from .razorpay_standin import RazorpayStandIn
+from .s3_standin import S3StandIn
+from .storage import S3Error
+from .tickets import issue_ticket
+from .transitions import InvalidTransition, booking_status, pdf_payment_status, update_if
+from .video import MAX_VIDEO_SIZE
+from .views import create_booking
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+import hashlib
+import hmac
+import io
 import json
+import os
+import razorpay
+import requests
+import shutil
+import smtplib
+import struct
+import tempfile
+import threading
+import time
 import uuid
 
 
-class BookingModelTest(TestCase):
+# Leading ftyp box of an MP4 file, enough for the upload type sniffing
+MP4_HEADER = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+
+
+def build_mp4(duration=10, width=1080, height=1920, codec=b'avc1', samples=(b'SAMPLE-A', b'SAMPLE-B'), moov_first=False):
+    """Build a tiny but well-formed MP4 whose stco offsets point at ``samples`` in mdat"""
+    def box(box_type, payload):
+        return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+    def moov_box(offsets):
+        mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, duration * 1000) + b'\0' * 80)
+        tkhd = box(b'tkhd', b'\0' * 76 + struct.pack('>II', width << 16, height << 16))
+        hdlr = box(b'hdlr', b'\0' * 8 + b'vide' + b'\0' * 13)
+        stsd = box(b'stsd', b'\0' * 4 + struct.pack('>I', 1) + struct.pack('>I4s', 16, codec) + b'\0' * 8)
+        stco = box(b'stco', b'\0' * 4 + struct.pack('>I', len(offsets)) + b''.join(struct.pack('>I', o) for o in offsets))
+        stbl = box(b'stbl', stsd + stco)
+        trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', stbl)))
+        return box(b'moov', mvhd + trak)
+
+    mdat = box(b'mdat', b''.join(samples))
+    moov_size = len(moov_box([0] * len(samples)))
+    mdat_offset = len(MP4_HEADER) + (moov_size if moov_first else 0)
+    offsets, position = [], mdat_offset + 8
+    for sample in samples:
+        offsets.append(position)
+        position += len(sample)
+
+    moov = moov_box(offsets)
+    return MP4_HEADER + (moov + mdat if moov_first else mdat + moov)
+
+
+class TempMediaTestCase(TestCase):
+    """Base for every test that stores a video or file: isolated MEDIA_ROOT and a clean cache.
+
+    Subclasses list further settings in ``settings_overrides``.
+    """
+
+    settings_overrides = {}
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, **self.settings_overrides)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.client = Client()
+
+    def stored_files(self):
+        return [
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        ]
+
+
+class BookingModelTest(TempMediaTestCase):
     """Test cases for the Booking model"""
     
     def setUp(self):
         """Set up test data"""
+        super().setUp()
         self.valid_booking_data = {
             'name': 'Test Customer',
             'email': 'test@example.com',
@@ -122,12 +222,12 @@ class BookingModelTest(TestCase):
         self.assertEqual(str(booking.amount), '123.45')
 
 
-class BookingViewTest(TestCase):
+class BookingViewTest(TempMediaTestCase):
     """Test cases for the Booking views"""
 
     def setUp(self):
         """Set up test data"""
-        self.client = Client()
+        super().setUp()
         self.valid_booking_data = {
             'name': 'Test Customer',
             'email': 'test@example.com',
@@ -160,7 +260,7 @@ class BookingViewTest(TestCase):
         """Test creating a booking with a video file upload"""
         mock_video = SimpleUploadedFile(
             name="test_video.mp4",
-            content=b"fake video content",
+            content=MP4_HEADER + b"fake video content",
             content_type="video/mp4"
         )
 
@@ -330,7 +430,6 @@ class BookingViewTest(TestCase):
 
     def test_submit_pdf_manual_payment(self):
         """Test submitting manual payment details for PDF"""
-        from .models import PDFPurchase
         purchase = PDFPurchase.objects.create(
             name='PDF Customer',
             email='pdf@example.com',
@@ -466,4 +565,2044 @@ class BookingViewTest(TestCase):
             else:
                 # The 6th request might hit rate limit
                 # This depends on timing, so we check for both possibilities
-                self.assertIn(response.status_code, [200, 201, 429])
\ No newline at end of file
+                self.assertIn(response.status_code, [200, 201, 429])
+
+class GatewayClientTest(TestCase):
+    """Test cases for the Razorpay client's timeouts, retries and circuit breaker"""
+
+    def setUp(self):
+        test = self
+        self.replies = []  # (status, body, delay) per request, last one repeats
+        self.received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                test.received.append((self.command, self.path))
+                status_code, body, delay = test.replies.pop(0) if len(test.replies) > 1 else test.replies[0]
+                time.sleep(delay)
+                payload = json.dumps(body).encode()
+                try:
+                    self.send_response(status_code)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out first
+
+            do_GET = do_POST = reply
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def gateway_client(self, **options):
+        host, port = self.server.server_address[:2]
+        defaults = {'key_id': 'rzp_test', 'key_secret': 'secret', 'read_timeout': 0.5, 'retries': 2,
+                    'breaker_threshold': 2, 'breaker_reset': 60}
+        return GatewayClient(base_url=f'http://{host}:{port}', **{**defaults, **options})
+
+    def test_get_retried_but_post_not(self):
+        """Idempotent fetches are retried on 503; order creation is not"""
+        unavailable = (503, {'error': {'code': 'SERVER_ERROR', 'description': 'down'}}, 0)
+        self.replies = [unavailable, (200, {'id': 'order_1', 'amount': 100}, 0)]
+        self.assertEqual(self.gateway_client().fetch_order('order_1')['id'], 'order_1')
+        self.assertEqual(len(self.received), 2)
+
+        self.received.clear()
+        self.replies = [unavailable, (200, {'id': 'order_2'}, 0)]
+        with self.assertRaises(GatewayUnavailable):
+            self.gateway_client().create_order(100)
+        self.assertEqual(self.received, [('POST', '/v1/orders')])
+
+    def test_read_timeout_bounds_slow_gateway(self):
+        self.replies = [(200, {'id': 'order_1'}, 2)]
+        started = time.monotonic()
+        with self.assertRaises(GatewayUnavailable):
+            self.gateway_client(retries=0).create_order(100)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_breaker_opens_and_fails_fast(self):
+        """After consecutive failures calls are refused without reaching the gateway"""
+        self.replies = [(500, {'error': {'code': 'SERVER_ERROR'}}, 0)]
+        client = self.gateway_client()
+        for _ in range(2):
+            with self.assertRaises(GatewayUnavailable):
+                client.create_order(100)
+        self.assertEqual(client.breaker.state, 'open')
+
+        sent = len(self.received)
+        with self.assertRaises(GatewayUnavailable) as raised:
+            client.create_order(100)
+        self.assertEqual(len(self.received), sent)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+        stats = client.stats()['calls']['order.create']
+        self.assertEqual((stats['calls'], stats['failures'], stats['rejected_by_breaker']), (2, 2, 1))
+
+    def test_breaker_closes_after_successful_trial(self):
+        self.replies = [(500, {'error': {'code': 'SERVER_ERROR'}}, 0)]
+        client = self.gateway_client(breaker_reset=0.01)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                client.create_order(100)
+
+        time.sleep(0.02)
+        self.assertEqual(client.breaker.state, 'half-open')
+        self.replies = [(200, {'id': 'order_3', 'amount': 100, 'currency': 'INR'}, 0)]
+        self.assertEqual(client.create_order(100)['id'], 'order_3')
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_rejected_request_does_not_trip_breaker(self):
+        """A 400 from the gateway is the request's fault, not the gateway's"""
+        self.replies = [(400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'amount too small'}}, 0)]
+        client = self.gateway_client(breaker_threshold=1)
+        with self.assertRaises(razorpay.errors.BadRequestError):
+            client.create_order(1)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_create_order_view_returns_503_when_circuit_open(self):
+        client = self.gateway_client()
+        client.breaker.record_failure()
+        client.breaker.record_failure()
+        with mock.patch.object(gateway, '_gateway', client):
+            response = Client().post(
+                reverse('create_order'), data=json.dumps({'amount': '100'}), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+class OrderReuseTest(TestCase):
+    """Test cases for reusing open Razorpay orders on repeat checkouts"""
+
+    def setUp(self):
+        cache.clear()
+        self.fake_gateway = mock.Mock()
+        self.fake_gateway.create_order.side_effect = lambda amount, **kwargs: {
+            'id': f'order_{self.fake_gateway.create_order.call_count}', 'amount': amount, 'currency': 'INR'
+        }
+        patcher = mock.patch.object(gateway, '_gateway', self.fake_gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.booking = Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210',
+            plan='One Day Story', amount='999.00',
+        )
+
+    def checkout(self):
+        response = self.client.post(
+            reverse('create_order'), data=json.dumps({'booking_id': self.booking.booking_id}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_repeat_checkout_reuses_order(self):
+        """The second checkout is answered from the database"""
+        first = self.checkout()
+        second = self.checkout()
+        self.assertEqual(first, second)
+        self.assertEqual(first['amount'], 99900)
+        self.assertEqual(self.fake_gateway.create_order.call_count, 1)
+
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.razorpay_order_id, first['order_id'])
+        self.assertEqual(self.booking.razorpay_order_amount, 99900)
+
+    def test_expired_or_repriced_order_replaced(self):
+        first = self.checkout()
+        Booking.objects.filter(pk=self.booking.pk).update(razorpay_order_expires_at=timezone.now() - timedelta(seconds=1))
+        second = self.checkout()
+        self.assertNotEqual(first['order_id'], second['order_id'])
+
+        Booking.objects.filter(pk=self.booking.pk).update(amount='1499.00')
+        third = self.checkout()
+        self.assertEqual(third['amount'], 149900)
+        self.assertEqual(self.fake_gateway.create_order.call_count, 3)
+
+    def test_pdf_checkout_reuses_open_purchase(self):
+        data = {'name': 'Reader', 'email': 'reader@example.com', 'phone': '9876543210'}
+        first = self.client.post(reverse('create_pdf_purchase'), data=json.dumps(data), content_type='application/json')
+        second = self.client.post(reverse('create_pdf_purchase'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.json()['order_id'], second.json()['order_id'])
+        self.assertEqual(PDFPurchase.objects.count(), 1)
+        self.assertEqual(self.fake_gateway.create_order.call_count, 1)
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_test')
+class RazorpayWebhookTest(TestCase):
+    """Test cases for the Razorpay webhook inbox and its batch processing"""
+
+    def setUp(self):
+        cache.clear()
+        self.booking = Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210',
+            plan='One Day Story', amount='999.00', razorpay_order_id='order_B1',
+        )
+
+    def deliver(self, event_id, event='payment.captured', order_id='order_B1', payment_id='pay_1', signature=None):
+        body = json.dumps({
+            'event': event,
+            'payload': {'payment': {'entity': {'id': payment_id, 'order_id': order_id, 'amount': 99900}}},
+        }).encode()
+        signature = signature or hmac.new(b'whsec_test', body, hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('razorpay_webhook'), data=body, content_type='application/json',
+            HTTP_X_RAZORPAY_SIGNATURE=signature, HTTP_X_RAZORPAY_EVENT_ID=event_id,
+        )
+
+    def test_invalid_signature_rejected(self):
+        response = self.deliver('evt_1', signature='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RazorpayWebhookEvent.objects.exists())
+
+    def test_redelivery_stored_once_and_acknowledged(self):
+        """Events are only stored by the endpoint; redeliveries are deduplicated on event id"""
+        for _ in range(3):
+            self.assertEqual(self.deliver('evt_1').status_code, 200)
+        self.assertEqual(self.deliver('evt_2', event='payment.failed').json()['status'], 'ignored')
+
+        self.assertEqual(RazorpayWebhookEvent.objects.count(), 1)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'pending')
+
+    def test_batch_processing_applies_payments(self):
+        """Processing marks the booking and PDF purchase paid, as the verify views would"""
+        purchase = PDFPurchase.objects.create(
+            name='Reader', email='reader@example.com', phone='9876543210', razorpay_order_id='order_P1'
+        )
+        self.deliver('evt_1')
+        self.deliver('evt_2', event='order.paid')
+        self.deliver('evt_3', order_id='order_P1', payment_id='pay_2')
+        self.deliver('evt_4', order_id='order_unknown', payment_id='pay_3')
+
+        # One lookup per batch for bookings and purchases, not one per event
+        # (plus queueing the PDF buyer's email and its delivery task)
+        with self.assertNumQueries(9):
+            self.assertEqual(webhooks.process_pending(batch_size=10), 4)
+
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'payment_received')
+        self.assertEqual(self.booking.transaction_id, 'pay_1')
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.payment_status, 'completed')
+        self.assertTrue(purchase.download_token)
+        self.assertEqual(
+            dict(RazorpayWebhookEvent.objects.values_list('event_id', 'status')),
+            {'evt_1': 'processed', 'evt_2': 'processed', 'evt_3': 'processed', 'evt_4': 'ignored'},
+        )
+
+    def test_payment_already_verified_by_browser(self):
+        """A webhook for a payment the verify view already recorded changes nothing"""
+        with override_settings(EMAIL_HOST_USER='admin@example.com'):
+            self.assertTrue(mark_booking_paid(self.booking, 'pay_1'))
+            self.assertFalse(mark_booking_paid(self.booking, 'pay_1'))
+            tasks.run_pending()
+            self.assertEqual(len(mail.outbox), 2)
+
+            self.deliver('evt_1')
+            webhooks.process_pending()
+            tasks.run_pending()
+            self.assertEqual(len(mail.outbox), 2)
+
+
+class PaymentReconciliationTest(TestCase):
+    """Test cases for reconcile_payments against the local Razorpay stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.standin = RazorpayStandIn(key_id='rzp_test', key_secret='test-secret').start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.standin.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.standin.orders.clear()
+        self.standin.payments.clear()
+        client = gateway.GatewayClient(key_id='rzp_test', key_secret='test-secret', base_url=self.standin.base_url)
+        patcher = mock.patch.object(gateway, '_gateway', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def booking(self, amount=99900, paid=False, status='pending', **fields):
+        order = self.standin.create_order(amount)
+        if paid:
+            self.standin.capture(order['id'], amount=paid if paid is not True else None)
+        return Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210', plan='One Day Story',
+            amount=amount / 100, status=status, razorpay_order_id=order['id'], razorpay_order_amount=amount,
+            **fields,
+        )
+
+    def test_stuck_records_fixed_and_reported(self):
+        """Captured payments mark their pending records paid; everything else is only reported"""
+        stuck = self.booking(paid=True)
+        recorded = self.booking(paid=True, status='payment_received')
+        short = self.booking(paid=1000)
+        unpaid = self.booking()
+        order = self.standin.create_order(900)
+        self.standin.capture(order['id'])
+        purchase = PDFPurchase.objects.create(
+            name='Reader', email='reader@example.com', phone='9876543210', razorpay_order_id=order['id']
+        )
+        self.standin.capture(self.standin.create_order(500)['id'])  # not ours
+        self.standin.capture(self.standin.create_order(99900)['id'], status='failed')
+
+        out = StringIO()
+        with override_settings(EMAIL_HOST_USER='admin@example.com'):
+            call_command('reconcile_payments', '--days', '1', stdout=out)
+            call_command('run_tasks', '--once', stdout=StringIO())
+
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'payment_received')
+        self.assertTrue(stuck.transaction_id.startswith('pay_'))
+        for booking, status in ((recorded, 'payment_received'), (short, 'pending'), (unpaid, 'pending')):
+            booking.refresh_from_db()
+            self.assertEqual(booking.status, status)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.payment_status, 'completed')
+        self.assertTrue(purchase.download_token)
+        self.assertEqual(len(mail.outbox), 2)  # customer and admin, for the fixed booking only
+
+        output = out.getvalue()
+        self.assertIn(f'Marked booking {stuck.booking_id} paid', output)
+        self.assertIn(f'Amount mismatch on {short.razorpay_order_id}', output)
+        self.assertIn('1 already recorded', output)
+        self.assertIn('1 unmatched', output)
+
+    def test_month_of_payments_in_bulk(self):
+        """A month is fetched a page at a time, with a fixed number of queries per page"""
+        now = timezone.now()
+        for day in range(30):
+            for _ in range(10):
+                booking = self.booking(paid=False)
+                payment = self.standin.capture(booking.razorpay_order_id)
+                payment['created_at'] = int((now - timedelta(days=day, hours=1)).timestamp())
+
+        dry = reconcile.reconcile(now - timedelta(days=31), now, dry_run=True, page_size=50)
+        self.assertEqual(len(dry.fixed_bookings), 300)
+        self.assertFalse(Booking.objects.exclude(status='pending').exists())
+
+        started = time.monotonic()
+        with CaptureQueriesContext(connection) as queries:
+            report = reconcile.reconcile(now - timedelta(days=31), now, page_size=50, notify=False)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(report.pages, 6)
+        self.assertEqual(len(report.fixed_bookings), 300)
+        self.assertLessEqual(len(queries), report.pages * 8 + 1)
+        self.assertFalse(Booking.objects.filter(status='pending').exists())
+
+        # Running again finds everything already recorded
+        again = reconcile.reconcile(now - timedelta(days=31), now, page_size=50)
+        self.assertEqual(again.already_recorded, 300)
+        self.assertEqual(again.fixed_bookings, [])
+
+
+class ManualPaymentVerificationTest(TestCase):
+    """Test cases for verifying manual payments against bank statement imports"""
+
+    STATEMENT = (
+        'Account Statement,,,,\n'
+        'Account No: XXXX1234,,,,\n'
+        'Txn Date,Narration,UTR No.,Withdrawal Amt.,Deposit Amt.\n'
+        '01/05/2024,UPI/CUSTOMER ONE,412345678901,,"999.00"\n'
+        '01/05/2024,UPI/CUSTOMER TWO,412345678902,,500.00\n'
+        '02/05/2024,UPI/READER,412345678903,,9.00\n'
+        '02/05/2024,ATM WITHDRAWAL,412345678904,2000.00,\n'
+        '03/05/2024,UPI/SOMEONE ELSE,412345678905,,150.00\n'
+        '03/05/2024,UPI/CUSTOMER ONE,412345678901,,"999.00"\n'
+    )
+
+    def manual_booking(self, transaction_id, amount='999.00'):
+        return Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210', plan='One Day Story',
+            amount=amount, status='payment_received', payment_method='manual',
+            transaction_id=transaction_id, payment_verification='unverified',
+        )
+
+    def test_submit_marks_payment_unverified(self):
+        booking = Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210', plan='One Day Story', amount='999.00'
+        )
+        response = self.client.post(
+            reverse('submit_manual_payment'),
+            {'booking_id': booking.booking_id, 'transaction_id': ' 4123 4567 8901 '},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        booking.refresh_from_db()
+        self.assertEqual(booking.transaction_id, '412345678901')
+        self.assertEqual(booking.payment_verification, 'unverified')
+
+    def test_statement_import_verifies_and_flags(self):
+        """One pass over the statement verifies matches and flags mismatches and reused IDs"""
+        paid = self.manual_booking('412345678901')
+        reused = self.manual_booking('412345678901')
+        short = self.manual_booking('412345678902')
+        missing = self.manual_booking('412345678999')
+        purchase = PDFPurchase.objects.create(
+            name='Reader', email='reader@example.com', phone='9876543210', razorpay_order_id='order_P1',
+            payment_status='completed', razorpay_payment_id='manual_412345678903', payment_verification='unverified',
+        )
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as statement:
+            statement.write(self.STATEMENT)
+            statement.flush()
+            dry_out = StringIO()
+            call_command('import_bank_statement', statement.name, '--dry-run', stdout=dry_out)
+            self.assertFalse(Booking.objects.exclude(payment_verification='unverified').exists())
+            out = StringIO()
+            call_command('import_bank_statement', statement.name, stdout=out)
+
+        expected = {paid: 'verified', reused: 'duplicate', short: 'amount_mismatch', missing: 'unverified'}
+        for booking, state in expected.items():
+            booking.refresh_from_db()
+            self.assertEqual(booking.payment_verification, state)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.payment_verification, 'verified')
+        self.assertIsNotNone(purchase.payment_verified_at)
+        self.assertIn('Amount mismatch for', out.getvalue())
+        self.assertIn('5 credits, verified 2 manual payments', out.getvalue())
+        self.assertIn('1 manual payments still unverified', out.getvalue())
+        self.assertEqual(dry_out.getvalue().splitlines()[-1], out.getvalue().splitlines()[-1].replace('verified 2', 'would verify 2'))
+
+    def test_queries_follow_statement_batches(self):
+        """Each batch of credits costs one lookup per model and one UPDATE per outcome"""
+        for n in range(200):
+            self.manual_booking(f'5000{n:08d}')
+        statement = StringIO('UTR,Credit\n' + ''.join(f'5000{n:08d},999.00\n' for n in range(300)))
+
+        # 3 batches x 2 lookups, one UPDATE for each of the 2 batches with claims, 2 outstanding counts
+        with self.assertNumQueries(10):
+            report = statements.verify(statement, batch_size=100)
+        self.assertEqual(len(report.verified), 200)
+        self.assertEqual(report.unclaimed_credits, 100)
+        self.assertEqual(report.outstanding, 0)
+
+
+class StateTransitionTest(TestCase):
+    """Test cases for the conditional status transitions in api/transitions.py"""
+
+    def setUp(self):
+        cache.clear()
+        self.booking = Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210', plan='One Day Story', amount='999.00'
+        )
+
+    def test_only_one_racing_caller_wins(self):
+        """Two copies read while pending: the first UPDATE wins, the second changes nothing"""
+        first = Booking.objects.get(pk=self.booking.pk)
+        second = Booking.objects.get(pk=self.booking.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(booking_status.apply(first, 'pay', transaction_id='pay_1'))
+        self.assertFalse(booking_status.apply(second, 'pay', transaction_id='pay_2'))
+
+        # Only the changed columns are written
+        update = queries.captured_queries[0]['sql']
+        self.assertIn('"transaction_id"', update)
+        self.assertNotIn('"name"', update)
+        self.assertEqual(first.status, 'payment_received')
+        self.assertEqual(second.status, 'pending')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.transaction_id, 'pay_1')
+        with self.assertRaises(InvalidTransition):
+            booking_status.apply(first, 'refund')
+
+    def test_repeated_manual_submission_sends_emails_once(self):
+        data = json.dumps({'booking_id': self.booking.booking_id, 'transaction_id': 'TXN123456789'})
+        with override_settings(EMAIL_HOST_USER='admin@example.com'):
+            response = self.client.post('/api/submit-manual-payment/', data=data, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(tasks.run_pending(), 1)  # one delivery for both emails
+            self.assertEqual(len(mail.outbox), 2)
+            self.assertEqual(
+                sorted(self.booking.emails.values_list('kind', 'status')),
+                [('manual_payment_admin', 'sent'), ('manual_payment_customer', 'sent')],
+            )
+            response = self.client.post('/api/submit-manual-payment/', data=data, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(tasks.run_pending(), 0)
+            self.assertEqual(len(mail.outbox), 2)
+
+        Booking.objects.filter(pk=self.booking.pk).update(status='completed')
+        response = self.client.post('/api/submit-manual-payment/', data=data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'completed')
+
+    def test_first_download_recorded_once(self):
+        purchase = PDFPurchase.objects.create(
+            name='Reader', email='reader@example.com', phone='9876543210', razorpay_order_id='order_P1'
+        )
+        self.assertTrue(pdf_payment_status.apply(purchase, 'pay', razorpay_payment_id='pay_1', download_token='tok'))
+        self.assertFalse(pdf_payment_status.apply(purchase, 'submit_manual', download_token='other'))
+
+        stale = PDFPurchase.objects.get(pk=purchase.pk)
+        self.assertTrue(update_if(purchase, {'downloaded_at__isnull': True}, downloaded_at=timezone.now()))
+        self.assertFalse(update_if(stale, {'downloaded_at__isnull': True}, downloaded_at=timezone.now()))
+        self.assertIsNone(stale.downloaded_at)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.download_token, 'tok')
+
+
+class RateLimitTest(TestCase):
+    """Test cases for the shared sliding-window rate limiter"""
+
+    def setUp(self):
+        cache.clear()
+        ratelimit.reset()
+
+    def test_limit_slides_across_windows(self):
+        """The previous window's count fades out instead of resetting at the boundary"""
+        start = 6000.0  # the start of a 60 second window
+        results = [ratelimit.hit('test', '1.2.3.4', 5, 60, now=start + i) for i in range(6)]
+        self.assertEqual([r.allowed for r in results], [True] * 5 + [False])
+        self.assertEqual(results[-1].retry_after, 55)
+        self.assertTrue(ratelimit.hit('test', '5.6.7.8', 5, 60, now=start + 6).allowed)
+
+        # Just after the boundary the 6 earlier requests still count almost fully
+        self.assertFalse(ratelimit.hit('test', '1.2.3.4', 5, 60, now=start + 61).allowed)
+        # Half a window later half of them have slid out
+        self.assertTrue(ratelimit.hit('test', '1.2.3.4', 5, 60, now=start + 90).allowed)
+
+    def test_steady_state_costs_one_cache_operation(self):
+        """Once the window's counter exists, a request is one atomic increment"""
+        ratelimit.hit('test', '1.2.3.4', 5, 60, now=6000.0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ratelimit.hit('test', '1.2.3.4', 5, 60, now=6001.0).count, 2)
+        statements = [q['sql'] for q in queries.captured_queries if 'api_cache' in q['sql']]
+        self.assertEqual(len(statements), 2)  # SELECT ... FOR UPDATE and UPDATE in one transaction
+        self.assertTrue(statements[1].startswith('UPDATE'))
+
+    def test_database_cache_incr(self):
+        with self.assertRaises(ValueError):
+            cache.incr('counter')
+        cache.add('counter', 1, timeout=60)
+        self.assertEqual(cache.incr('counter', 5), 6)
+        self.assertEqual(cache.decr('counter'), 5)
+        self.assertEqual(cache.get('counter'), 5)
+        cache.set('expired', 1, timeout=-1)
+        with self.assertRaises(ValueError):
+            cache.incr('expired')
+
+    def test_drf_throttle_shares_the_limiter(self):
+        """The anon throttle counts per client IP through the shared cache and sets Retry-After"""
+        with mock.patch.object(ratelimit.AnonRateThrottle, 'THROTTLE_RATES', {'anon': '2/min'}):
+            for _ in range(2):
+                self.assertEqual(self.client.get(reverse('get_pdf_info'), HTTP_X_FORWARDED_FOR='1.2.3.4').status_code, 200)
+            response = self.client.get(reverse('get_pdf_info'), HTTP_X_FORWARDED_FOR='1.2.3.4')
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(response.has_header('Retry-After'))
+            self.assertEqual(self.client.get(reverse('get_pdf_info'), HTTP_X_FORWARDED_FOR='5.6.7.8').status_code, 200)
+
+    def test_forged_forwarded_for_does_not_rotate_the_limit(self):
+        """Entries the client prepends to X-Forwarded-For are not what the limits count by"""
+        forged = lambda n: f'10.9.9.{n}, 1.2.3.4'
+        with mock.patch.object(ratelimit.AnonRateThrottle, 'THROTTLE_RATES', {'anon': '2/min'}):
+            statuses = [
+                self.client.get(reverse('get_pdf_info'), HTTP_X_FORWARDED_FOR=forged(n)).status_code for n in range(3)
+            ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        request = RequestFactory().post('/', HTTP_X_FORWARDED_FOR=forged(0))
+        for n in range(10):
+            request.META['HTTP_X_FORWARDED_FOR'] = forged(n)
+            self.assertTrue(views.check_rate_limit(request, 'test', max_requests=10))
+        self.assertFalse(views.check_rate_limit(request, 'test', max_requests=10))
+
+
+@override_settings(
+    HEAVY_HITTER_THRESHOLDS={'ip': 3, 'prefix': 5, 'agent': 0},
+    HEAVY_HITTER_CAPACITY=16,
+    HEAVY_HITTER_SYNC_INTERVAL=60,
+)
+class HeavyHitterTest(TestCase):
+    """Test cases for heavy-hitter detection and the deny-list on write endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        heavyhitters.reset()
+        self.addCleanup(heavyhitters.reset)
+
+    def track(self, ip):
+        return self.client.post(
+            reverse('track_mediakit_download'), data={}, content_type='application/json', HTTP_X_FORWARDED_FOR=ip
+        )
+
+    def test_space_saving_keeps_heavy_keys_in_fixed_memory(self):
+        counters = SpaceSaving(10)
+        for n in range(1000):
+            counters.add(f'10.1.{n // 256}.{n % 256}')
+            if n % 3 == 0:
+                counters.add('203.0.113.9')
+        self.assertEqual(len(counters.counts), 10)
+        key, count, error = counters.top(1)[0]
+        self.assertEqual(key, '203.0.113.9')
+        self.assertGreaterEqual(count - error, 1)
+        self.assertGreaterEqual(count, 334)
+
+    def test_offenders_denied_by_ip_then_network(self):
+        """A client over its threshold is refused before the view runs; so is a busy /24"""
+        responses = [self.track('10.0.0.1') for _ in range(3)]
+        self.assertEqual([r.status_code == 429 for r in responses], [False, False, True])
+        self.assertTrue(responses[-1].has_header('Retry-After'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.track('10.0.0.1').status_code, 429)
+
+        # Neighbours add up to the network threshold
+        self.assertNotEqual(self.track('10.0.0.2').status_code, 429)
+        self.assertEqual(self.track('10.0.0.3').status_code, 429)
+        self.assertEqual(self.track('10.0.0.4').status_code, 429)
+        self.assertNotEqual(self.track('10.0.1.1').status_code, 429)
+        # Reads are not watched
+        self.assertEqual(self.client.get(reverse('get_pdf_info'), HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 200)
+
+    def test_forged_forwarded_for_is_ignored(self):
+        """Rotating a made-up first X-Forwarded-For entry does not dodge the per-IP count"""
+        statuses = [
+            self.client.post(
+                reverse('track_mediakit_download'), data={}, content_type='application/json',
+                HTTP_X_FORWARDED_FOR=f'198.51.100.{n}, 10.0.0.1',
+            ).status_code
+            for n in range(3)
+        ]
+        self.assertEqual(statuses[-1], 429)
+
+    def test_deny_list_shared_between_workers(self):
+        for _ in range(3):
+            self.track('10.0.0.1')
+        other_worker = DenyList()
+        keys = {'ip': '10.0.0.1', 'prefix': '10.0.0.0/24', 'agent': '-'}
+        self.assertEqual(other_worker.match(keys)[:2], ('ip', '10.0.0.1'))
+
+    def test_top_talkers_view(self):
+        for _ in range(2):
+            self.track('10.0.0.1')
+        self.track('192.0.2.7')
+
+        User.objects.create_user('user', password='pw')
+        self.client.login(username='user', password='pw')
+        self.assertEqual(self.client.get(reverse('top_talkers')).status_code, 403)
+
+        User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.login(username='admin', password='pw')
+        report = self.client.get(reverse('top_talkers')).json()
+        self.assertEqual(report['windows'][0]['top']['ip'][0], {'value': '10.0.0.1', 'count': 2, 'error': 0})
+
+        response = self.client.post(
+            reverse('top_talkers'), {'action': 'deny', 'kind': 'ip', 'value': '192.0.2.7'}, content_type='application/json'
+        )
+        self.assertEqual(response.json()['denied'][0]['value'], '192.0.2.7')
+        self.client.logout()
+        self.assertEqual(self.track('192.0.2.7').status_code, 429)
+
+        self.client.login(username='admin', password='pw')
+        self.client.post(
+            reverse('top_talkers'), {'action': 'allow', 'kind': 'ip', 'value': '192.0.2.7'}, content_type='application/json'
+        )
+        self.client.logout()
+        self.assertNotEqual(self.track('192.0.2.7').status_code, 429)
+
+
+TASK_CALLS = []
+
+
+def record_call(label, fail=False):
+    TASK_CALLS.append(label)
+    if fail:
+        raise RuntimeError(f'{label} failed')
+
+
+class TaskQueueTest(TestCase):
+    """Test cases for the database-backed background task queue"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        tasks.task(max_attempts=3, retry_delay=10)(record_call)
+
+    def setUp(self):
+        TASK_CALLS.clear()
+
+    def test_due_tasks_run_by_priority_then_age(self):
+        """Higher priority first, then oldest; delayed tasks wait for their time"""
+        with self.assertNumQueries(1):
+            tasks.enqueue(record_call, {'label': 'normal'})
+        tasks.enqueue(record_call, {'label': 'urgent'}, priority=5)
+        later = tasks.enqueue(record_call, {'label': 'later'}, delay=60)
+
+        self.assertEqual(tasks.run_pending(), 2)
+        self.assertEqual(TASK_CALLS, ['urgent', 'normal'])
+        self.assertEqual(Task.objects.filter(status='done').count(), 2)
+        later.refresh_from_db()
+        self.assertEqual(later.status, 'queued')
+
+    def test_failures_retried_with_backoff_until_failed(self):
+        """A raising task is requeued with a growing delay, then marked failed"""
+        task = record_call.delay(label='flaky', fail=True)
+        self.assertEqual(tasks.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('queued', 1))
+        delay = (task.run_at - timezone.now()).total_seconds()
+        self.assertTrue(8 < delay <= 11, delay)
+        self.assertIn('RuntimeError: flaky failed', task.last_error)
+
+        # Not retried before its time
+        self.assertEqual(tasks.run_pending(), 0)
+        for attempt, max_delay in ((2, 22), (3, None)):
+            [claimed] = tasks.claim(10, now=timezone.now() + timedelta(seconds=30))
+            self.assertFalse(tasks.execute(claimed))
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.attempts, attempt)
+            if max_delay:
+                self.assertEqual(claimed.status, 'queued')
+                self.assertLessEqual((claimed.run_at - timezone.now()).total_seconds(), max_delay)
+        self.assertEqual(claimed.status, 'failed')
+        self.assertIsNotNone(claimed.finished_at)
+        self.assertEqual(TASK_CALLS, ['flaky'] * 3)
+
+    def test_unique_key_keeps_one_queued_task(self):
+        """Enqueueing a queued key again is dropped; once it runs a new one can queue"""
+        for _ in range(3):
+            tasks.enqueue(record_call, {'label': 'inbox'}, unique_key='inbox')
+        self.assertEqual(Task.objects.count(), 1)
+
+        tasks.claim(10, worker='w1')
+        tasks.enqueue(record_call, {'label': 'inbox'}, unique_key='inbox')
+        self.assertEqual(Task.objects.filter(status='queued').count(), 1)
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_claims_are_exclusive_and_stale_tasks_requeued(self):
+        """A claimed task is not handed out again until its worker's lease runs out"""
+        task = record_call.delay(label='once')
+        [first] = tasks.claim(10, worker='w1')
+        self.assertEqual(tasks.claim(10, worker='w2'), [])
+
+        lease = timedelta(seconds=settings.TASK_LEASE_SECONDS + 1)
+        self.assertEqual(tasks.requeue_stale(now=timezone.now() + lease), 1)
+        [second] = tasks.claim(10, worker='w2', now=timezone.now() + 2 * lease)
+        self.assertEqual((second.pk, second.attempts), (task.pk, 2))
+
+        # The first worker finishing late does not overwrite the second's claim
+        self.assertTrue(tasks.execute(first))
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.locked_by), ('running', 'w2'))
+        self.assertTrue(tasks.execute(second))
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'done')
+
+
+class ScriptedEmailBackend:
+    """Email backend that counts connections and fails sends as a test scripts it"""
+
+    opened = 0
+    sent = []
+    # Raised by the next open() or send_messages() calls, in order
+    open_failures = []
+    send_failures = []
+
+    def __init__(self, fail_silently=False, **kwargs):
+        pass
+
+    def open(self):
+        if self.open_failures:
+            raise self.open_failures.pop(0)
+        type(self).opened += 1
+        return True
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.send_failures:
+            raise self.send_failures.pop(0)
+        self.sent.extend(messages)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND='api.tests.ScriptedEmailBackend', EMAIL_BATCH_SIZE=2, EMAIL_RETRY_DELAY=60)
+class EmailDeliveryTest(TestCase):
+    """Test cases for queued email delivery over a shared SMTP connection"""
+
+    def setUp(self):
+        ScriptedEmailBackend.opened = 0
+        ScriptedEmailBackend.sent = []
+        ScriptedEmailBackend.open_failures = []
+        ScriptedEmailBackend.send_failures = []
+        self.queued = 0
+        self.booking = Booking.objects.create(
+            name='Test Customer', email='test@example.com', contact='9876543210', plan='Post', amount='10'
+        )
+
+    def queue(self, count):
+        start, self.queued = self.queued, self.queued + count
+        return [
+            emails.queue(f'Subject {n}', 'Body', 'shop@example.com', [f'user{n}@example.com'],
+                         booking=self.booking, kind='test')
+            for n in range(start, self.queued)
+        ]
+
+    def test_batches_share_one_connection(self):
+        """Queueing does not touch SMTP; one delivery sends everything over one login"""
+        with self.assertNumQueries(2):
+            self.queue(1)
+        self.queue(4)
+        self.assertEqual(ScriptedEmailBackend.opened, 0)
+
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(ScriptedEmailBackend.opened, 1)
+        self.assertEqual([m.to for m in ScriptedEmailBackend.sent], [[f'user{n}@example.com'] for n in range(5)])
+        self.assertEqual(set(self.booking.emails.values_list('status', flat=True)), {'sent'})
+
+    def test_transient_failures_retried_and_permanent_ones_dropped(self):
+        """A dropped connection is reopened and the message retried later; a 5xx refusal is final"""
+        dropped, refused, fine = self.queue(3)
+        ScriptedEmailBackend.send_failures = [
+            smtplib.SMTPServerDisconnected('Connection unexpectedly closed'),
+            smtplib.SMTPRecipientsRefused({'user1@example.com': (550, b'No such user')}),
+        ]
+        self.assertEqual(emails.deliver(), 1)
+        self.assertEqual(ScriptedEmailBackend.opened, 2)
+
+        for email in (dropped, refused, fine):
+            email.refresh_from_db()
+        self.assertEqual((dropped.status, dropped.attempts), ('queued', 1))
+        self.assertIn('SMTPServerDisconnected', dropped.last_error)
+        self.assertEqual(refused.status, 'failed')
+        self.assertEqual(fine.status, 'sent')
+
+        retry = Task.objects.get(unique_key=emails.RETRY_KEY)
+        self.assertEqual(retry.run_at, dropped.next_attempt_at)
+        self.assertGreater(retry.run_at, timezone.now() + timedelta(seconds=50))
+
+        dropped.next_attempt_at = timezone.now()
+        dropped.save()
+        self.assertEqual(emails.deliver(), 1)
+        dropped.refresh_from_db()
+        self.assertEqual((dropped.status, dropped.attempts), ('sent', 2))
+
+    def test_earlier_retry_moves_queued_retry_forward(self):
+        """A retry due sooner than the one already queued is not lost to the unique key"""
+        later = timezone.now() + timedelta(hours=1)
+        tasks.enqueue(emails.deliver, run_at=later, unique_key=emails.RETRY_KEY)
+        [email] = self.queue(1)
+        email.next_attempt_at = timezone.now() + timedelta(minutes=1)
+        email.save()
+
+        emails.deliver()
+        retry = Task.objects.get(unique_key=emails.RETRY_KEY)
+        self.assertEqual(retry.run_at, email.next_attempt_at)
+
+    def test_unreachable_server_leaves_emails_queued(self):
+        """If SMTP cannot be reached, no email is touched and the delivery task is retried"""
+        [email] = self.queue(1)
+        ScriptedEmailBackend.open_failures = [ConnectionRefusedError('Connection refused')]
+        tasks.run_pending()
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('queued', 0))
+        task = Task.objects.get(unique_key=emails.DELIVER_KEY)
+        self.assertEqual((task.status, task.attempts), ('queued', 1))
+        self.assertIn('ConnectionRefusedError', task.last_error)
+
+    # The admin templates need static files, which the tests never collect
+    @override_settings(STORAGES={
+        **settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_admin_warns_when_no_worker_sends_mail(self):
+        """Mail left queued past EMAIL_STALE_AFTER is flagged on the admin changelists"""
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        [email] = self.queue(1)
+        response = self.client.get('/admin/api/booking/')
+        self.assertNotContains(response, 'run_tasks')
+
+        email.next_attempt_at = timezone.now() - timedelta(seconds=settings.EMAIL_STALE_AFTER + 60)
+        email.save()
+        response = self.client.get('/admin/api/booking/')
+        self.assertContains(response, '1 emails have been waiting to be sent')
+
+@override_settings(
+    EMAIL_HOST_USER='admin@example.com',
+    ADMIN_NOTIFICATIONS='digest',
+    ADMIN_DIGEST_INTERVAL=3600,
+    ADMIN_DIGEST_IMMEDIATE_AMOUNT=1000,
+)
+class AdminDigestTest(TestCase):
+    """Test cases for collecting admin notifications into a periodic digest"""
+
+    def paid_booking(self, name, amount):
+        booking = Booking.objects.create(
+            name=name, email=f'{name.lower()}@example.com', contact='9876543210', plan='Post', amount=amount
+        )
+        self.assertTrue(mark_booking_paid(booking, f'pay_{name}'))
+        return booking
+
+    def test_small_bookings_held_for_one_digest(self):
+        """Admin emails below the threshold wait for the interval's digest; large ones go at once"""
+        small = [self.paid_booking('Asha', '199.00'), self.paid_booking('Ravi', '499.00')]
+        large = self.paid_booking('Meera', '4999.00')
+        tasks.run_pending()
+
+        sent = sorted(m.subject for m in mail.outbox if m.to == ['admin@example.com'])
+        self.assertEqual(sent, ['💰 New Booking: Meera - ₹4999.00'])
+        self.assertEqual(len(mail.outbox), 4)  # three customers, one admin
+
+        digest_task = Task.objects.get(unique_key=emails.DIGEST_KEY)
+        self.assertEqual(digest_task.status, 'queued')
+        self.assertEqual(digest_task.run_at.timestamp() % 3600, 0)
+        self.assertGreater(digest_task.run_at, timezone.now())
+
+        [claimed] = tasks.claim(10, now=digest_task.run_at)
+        self.assertTrue(tasks.execute(claimed))
+        tasks.run_pending()
+
+        digest = mail.outbox[-1]
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(digest.subject, '📋 ChittorgarhVlog digest: 2 new notifications')
+        self.assertIn('Bookings: 2 (₹698.00)', digest.body)
+        for booking in small:
+            self.assertIn(f'New Booking: {booking.name}', digest.body)
+            held = booking.emails.get(kind='booking_paid_admin')
+            self.assertEqual((held.status, held.digest.status), ('digested', 'sent'))
+        self.assertNotIn('Meera', digest.body)
+        self.assertEqual(large.emails.get(kind='booking_paid_admin').status, 'sent')
+
+        # Nothing new, nothing sent
+        self.assertIsNone(emails.send_admin_digest())
+
+    def test_digest_task_queued_once_per_interval(self):
+        """Every held notification tries to queue the digest; only one waits"""
+        for name in ('Asha', 'Ravi', 'Kavya'):
+            self.paid_booking(name, '99.00')
+        self.assertEqual(Task.objects.filter(unique_key=emails.DIGEST_KEY).count(), 1)
+
+
+class ResumableUploadTest(TempMediaTestCase):
+    """Test cases for the resumable chunked upload endpoints"""
+
+    settings_overrides = {'UPLOAD_CHUNK_SIZE': 12}
+
+    def setUp(self):
+        super().setUp()
+        self.booking = Booking.objects.create(
+            name='Upload Customer',
+            email='upload@example.com',
+            contact='9876543210',
+            plan='One Day Story',
+            amount='999.00'
+        )
+        self.content = MP4_HEADER + b'abcdef'  # 3 chunks of 12, 12 and 6 bytes
+
+    def open_session(self):
+        response = self.client.post(
+            '/api/uploads/',
+            data=json.dumps({
+                'booking_id': self.booking.booking_id,
+                'filename': 'clip.mp4',
+                'content_type': 'video/mp4',
+                'total_size': len(self.content),
+            }),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put_chunk(self, upload_id, index, data):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/chunks/{index}/',
+            data=data,
+            content_type='application/octet-stream'
+        )
+
+    def test_chunked_upload_resume_and_finalize(self):
+        """Chunks can be resumed from the reported offset and finalized into the booking"""
+        session = self.open_session()
+        self.assertEqual(session['total_chunks'], 3)
+        upload_id = session['upload_id']
+
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[0:12]).status_code, 200)
+
+        # Client reconnects and re-opens the same upload: it resumes the session
+        resumed = self.open_session()
+        self.assertEqual(resumed['upload_id'], upload_id)
+        self.assertEqual(resumed['next_chunk'], 1)
+
+        # Finalizing early is refused
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 409)
+
+        # Retrying an already-stored chunk is harmless
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[0:12]).json()['received_bytes'], 12)
+        self.put_chunk(upload_id, 1, self.content[12:24])
+        response = self.put_chunk(upload_id, 2, self.content[24:])
+        self.assertTrue(response.json()['complete'])
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 200)
+
+        self.booking.refresh_from_db()
+        self.assertTrue(self.booking.video_file.name.startswith('uploaded_videos/'))
+        with self.booking.video_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_failed_finalize_can_be_retried(self):
+        """A finalize that fails while storing the video leaves the session open for a retry"""
+        upload_id = self.open_session()['upload_id']
+        for index in range(3):
+            self.put_chunk(upload_id, index, self.content[index * 12:(index + 1) * 12])
+
+        with mock.patch.object(video_store, 'ingest', side_effect=OSError('disk full')):
+            response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(UploadSession.objects.get(upload_id=upload_id).status, 'active')
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UploadSession.objects.get(upload_id=upload_id).status, 'completed')
+        self.booking.refresh_from_db()
+        with self.booking.video_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_out_of_order_and_wrong_size_chunks_rejected(self):
+        """Chunks ahead of the received offset or of the wrong length are rejected"""
+        upload_id = self.open_session()['upload_id']
+
+        response = self.put_chunk(upload_id, 1, self.content[12:24])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['next_chunk'], 0)
+
+        response = self.put_chunk(upload_id, 0, self.content[0:3])
+        self.assertEqual(response.status_code, 400)
+
+        # The first chunk is sniffed: a renamed text file is refused outright
+        response = self.put_chunk(upload_id, 0, b'not a video!')
+        self.assertEqual(response.status_code, 415)
+
+        response = self.client.get(f'/api/uploads/{upload_id}/')
+        self.assertEqual(response.json()['received_bytes'], 0)
+
+
+    def test_direct_mode_falls_back_to_chunks_on_local_storage(self):
+        """Filesystem storage cannot presign uploads, so a direct request gets a chunked session"""
+        response = self.client.post(
+            '/api/uploads/',
+            data=json.dumps({
+                'booking_id': self.booking.booking_id,
+                'filename': 'clip.mp4',
+                'content_type': 'video/mp4',
+                'total_size': len(self.content),
+                'sha256': hashlib.sha256(self.content).hexdigest(),
+                'mode': 'direct',
+            }),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['mode'], 'chunked')
+        self.assertNotIn('upload_target', response.json())
+
+class StreamingVideoUploadTest(TempMediaTestCase):
+    """Test cases for the streaming booking video upload handler"""
+
+    def setUp(self):
+        super().setUp()
+        self.valid_booking_data = {
+            'name': 'Test Customer',
+            'email': 'test@example.com',
+            'contact': '9876543210',
+            'plan': 'One Day Story',
+            'amount': '999.00'
+        }
+
+    def test_video_streamed_to_final_location(self):
+        """The uploaded video is written once, directly under uploaded_videos/"""
+        content = MP4_HEADER + b'x' * 5000
+        booking_data = self.valid_booking_data.copy()
+        booking_data['video_file'] = SimpleUploadedFile('clip.mp4', content, content_type='video/mp4')
+
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        self.assertEqual(response.status_code, 201)
+
+        booking = Booking.objects.get(booking_id=response.json()['booking_id'])
+        self.assertTrue(booking.video_file.name.startswith('uploaded_videos/'))
+        self.assertEqual(self.stored_files(), [booking.video_file.path])
+        with booking.video_file.open('rb') as fh:
+            self.assertEqual(fh.read(), content)
+
+    def test_mislabelled_video_rejected_from_leading_bytes(self):
+        """A non-video body is rejected despite a video content type, and nothing is kept"""
+        booking_data = self.valid_booking_data.copy()
+        booking_data['video_file'] = SimpleUploadedFile('clip.mp4', b'<html>' * 200, content_type='video/mp4')
+
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not supported', response.json()['error'])
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_video_discarded_when_booking_invalid(self):
+        """A stored video is removed again when the booking fields fail validation"""
+        booking_data = self.valid_booking_data.copy()
+        booking_data['contact'] = '123'
+        booking_data['video_file'] = SimpleUploadedFile('clip.mp4', MP4_HEADER, content_type='video/mp4')
+
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_oversized_body_refused_by_view_without_middleware(self):
+        """The handler's own size check answers 400, not a server error, when reached"""
+        request = RequestFactory().post(reverse('create_booking'), data=self.valid_booking_data)
+        request.META['CONTENT_LENGTH'] = str(600 * 1024 * 1024)
+        response = create_booking(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', response.data['error'])
+        self.assertFalse(Booking.objects.exists())
+
+
+class UploadAdmissionTest(TempMediaTestCase):
+    """Test cases for the booking pre-flight check and upload admission middleware"""
+
+    settings_overrides = {'UPLOAD_TICKET_THRESHOLD': 1024}
+
+    def setUp(self):
+        super().setUp()
+        self.content = MP4_HEADER + b'x' * 4000
+        self.booking_data = {
+            'name': 'Test Customer',
+            'email': 'test@example.com',
+            'contact': '9876543210',
+            'plan': 'One Day Story',
+            'amount': '999.00'
+        }
+
+    def preflight(self, **overrides):
+        data = {
+            **self.booking_data,
+            'video_filename': 'clip.mp4',
+            'video_content_type': 'video/mp4',
+            'video_size': len(self.content),
+            **overrides,
+        }
+        return self.client.post(reverse('preflight_booking'), data=json.dumps(data), content_type='application/json')
+
+    def post_booking(self, ticket=None):
+        data = {**self.booking_data, 'video_file': SimpleUploadedFile('clip.mp4', self.content, content_type='video/mp4')}
+        headers = {'HTTP_X_UPLOAD_TICKET': ticket} if ticket else {}
+        return self.client.post(reverse('create_booking'), data=data, **headers)
+
+    def test_preflight_rejects_invalid_booking(self):
+        """Pre-flight applies create_booking's field and video checks"""
+        response = self.preflight(contact='123')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Contact number must be 10-15 digits')
+
+        response = self.preflight(video_size=600 * 1024 * 1024)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', response.json()['error'])
+
+    def test_preflight_ignores_declared_video_type(self):
+        """An empty or unusual declared type gets a ticket; the upload itself is sniffed"""
+        for content_type in ('', 'application/octet-stream', 'video/3gpp'):
+            response = self.preflight(video_content_type=content_type)
+            self.assertEqual(response.status_code, 200)
+        ticket = self.preflight(video_content_type='').json()['ticket']
+        self.assertEqual(self.post_booking(ticket).status_code, 201)
+
+    def test_large_upload_requires_ticket(self):
+        """A large body without a ticket is refused and nothing is stored"""
+        response = self.post_booking()
+        self.assertEqual(response.status_code, 428)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_ticket_admits_one_upload(self):
+        """A pre-flight ticket admits exactly one upload"""
+        ticket = self.preflight().json()['ticket']
+
+        response = self.post_booking(ticket)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['video_attached'])
+
+        response = self.post_booking(ticket)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_ticket_bounds_body_size(self):
+        """A body larger than the video declared in pre-flight is refused"""
+        ticket = self.preflight(video_size=100).json()['ticket']
+        self.content += b'x' * (128 * 1024)
+
+        response = self.post_booking(ticket)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_oversized_content_length_refused_before_body_is_read(self):
+        """Content-Length over the video limit is answered without reading the body"""
+        def view(request):
+            raise AssertionError('view must not run')
+
+        request = RequestFactory().post(reverse('create_booking'), data=b'', content_type='application/octet-stream')
+        request.META['CONTENT_LENGTH'] = str(600 * 1024 * 1024)
+        response = UploadAdmissionMiddleware(view)(request)
+        self.assertEqual(response.status_code, 413)
+
+    def test_tampered_ticket_refused(self):
+        ticket = self.preflight().json()['ticket']
+        response = self.post_booking(ticket[:-2] + 'xx')
+        self.assertEqual(response.status_code, 403)
+
+
+class UploadConcurrencyTest(TempMediaTestCase):
+    """Test cases for upload admission control"""
+
+    settings_overrides = {
+        'UPLOAD_TICKET_THRESHOLD': 1024,
+        'UPLOAD_MAX_CONCURRENT': 1,
+        'UPLOAD_MAX_CONCURRENT_PER_PROCESS': 1,
+        'UPLOAD_QUEUE_TIMEOUT': 0,
+        # The threads below would contend for the in-memory SQLite test database's cache table
+        'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.booking = Booking.objects.create(
+            name='Test Customer',
+            email='test@example.com',
+            contact='9876543210',
+            plan='One Day Story',
+            amount='999.00'
+        )
+
+    def post_video(self, ticket=None):
+        data = {'video_file': SimpleUploadedFile('clip.mp4', MP4_HEADER + b'x' * 4000, content_type='video/mp4')}
+        return self.client.post(
+            reverse('create_booking'), data=data, HTTP_X_UPLOAD_TICKET=ticket or issue_ticket(1024 * 1024)
+        )
+
+    def test_excess_upload_rejected_with_retry_after(self):
+        """An upload finding every slot taken gets 503 with Retry-After; other endpoints are unaffected"""
+        slot = admission.acquire()
+        ticket = issue_ticket(1024 * 1024)
+        response = self.post_video(ticket)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.UPLOAD_RETRY_AFTER))
+
+        response = self.client.get(reverse('booking_status', args=[self.booking.booking_id]))
+        self.assertEqual(response.status_code, 200)
+
+        # The ticket was not spent on the refused request
+        slot.release()
+        self.assertEqual(self.post_video(ticket).status_code, 400)
+
+    def test_slot_released_after_upload(self):
+        """Slots are given back when the request ends, whatever its outcome"""
+        self.assertEqual(self.post_video().status_code, 400)
+        self.assertEqual(self.post_video().status_code, 400)
+        self.assertEqual(admission.metrics()['in_flight'], 0)
+        self.assertEqual(admission.metrics()['admitted'], 2)
+
+    def test_refused_upload_takes_no_slot(self):
+        """Uploads the admission middleware refuses never claim an upload slot"""
+        data = {'video_file': SimpleUploadedFile('clip.mp4', MP4_HEADER + b'x' * 4000, content_type='video/mp4')}
+        self.assertEqual(self.client.post(reverse('create_booking'), data=data).status_code, 428)
+        self.assertEqual(admission.metrics()['admitted'], 0)
+
+    def test_slot_lease_covers_slow_uploads(self):
+        """A slot outlives the slowest allowed upload of its body"""
+        self.assertEqual(admission.slot_lease(0), settings.UPLOAD_SLOT_LEASE)
+        self.assertGreaterEqual(admission.slot_lease(MAX_VIDEO_SIZE) * settings.UPLOAD_MIN_RATE, MAX_VIDEO_SIZE)
+
+    def test_waiting_upload_admitted_when_slot_frees(self):
+        """A queued request takes the slot as soon as it is released"""
+        slot = admission.acquire()
+        threading.Timer(0.2, slot.release).start()
+        with override_settings(UPLOAD_QUEUE_TIMEOUT=5):
+            queued = admission.acquire()
+        self.assertIsNotNone(queued)
+        queued.release()
+
+        metrics = admission.metrics()
+        self.assertEqual((metrics['admitted'], metrics['queued'], metrics['queue_depth']), (2, 1, 0))
+
+    def test_metrics_require_staff(self):
+        slot = admission.acquire()
+        self.post_video()
+        slot.release()
+
+        user = User.objects.create_user('viewer', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('upload_metrics')).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('upload_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertEqual(response.json()['in_flight'], 0)
+
+
+class IdempotencyTest(TempMediaTestCase):
+    """Test cases for Idempotency-Key replay"""
+
+    settings_overrides = {'UPLOAD_TICKET_THRESHOLD': 1024, 'IDEMPOTENCY_WAIT_SECONDS': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.booking_data = {
+            'name': 'Test Customer',
+            'email': 'test@example.com',
+            'contact': '9876543210',
+            'plan': 'One Day Story',
+            'amount': '999.00'
+        }
+
+    def test_retried_booking_replayed(self):
+        """A retry with the same key gets the first response and creates nothing"""
+        first = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1')
+        second = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Booking.objects.count(), 1)
+
+        third = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertNotEqual(third.json()['booking_id'], first.json()['booking_id'])
+
+    def test_reused_key_for_different_request_refused(self):
+        """A key reused with other booking details gets 422, not the first booking's response"""
+        first = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, 201)
+
+        other = {**self.booking_data, 'name': 'Someone Else'}
+        response = self.client.post(reverse('create_booking'), data=other, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_reused_key_for_same_size_booking_refused(self):
+        """A small booking is never replayed on its Content-Length alone"""
+        first = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, 201)
+
+        other = {**self.booking_data, 'name': 'Rest Customer'}
+        response = self.client.post(reverse('create_booking'), data=other, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_key_scoped_to_client(self):
+        """Another client sending the same key gets its own booking, not the first one's response"""
+        first = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1')
+        other = self.client.post(
+            reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='key-1', REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(other.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertNotEqual(other.json()['booking_id'], first.json()['booking_id'])
+        self.assertEqual(IdempotencyRecord.objects.filter(key='key-1').count(), 2)
+
+    def test_reused_order_key_for_other_amount_refused(self):
+        fake = mock.Mock()
+        fake.create_order.return_value = {'id': 'order_1', 'amount': 50000, 'currency': 'INR'}
+        with mock.patch.object(gateway, '_gateway', fake):
+            statuses = [
+                self.client.post(
+                    reverse('create_order'), data=json.dumps({'amount': amount}),
+                    content_type='application/json', HTTP_IDEMPOTENCY_KEY='order-key'
+                ).status_code
+                for amount in ('500', '900')
+            ]
+        self.assertEqual(statuses, [200, 422])
+        self.assertEqual(fake.create_order.call_count, 1)
+
+    def test_retried_upload_replayed_without_ticket(self):
+        """Retrying a video upload that already succeeded needs no new ticket and reads no body"""
+        preflight = self.client.post(
+            reverse('preflight_booking'),
+            data=json.dumps({**self.booking_data, 'video_filename': 'clip.mp4', 'video_content_type': 'video/mp4', 'video_size': 4000}),
+            content_type='application/json'
+        ).json()
+        video = lambda: SimpleUploadedFile('clip.mp4', MP4_HEADER + b'x' * 3900, content_type='video/mp4')
+        first = self.client.post(
+            reverse('create_booking'), data={**self.booking_data, 'video_file': video()},
+            HTTP_IDEMPOTENCY_KEY='upload-1', HTTP_X_UPLOAD_TICKET=preflight['ticket']
+        )
+        retry = self.client.post(
+            reverse('create_booking'), data={**self.booking_data, 'video_file': video()},
+            HTTP_IDEMPOTENCY_KEY='upload-1', HTTP_X_UPLOAD_TICKET=preflight['ticket']
+        )
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json()['booking_id'], first.json()['booking_id'])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_retry_while_first_request_in_flight(self):
+        """A retry racing the original gets 409 until it finishes; a dead claim is taken over"""
+        record = IdempotencyRecord.objects.create(
+            scope='create_booking', key='busy', client='ip:127.0.0.1', expires_at=timezone.now() + timedelta(hours=1)
+        )
+        response = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='busy')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(Booking.objects.exists())
+
+        IdempotencyRecord.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(hours=2))
+        response = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='busy')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get(key='busy').status, 'completed')
+
+    def test_rate_limited_response_not_stored(self):
+        """Transient failures are not replayed; the retry runs the request again"""
+        with mock.patch.object(views, 'check_rate_limit', return_value=False):
+            response = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+        response = self.client.post(reverse('create_booking'), data=self.booking_data, HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 201)
+
+    def test_order_creation_replayed(self):
+        fake = mock.Mock()
+        fake.create_order.return_value = {'id': 'order_1', 'amount': 50000, 'currency': 'INR'}
+        with mock.patch.object(gateway, '_gateway', fake):
+            for _ in range(3):
+                response = self.client.post(
+                    reverse('create_order'), data=json.dumps({'amount': '500'}),
+                    content_type='application/json', HTTP_IDEMPOTENCY_KEY='order-key'
+                )
+                self.assertEqual(response.json()['order_id'], 'order_1')
+        self.assertEqual(fake.create_order.call_count, 1)
+
+
+class VideoStoreTest(TempMediaTestCase):
+    """Test cases for the content-addressed, deduplicating video store"""
+
+    content = MP4_HEADER + b'same bytes every time'
+
+    def setUp(self):
+        super().setUp()
+        self.valid_booking_data = {
+            'name': 'Test Customer',
+            'email': 'test@example.com',
+            'contact': '9876543210',
+            'plan': 'One Day Story',
+            'amount': '999.00'
+        }
+
+    def upload(self, **extra):
+        booking_data = self.valid_booking_data.copy()
+        booking_data.update(extra)
+        return self.client.post(reverse('create_booking'), data=booking_data)
+
+    def test_duplicate_uploads_share_one_file(self):
+        """Re-uploading the same video stores it once and counts references"""
+        for _ in range(2):
+            response = self.upload(video_file=SimpleUploadedFile('clip.mp4', self.content, content_type='video/mp4'))
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(response.json()['video_attached'])
+
+        blob = StoredVideo.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(self.stored_files(), [blob.file.path])
+        self.assertEqual(set(Booking.objects.values_list('video_file', flat=True)), {blob.file.name})
+
+        # The file survives until the last booking referencing it is gone
+        Booking.objects.first().delete()
+        self.assertTrue(os.path.exists(blob.file.path))
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.first().delete()
+        self.assertFalse(StoredVideo.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_known_digest_skips_transfer(self):
+        """A client presenting the digest of a stored video does not upload it again"""
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.upload(video_file=SimpleUploadedFile('clip.mp4', self.content, content_type='video/mp4'))
+
+        response = self.upload(video_sha256=digest)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['video_attached'])
+
+        booking = Booking.objects.create(
+            name='Other Customer', email='other@example.com', contact='9876543210',
+            plan='One Day Story', amount='999.00'
+        )
+        response = self.client.post(
+            '/api/uploads/',
+            data=json.dumps({
+                'booking_id': booking.booking_id,
+                'filename': 'clip.mp4',
+                'content_type': 'video/mp4',
+                'total_size': len(self.content),
+                'sha256': digest,
+            }),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['upload_required'])
+        booking.refresh_from_db()
+        self.assertEqual(booking.stored_video.ref_count, 3)
+
+    def test_unknown_digest_requires_upload(self):
+        """A digest the server does not hold creates the booking without a video"""
+        response = self.upload(video_sha256='a' * 64)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.json()['video_attached'])
+
+
+class VideoLifecycleTest(TempMediaTestCase):
+    """Test cases for stored-video retention and high-water eviction"""
+
+    settings_overrides = {'VIDEO_LIFECYCLE_INTERVAL': 0}
+
+    def store(self, content=None):
+        content = content or MP4_HEADER + uuid.uuid4().bytes
+        path = video_store.scratch_path(f'{video_store.INCOMING_DIR}/{uuid.uuid4().hex}.part')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return video_store.ingest(path, hashlib.sha256(content).hexdigest(), len(content), 'video/mp4')
+
+    def make_booking(self, status='pending', days_old=0, content=None):
+        booking = Booking(
+            name='Test Customer', email='test@example.com', contact='9876543210',
+            plan='One Day Story', amount='999.00', status=status,
+        )
+        video_store.attach(booking, self.store(content))
+        Booking.objects.filter(pk=booking.pk).update(created_at=timezone.now() - timedelta(days=days_old))
+        return booking
+
+    def test_retention_by_status_and_age(self):
+        """Only videos past their status's retention period are purged, and the purge is recorded"""
+        old_pending = self.make_booking('pending', days_old=10)
+        new_pending = self.make_booking('pending', days_old=1)
+        old_paid = self.make_booking('payment_received', days_old=90)
+        old_path = old_pending.video_file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = lifecycle.run()
+
+        self.assertEqual(report.retention_purged, [old_pending.booking_id])
+        old_pending.refresh_from_db()
+        self.assertFalse(old_pending.video_file)
+        self.assertEqual(old_pending.video_purge_reason, 'retention')
+        self.assertIsNotNone(old_pending.video_purged_at)
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertNotIn(old_path, self.stored_files())
+        for booking in (new_pending, old_paid):
+            booking.refresh_from_db()
+            self.assertTrue(booking.video_file)
+
+    def test_shared_video_kept_for_remaining_booking(self):
+        """Purging one of two bookings sharing a video leaves the file in place"""
+        content = MP4_HEADER + b'shared'
+        old = self.make_booking('completed', days_old=60, content=content)
+        recent = self.make_booking('completed', days_old=2, content=content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = lifecycle.run()
+
+        self.assertEqual(report.retention_purged, [old.booking_id])
+        self.assertEqual(report.bytes_freed, 0)
+        recent.refresh_from_db()
+        self.assertEqual(recent.stored_video.ref_count, 1)
+        self.assertEqual(self.stored_files(), [recent.video_file.path])
+
+    def test_high_water_evicts_oldest_eligible_first(self):
+        """Above the high-water mark the oldest evictable videos go first; paid ones are kept"""
+        paid = self.make_booking('payment_received', days_old=6)
+        oldest = self.make_booking('pending', days_old=5)
+        older = self.make_booking('completed', days_old=4)
+        newer = self.make_booking('pending', days_old=3)
+
+        # 95% used of a volume: get down to 75%
+        needed = lifecycle.bytes_over_high_water([(950, 1000)])
+        self.assertEqual(needed, 200)
+        self.assertEqual(lifecycle.bytes_over_high_water([(800, 1000)]), 0)
+
+        report = lifecycle.LifecycleReport()
+        size = oldest.stored_video.size
+        lifecycle.relieve_storage_pressure(timezone.now(), report, needed=size + 1)
+
+        self.assertEqual(report.pressure_purged, [oldest.booking_id, older.booking_id])
+        for booking, kept in ((paid, True), (oldest, False), (older, False), (newer, True)):
+            booking.refresh_from_db()
+            self.assertEqual(bool(booking.video_file), kept)
+        self.assertEqual(Booking.objects.get(pk=older.pk).video_purge_reason, 'disk_pressure')
+
+    def test_leftovers_cleaned_up(self):
+        """Expired upload sessions and unreferenced stored videos are removed"""
+        booking = self.make_booking('pending')
+        session = uploads.open_session(booking, 'clip.mp4', 'video/mp4', 100)
+        UploadSession.objects.filter(pk=session.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        orphan = self.store()
+        StoredVideo.objects.filter(pk=orphan.pk).update(last_referenced_at=timezone.now() - timedelta(days=1))
+        fresh = self.store()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = lifecycle.run()
+        self.assertEqual(report.expired_sessions, 1)
+        self.assertEqual(report.orphaned_videos, 1)
+        self.assertFalse(os.path.exists(uploads.partial_path(session)))
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).status, 'aborted')
+        self.assertFalse(StoredVideo.objects.filter(pk=orphan.pk).exists())
+        self.assertFalse(os.path.exists(orphan.file.path))
+        # Not yet past the grace period: it may be about to be attached
+        self.assertTrue(StoredVideo.objects.filter(pk=fresh.pk).exists())
+
+    def test_prune_videos_dry_run(self):
+        booking = self.make_booking('pending', days_old=30)
+        out = StringIO()
+        call_command('prune_videos', '--dry-run', stdout=out)
+
+        self.assertIn(f'Would remove video of {booking.booking_id} (retention)', out.getvalue())
+        booking.refresh_from_db()
+        self.assertTrue(booking.video_file)
+
+
+class VideoMetadataTest(TempMediaTestCase):
+    """Test cases for the MP4 post-upload pipeline (metadata probe and faststart)"""
+
+    def setUp(self):
+        super().setUp()
+        self.valid_booking_data = {
+            'name': 'Test Customer',
+            'email': 'test@example.com',
+            'contact': '9876543210',
+            'plan': 'One Day Story',
+            'amount': '999.00'
+        }
+
+    def test_probe_reads_moov_metadata(self):
+        """Duration, resolution, codec and bitrate are parsed from the box structure"""
+        data = build_mp4(duration=15, width=720, height=1280, codec=b'hvc1')
+        info = probe(io.BytesIO(data), len(data))
+        self.assertEqual(info['duration'], 15)
+        self.assertEqual((info['width'], info['height']), (720, 1280))
+        self.assertEqual(info['video_codec'], 'hvc1')
+        self.assertEqual(info['bitrate'], int(len(data) * 8 / 15))
+
+    def test_metadata_stored_on_booking_and_filterable(self):
+        """Uploaded videos get their metadata persisted and list_bookings can filter on it"""
+        booking_data = self.valid_booking_data.copy()
+        booking_data['video_file'] = SimpleUploadedFile('clip.mp4', build_mp4(duration=30), content_type='video/mp4')
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        self.assertEqual(response.status_code, 201)
+
+        booking = Booking.objects.get(booking_id=response.json()['booking_id'])
+        self.assertEqual(booking.video_duration, 30)
+        self.assertEqual((booking.video_width, booking.video_height), (1080, 1920))
+        self.assertEqual(booking.video_codec, 'avc1')
+        self.assertIsNotNone(booking.video_bitrate)
+
+        Booking.objects.create(name='No Video', email='nv@example.com', contact='9876543210', plan='Post', amount='10')
+        admin_user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(admin_user)
+
+        response = self.client.get('/api/bookings/', {'min_duration': 20, 'ordering': '-video_duration'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['booking_id'] for b in response.json()['bookings']], [booking.booking_id])
+
+        response = self.client.get('/api/bookings/', {'ordering': 'name'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_faststart_moves_moov_and_rewrites_offsets(self):
+        """Uploads with moov at the end are rewritten with moov first and valid chunk offsets"""
+        booking_data = self.valid_booking_data.copy()
+        booking_data['video_file'] = SimpleUploadedFile('clip.mp4', build_mp4(), content_type='video/mp4')
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        # The remux runs in the background worker
+        tasks.run_pending()
+        booking = Booking.objects.get(booking_id=response.json()['booking_id'])
+
+        with booking.video_file.open('rb') as fh:
+            data = fh.read()
+        fh = io.BytesIO(data)
+        moov = find_box(fh, 0, len(data), b'moov')
+        mdat = find_box(fh, 0, len(data), b'mdat')
+        self.assertLess(moov[0], mdat[0])
+
+        trak = find_box(fh, moov[0] + 8, moov[0] + moov[2], b'trak')
+        stco = find_path(fh, trak[0] + 8, trak[0] + trak[2], [b'mdia', b'minf', b'stbl', b'stco'])
+        offsets = struct.unpack('>2I', read_payload(fh, stco)[8:16])
+        self.assertEqual([data[o:o + 8] for o in offsets], [b'SAMPLE-A', b'SAMPLE-B'])
+
+        blob = booking.stored_video
+        blob.refresh_from_db()
+        self.assertEqual(blob.content_sha256, hashlib.sha256(data).hexdigest())
+        self.assertNotEqual(blob.content_sha256, blob.sha256)
+        self.assertEqual(booking.video_duration, 10)
+
+    def test_faststart_leaves_progressive_files_alone(self):
+        """A file that already has moov first is not rewritten"""
+        data = build_mp4(moov_first=True)
+        dst = io.BytesIO()
+        self.assertIsNone(faststart(io.BytesIO(data), dst, len(data)))
+        self.assertEqual(dst.getvalue(), b'')
+
+
+class MediaServingTest(TempMediaTestCase):
+    """Test cases for Range and conditional GET support on /media/"""
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        os.makedirs(os.path.join(self.media_root, 'pdfs'))
+        with open(os.path.join(self.media_root, 'pdfs', 'guide.pdf'), 'wb') as fh:
+            fh.write(self.content)
+        self.url = '/media/pdfs/guide.pdf'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_and_single_range(self):
+        """Plain GETs return the whole file; a byte range returns 206 with that slice"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), self.content)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(self.body(response), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.body(response), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_multiple_ranges(self):
+        """Several ranges are returned as multipart/byteranges"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = self.body(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-9/1024\r\n\r\n' + self.content[0:10], body)
+        self.assertIn(b'Content-Range: bytes 20-29/1024\r\n\r\n' + self.content[20:30], body)
+
+    def test_conditional_requests(self):
+        """Matching validators give 304, and a stale If-Range falls back to the full file"""
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_stored_video_strong_etag(self):
+        """Videos in the content-addressed store get a strong ETag from their content digest"""
+        booking_data = {
+            'name': 'Test Customer', 'email': 'test@example.com', 'contact': '9876543210',
+            'plan': 'One Day Story', 'amount': '999.00',
+            'video_file': SimpleUploadedFile('clip.mp4', build_mp4(), content_type='video/mp4'),
+        }
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        booking = Booking.objects.get(booking_id=response.json()['booking_id'])
+
+        response = self.client.get(f'/media/{booking.video_file.name}', HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['ETag'], f'"{booking.stored_video.content_sha256}"')
+
+        response = self.client.get(
+            f'/media/{booking.video_file.name}', HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=response['ETag']
+        )
+        self.assertEqual(response.status_code, 206)
+
+    def test_private_and_traversal_paths_not_served(self):
+        """Partial uploads and paths outside MEDIA_ROOT are never served"""
+        self.assertEqual(self.client.get('/media/upload_sessions/x.part').status_code, 404)
+        with self.assertRaises(Http404):
+            serve_media(RequestFactory().get('/media/'), '../../chittorgarh_vlog/settings.py')
+
+    def test_offload_to_front_proxy(self):
+        """With offloading enabled, downloads are handed to nginx or the sendfile module"""
+        os.makedirs(os.path.join(self.media_root, 'pdfs', 'free'))
+        with open(os.path.join(self.media_root, 'pdfs', 'free', 'kit.pdf'), 'wb') as fh:
+            fh.write(self.content)
+
+        with override_settings(MEDIA_OFFLOAD_MODE='nginx', MEDIA_OFFLOAD_PREFIX='/protected-media/'):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/pdfs/guide.pdf')
+            self.assertEqual(response.content, b'')
+
+            response = self.client.get(reverse('download_mediakit_pdf', args=['kit.pdf']))
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/pdfs/free/kit.pdf')
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="kit.pdf"')
+
+            self.assertEqual(self.client.get('/media/upload_sessions/x.part').status_code, 404)
+
+        with override_settings(MEDIA_OFFLOAD_MODE='sendfile'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'pdfs', 'guide.pdf'))
+
+
+class HotFilesTest(TempMediaTestCase):
+    """Test cases for the hot-file cache behind the PDF download views"""
+
+    def setUp(self):
+        super().setUp()
+        hotfiles.clear()
+        self.addCleanup(hotfiles.clear)
+        os.makedirs(os.path.join(self.media_root, 'pdfs', 'free'))
+        self.path = os.path.join(self.media_root, 'pdfs', 'free', 'media-kit-english.pdf')
+        self.write(b'%PDF-1.4 first version')
+        self.url = reverse('download_mediakit_pdf', args=['media-kit-english.pdf'])
+
+    def write(self, content):
+        with open(self.path + '.tmp', 'wb') as fh:
+            fh.write(content)
+        os.replace(self.path + '.tmp', self.path)
+
+    def download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_descriptor_reused_and_position_untouched(self):
+        """Repeated downloads share one descriptor whose file position never moves"""
+        self.assertEqual(self.download(), b'%PDF-1.4 first version')
+        hot_file = hotfiles.get(self.path)
+        self.assertEqual(self.download(), b'%PDF-1.4 first version')
+        self.assertIs(hotfiles.get(self.path), hot_file)
+        self.assertEqual(os.lseek(hot_file.file.fileno(), 0, os.SEEK_CUR), 0)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Length'], str(len(b'%PDF-1.4 first version')))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="media-kit-english.pdf"')
+
+    def test_replaced_file_is_reopened(self):
+        """A new version of the PDF is served as soon as it replaces the old one"""
+        self.download()
+        self.write(b'%PDF-1.4 second, longer version')
+        self.assertEqual(self.download(), b'%PDF-1.4 second, longer version')
+
+    def test_missing_file(self):
+        """A missing PDF is still a JSON 404"""
+        os.remove(self.path)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['error'], 'PDF file not found')
+
+
+class S3StorageTest(TempMediaTestCase):
+    """Test cases for the S3 storage backend against the local S3 stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.standin = S3StandIn(access_key='test', secret_key='test-secret').start()
+        cls.settings_overrides = {
+            'STORAGES': {
+                'default': {'BACKEND': 'api.storage.S3Storage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            'AWS_S3_BUCKET': 'media',
+            'AWS_S3_ENDPOINT_URL': cls.standin.endpoint_url,
+            'AWS_S3_REGION': 'us-east-1',
+            'AWS_ACCESS_KEY_ID': 'test',
+            'AWS_SECRET_ACCESS_KEY': 'test-secret',
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.standin.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.standin.objects.clear()
+
+    def test_save_open_url_and_delete(self):
+        """Objects round-trip through signed requests, ranged reads and presigned URLs"""
+        content = bytes(range(256)) * 1024
+        name = default_storage.save('pdfs/free/kit.pdf', ContentFile(content))
+        self.assertEqual(name, 'pdfs/free/kit.pdf')
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(default_storage.size(name), len(content))
+
+        with default_storage.open(name, 'rb') as fh:
+            fh.seek(200000)
+            self.assertEqual(fh.read(10), content[200000:200010])
+
+        url = default_storage.url(name)
+        self.assertEqual(requests.get(url).content, content)
+        self.assertEqual(requests.get(url.replace('X-Amz-Expires=3600', 'X-Amz-Expires=9999')).status_code, 403)
+
+        default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+        with self.assertRaises(FileNotFoundError):
+            default_storage.size(name)
+
+    def test_ranged_read_refuses_whole_object(self):
+        """An endpoint that ignores Range fails the read instead of sending the whole object each time"""
+        name = default_storage.save('pdfs/free/kit.pdf', ContentFile(b'%PDF-1.4 ' + b'x' * 4096))
+        send = requests.Session.request
+
+        def ignore_range(session, method, url, headers=None, **kwargs):
+            headers = {key: value for key, value in (headers or {}).items() if key != 'Range'}
+            return send(session, method, url, headers=headers, **kwargs)
+
+        with mock.patch.object(requests.Session, 'request', ignore_range):
+            with self.assertRaises(S3Error) as raised:
+                default_storage.read_range(name, 0, 9)
+        self.assertEqual(raised.exception.status_code, 200)
+        self.assertEqual(default_storage.read_range(name, 0, 7), b'%PDF-1.4')
+
+    def test_booking_video_stored_in_bucket(self):
+        """Uploaded videos land in the bucket, get remuxed and probed, and leave no local files"""
+        booking_data = {
+            'name': 'Test Customer', 'email': 'test@example.com', 'contact': '9876543210',
+            'plan': 'One Day Story', 'amount': '999.00',
+            'video_file': SimpleUploadedFile('clip.mp4', build_mp4(), content_type='video/mp4'),
+        }
+        response = self.client.post(reverse('create_booking'), data=booking_data)
+        self.assertEqual(response.status_code, 201)
+        tasks.run_pending()
+        booking = Booking.objects.get(booking_id=response.json()['booking_id'])
+
+        self.assertEqual(self.standin.keys('media'), [booking.video_file.name])
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(booking.video_duration, 10)
+        self.assertNotEqual(booking.stored_video.content_sha256, booking.stored_video.sha256)
+
+        response = self.client.get(f'/media/{booking.video_file.name}')
+        self.assertEqual(response.status_code, 302)
+        data = requests.get(response['Location']).content
+        self.assertLess(data.index(b'moov'), data.index(b'mdat'))
+
+    def test_pdf_download_redirects_to_presigned_url(self):
+        """PDF downloads redirect to a short-lived URL that forces the attachment filename"""
+        default_storage.save('pdfs/free/media-kit-english.pdf', ContentFile(b'%PDF-1.4 kit'))
+        response = self.client.get(reverse('download_mediakit_pdf', args=['media-kit-english.pdf']))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('X-Amz-Expires=300', response['Location'])
+
+        download = requests.get(response['Location'])
+        self.assertEqual(download.content, b'%PDF-1.4 kit')
+        self.assertEqual(download.headers['Content-Disposition'], 'attachment; filename="media-kit-english.pdf"')
+
+        response = self.client.get(reverse('download_mediakit_pdf', args=['missing.pdf']))
+        self.assertEqual(response.status_code, 404)
+
+    def direct_booking(self, content, content_type='video/mp4'):
+        response = self.client.post(reverse('create_booking'), data={
+            'name': 'Test Customer', 'email': 'test@example.com', 'contact': '9876543210',
+            'plan': 'One Day Story', 'amount': '999.00',
+            'video_upload': 'direct',
+            'video_filename': 'clip.mp4',
+            'video_content_type': content_type,
+            'video_size': len(content),
+            'video_sha256': hashlib.sha256(content).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_direct_upload_bypasses_the_api(self):
+        """The client PUTs the video to the bucket and finalize attaches it after verification"""
+        content = build_mp4(moov_first=True)
+        payload = self.direct_booking(content)
+        upload = payload['upload']
+        self.assertEqual(upload['mode'], 'direct')
+        self.assertFalse(payload['video_attached'])
+
+        finalize_url = f"/api/uploads/{upload['upload_id']}/finalize/"
+        self.assertEqual(self.client.post(finalize_url).status_code, 409)
+
+        target = upload['upload_target']
+        response = requests.put(target['url'], data=content, headers=target['headers'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_files(), [])
+
+        response = self.client.post(finalize_url)
+        self.assertEqual(response.status_code, 200)
+        booking = Booking.objects.get(booking_id=payload['booking_id'])
+        self.assertEqual(self.standin.keys('media'), [booking.video_file.name])
+        self.assertEqual(booking.stored_video.ref_count, 1)
+        self.assertEqual(booking.video_width, 1080)
+
+    def test_failed_direct_finalize_can_be_retried(self):
+        """A direct finalize that fails after verification leaves the session open for a retry"""
+        content = build_mp4(moov_first=True)
+        upload = self.direct_booking(content)['upload']
+        target = upload['upload_target']
+        requests.put(target['url'], data=content, headers=target['headers'])
+
+        finalize_url = f"/api/uploads/{upload['upload_id']}/finalize/"
+        with mock.patch.object(video_store, 'attach', side_effect=RuntimeError('database went away')):
+            self.assertEqual(self.client.post(finalize_url).status_code, 500)
+        session = UploadSession.objects.get(upload_id=upload['upload_id'])
+        self.assertEqual((session.status, session.received_bytes), ('active', 0))
+
+        self.assertEqual(self.client.post(finalize_url).status_code, 200)
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.received_bytes), ('completed', len(content)))
+
+    def test_expired_session_keeps_object_another_session_uploads(self):
+        """Expiring one of two sessions for the same video leaves the shared object for the other"""
+        content = build_mp4(moov_first=True)
+        first, payload = self.direct_booking(content)['upload'], self.direct_booking(content)
+        second = payload['upload']
+        target = second['upload_target']
+        self.assertEqual(requests.put(target['url'], data=content, headers=target['headers']).status_code, 200)
+
+        UploadSession.objects.filter(upload_id=first['upload_id']).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(lifecycle.expire_upload_sessions(timezone.now()), 1)
+        self.assertEqual(len(self.standin.keys('media')), 1)
+
+        response = self.client.post(f"/api/uploads/{second['upload_id']}/finalize/")
+        self.assertEqual(response.status_code, 200)
+        booking = Booking.objects.get(booking_id=payload['booking_id'])
+        self.assertEqual(self.standin.keys('media'), [booking.video_file.name])
+
+    def test_direct_upload_target_rejects_other_bytes(self):
+        """Storage refuses a body with another size or hash, and finalize refuses non-videos"""
+        content = build_mp4(moov_first=True)
+        target = self.direct_booking(content)['upload']['upload_target']
+        tampered = content[:-1] + b'X'
+        self.assertEqual(requests.put(target['url'], data=tampered, headers=target['headers']).status_code, 400)
+        self.assertEqual(requests.put(target['url'], data=content + b'X', headers=target['headers']).status_code, 403)
+        self.assertEqual(self.standin.keys('media'), [])
+
+        not_video = b'%PDF-1.4 definitely not a video'
+        upload = self.direct_booking(not_video)['upload']
+        target = upload['upload_target']
+        self.assertEqual(requests.put(target['url'], data=not_video, headers=target['headers']).status_code, 200)
+        response = self.client.post(f"/api/uploads/{upload['upload_id']}/finalize/")
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.standin.keys('media'), [])
+
+    def test_aborted_session_keeps_object_another_session_uploads(self):
+        """A refused finalize only removes the shared object once no other session awaits it"""
+        not_video = b'%PDF-1.4 definitely not a video'
+        first, second = self.direct_booking(not_video)['upload'], self.direct_booking(not_video)['upload']
+        target = first['upload_target']
+        self.assertEqual(requests.put(target['url'], data=not_video, headers=target['headers']).status_code, 200)
+
+        self.assertEqual(self.client.post(f"/api/uploads/{first['upload_id']}/finalize/").status_code, 415)
+        self.assertEqual(len(self.standin.keys('media')), 1)
+        self.assertEqual(self.client.post(f"/api/uploads/{second['upload_id']}/finalize/").status_code, 415)
+        self.assertEqual(self.standin.keys('media'), [])
@@ -0,0 +1,59 @@
+"""
+One-time upload tickets issued by the booking pre-flight check.
+
+A ticket is a signed, timestamped token carrying a random nonce and the
+largest request body its holder may send. The pre-flight endpoint issues one
+after validating the booking fields and the declared video; the upload
+admission middleware redeems it from the ``X-Upload-Ticket`` header using
+only ``Content-Length``, before a byte of the body is read.
+"""
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+
+TICKET_SALT = 'api.upload-ticket'
+
+
+class TicketError(Exception):
+    """A ticket that cannot admit the request it came with"""
+
+    def __init__(self, message, status_code=403):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def issue_ticket(max_body_size):
+    """Sign a ticket admitting one request body of up to ``max_body_size`` bytes"""
+    return signing.dumps({'n': secrets.token_hex(16), 's': int(max_body_size)}, salt=TICKET_SALT)
+
+
+def redeem_ticket(ticket, content_length):
+    """Check a ticket against a request's Content-Length and mark it used.
+
+    Raises TicketError if the ticket is forged, expired, already used, or
+    was issued for a smaller body.
+    """
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.UPLOAD_TICKET_TTL)
+    except signing.BadSignature:
+        raise TicketError('Upload ticket is invalid or has expired; run the pre-flight check again')
+
+    if content_length > data['s']:
+        raise TicketError('Request body is larger than the video declared in the pre-flight check', 413)
+
+    # add() only succeeds for the first request presenting this ticket
+    if not cache.add(f"upload_ticket_{data['n']}", True, timeout=settings.UPLOAD_TICKET_TTL):
+        raise TicketError('Upload ticket has already been used', 409)
+
+
+def release_ticket(ticket):
+    """Make a redeemed ticket usable again, for a request turned away before its upload began"""
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.UPLOAD_TICKET_TTL)
+    except signing.BadSignature:
+        return
+    cache.delete(f"upload_ticket_{data['n']}")
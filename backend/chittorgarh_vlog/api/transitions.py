@@ -0,0 +1,82 @@
+"""
+Atomic state transitions for bookings and PDF purchases.
+
+Views used to read a row, check its status in Python and ``save()`` it
+back. Two concurrent requests (a double-clicked button, a client retry,
+the verify view racing the webhook) could then both pass the check, both
+send the emails, and both rewrite every column.
+
+A transition here is a single ``UPDATE ... WHERE pk = %s AND status IN
+(...)`` that writes only the fields it changes. The database lets exactly
+one caller match the row; ``apply()`` returns True for that caller only,
+and only the winner should run the side effects (emails, logging):
+
+    if booking_status.apply(booking, 'pay', transaction_id=payment_id):
+        send_booking_paid_emails(booking)
+
+``update_if()`` is the same conditional update for guards that are not a
+status, e.g. recording only the first download of a PDF.
+"""
+from django.db import models
+from django.utils import timezone
+
+from .models import Booking, PDFPurchase
+
+
+class InvalidTransition(ValueError):
+    """A transition name the state machine does not define"""
+
+
+def update_if(instance, conditions, **changes):
+    """UPDATE ``instance``'s row with ``changes`` if it still matches ``conditions``.
+
+    ``conditions`` are queryset lookups, e.g. ``{'downloaded_at__isnull': True}``.
+    ``auto_now`` fields are refreshed as ``save()`` would. On success the new
+    values are set on ``instance`` and True is returned; otherwise nothing is
+    written and ``instance`` is left as it was.
+    """
+    model = type(instance)
+    for field in model._meta.concrete_fields:
+        if isinstance(field, models.DateField) and field.auto_now and field.name not in changes:
+            changes[field.name] = timezone.now()
+    if not model._default_manager.filter(pk=instance.pk, **conditions).update(**changes):
+        return False
+    for name, value in changes.items():
+        setattr(instance, name, value)
+    return True
+
+
+class StateMachine:
+    """Named transitions of one status field: {name: (source states, target state)}"""
+
+    def __init__(self, model, field, transitions):
+        self.model = model
+        self.field = field
+        self.transitions = transitions
+
+    def apply(self, instance, name, **changes):
+        """Run transition ``name`` on ``instance`` along with ``changes``; True if this call made it"""
+        try:
+            sources, target = self.transitions[name]
+        except KeyError:
+            raise InvalidTransition(f'{self.model.__name__}.{self.field} has no transition {name!r}')
+        return update_if(instance, {f'{self.field}__in': sources}, **{self.field: target}, **changes)
+
+    def can_apply(self, instance, name):
+        """Whether ``instance``, as last read, is in a source state of ``name``"""
+        return getattr(instance, self.field) in self.transitions[name][0]
+
+
+booking_status = StateMachine(Booking, 'status', {
+    # Razorpay payment verified by the browser, a webhook or reconciliation
+    'pay': (('pending',), 'payment_received'),
+    # Customer reported a UPI/bank transfer; checked later against the statement
+    'submit_manual': (('pending',), 'payment_received'),
+    # Admin posted the video
+    'complete': (('pending', 'payment_received'), 'completed'),
+})
+
+pdf_payment_status = StateMachine(PDFPurchase, 'payment_status', {
+    'pay': (('pending',), 'completed'),
+    'submit_manual': (('pending',), 'completed'),
+})
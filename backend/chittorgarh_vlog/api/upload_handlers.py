@@ -0,0 +1,157 @@
+"""
+Upload handler that streams a booking video straight into media storage.
+
+Django's default handlers spool the upload to a temporary file which the
+FileField then copies into ``uploaded_videos/``. This handler instead writes
+each chunk into the media volume as it arrives, computes the SHA-256 digest
+and size on the fly, and sniffs the container from the first bytes so a
+non-video body is rejected without reading the rest of the request. The
+finished file is then adopted by the content-addressed video store.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from .video_store import INCOMING_DIR, scratch_path
+from .video import ALLOWED_VIDEO_TYPES, MAX_VIDEO_SIZE, SNIFF_BYTES, sniff_video_type
+
+
+# Generous allowance for the other multipart fields and part headers
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class StoredVideoUpload(UploadedFile):
+    """A video that has already been written to media storage while uploading"""
+
+    def __init__(self, name, path, size, sha256, detected_type, client_content_type):
+        super().__init__(
+            file=None,
+            name=name,
+            content_type=detected_type,
+            size=size,
+        )
+        self.path = path
+        self.sha256 = sha256
+        self.detected_type = detected_type
+        self.client_content_type = client_content_type
+
+    def open(self, mode='rb'):
+        self.file = open(self.path, mode)
+        return self
+
+    def discard(self):
+        """Remove the stored file, e.g. when the booking could not be created"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class StreamingVideoUploadHandler(FileUploadHandler):
+    """Write the ``video_file`` form field directly into the media volume.
+
+    Rejections are reported on ``request.video_upload_error``: Django
+    swallows the ``StopUpload`` raised while file data arrives, and a body
+    refused before parsing starts is parsed as empty instead.
+    """
+
+    field_name = 'video_file'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.fd = None
+        self.path = None
+
+    def reject(self, message):
+        self.request.video_upload_error = message
+        self.cleanup()
+        raise StopUpload(connection_reset=True)
+
+    def cleanup(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self.active = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > MAX_VIDEO_SIZE + MULTIPART_OVERHEAD:
+            # StopUpload is not caught this early; skip the body instead of reading it
+            self.request.video_upload_error = 'Video file size too large. Maximum size is 500MB'
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.field_name:
+            return
+
+        # Same volume as local video storage, so adopting the file is a rename
+        path = scratch_path(f'{INCOMING_DIR}/{uuid.uuid4().hex}.part')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o644)
+
+        self.active = True
+        self.path = path
+        self.head = b''
+        self.detected_type = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        if self.detected_type is None:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self.sniff()
+
+        self.size += len(raw_data)
+        if self.size > MAX_VIDEO_SIZE:
+            self.reject('Video file size too large. Maximum size is 500MB')
+
+        self.digest.update(raw_data)
+        view = memoryview(raw_data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        return None
+
+    def sniff(self):
+        self.detected_type = sniff_video_type(self.head)
+        if self.detected_type not in ALLOWED_VIDEO_TYPES:
+            self.reject(f'Video file type not supported. Allowed types: {ALLOWED_VIDEO_TYPES}')
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if self.detected_type is None:
+            self.sniff()
+
+        os.close(self.fd)
+        self.fd = None
+        self.active = False
+        return StoredVideoUpload(
+            name=self.file_name,
+            path=self.path,
+            size=self.size,
+            sha256=self.digest.hexdigest(),
+            detected_type=self.detected_type,
+            client_content_type=self.content_type,
+        )
+
+    def upload_interrupted(self):
+        if self.active:
+            self.cleanup()
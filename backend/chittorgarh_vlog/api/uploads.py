@@ -0,0 +1,330 @@
+"""
+Resumable chunked uploads for booking videos.
+
+A client opens an UploadSession for a booking, PUTs numbered chunks of
+``chunk_size`` bytes (chunk N lives at offset ``N * chunk_size``), can ask for
+the received offset at any time to resume after a dropped connection, and
+finally asks the server to attach the assembled file to ``Booking.video_file``.
+
+Chunks are written in place into a partial file under
+``MEDIA_ROOT/upload_sessions/``; finalizing hashes that file and hands it
+to the content-addressed video store, which renames it into place on local
+storage, so the video is never copied a second time.
+
+With a storage backend that supports presigned uploads (S3), a session can
+instead be opened in ``direct`` mode: the client PUTs the whole video to the
+bucket under its content address and only the small open/finalize requests
+reach the API. Finalizing verifies the size and the bucket-checked SHA-256
+before the object is attached.
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import video_store
+from .models import StoredVideo, UploadSession
+from .video import ALLOWED_VIDEO_TYPES, MAX_VIDEO_SIZE, SNIFF_BYTES, sniff_video_type
+
+
+PARTIAL_UPLOAD_DIR = 'upload_sessions'
+COPY_BUFFER_SIZE = 64 * 1024
+# A finalize still running after this long died with its worker; another request may take over
+FINALIZE_TIMEOUT = timedelta(minutes=10)
+
+
+class UploadError(Exception):
+    """A chunk or finalize request that cannot be applied to the session"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def partial_path(session):
+    """Absolute path of the partial file backing an upload session"""
+    return video_store.scratch_path(f'{PARTIAL_UPLOAD_DIR}/{session.upload_id}.part')
+
+
+def check_upload(content_type, total_size):
+    """Validate what a client announces about a video before anything is created"""
+    if content_type not in ALLOWED_VIDEO_TYPES:
+        raise UploadError(f'Video file type not supported. Allowed types: {ALLOWED_VIDEO_TYPES}')
+    check_upload_size(total_size)
+
+
+def check_upload_size(total_size):
+    if total_size <= 0:
+        raise UploadError('Video file size must be a positive number of bytes')
+    if total_size > MAX_VIDEO_SIZE:
+        raise UploadError('Video file size too large. Maximum size is 500MB')
+
+
+def _resumable_session(booking, mode, filename, total_size, sha256):
+    return booking.upload_sessions.filter(
+        status='active',
+        mode=mode,
+        filename=filename,
+        total_size=total_size,
+        sha256=sha256,
+        expires_at__gt=timezone.now(),
+    ).first()
+
+
+def open_session(booking, filename, content_type, total_size, sha256=''):
+    """Create an upload session for a booking, or resume the matching active one"""
+    check_upload(content_type, total_size)
+    if booking.status != 'pending':
+        raise UploadError('Video can only be uploaded for pending bookings', 409)
+
+    now = timezone.now()
+    existing = _resumable_session(booking, 'chunked', filename, total_size, sha256)
+    if existing and os.path.exists(partial_path(existing)):
+        return existing
+
+    session = UploadSession.objects.create(
+        booking=booking,
+        filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        sha256=sha256,
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+        expires_at=now + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS),
+    )
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return session
+
+
+def direct_uploads_supported():
+    return hasattr(video_store.video_storage(), 'presigned_upload')
+
+
+def open_direct_session(booking, filename, content_type, total_size, sha256):
+    """Create (or resume) a session whose video is PUT straight into storage"""
+    check_upload(content_type, total_size)
+    if not sha256:
+        raise UploadError('sha256 is required for direct uploads')
+    if booking.status != 'pending':
+        raise UploadError('Video can only be uploaded for pending bookings', 409)
+
+    existing = _resumable_session(booking, 'direct', filename, total_size, sha256)
+    if existing:
+        return existing
+
+    now = timezone.now()
+    return UploadSession.objects.create(
+        booking=booking,
+        mode='direct',
+        filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        sha256=sha256,
+        chunk_size=total_size,
+        object_name=video_store.blob_name(sha256, content_type),
+        expires_at=now + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS),
+    )
+
+
+def upload_target(session):
+    """Short-lived presigned request the client uses to upload a direct session's video"""
+    return video_store.video_storage().presigned_upload(
+        session.object_name,
+        session.content_type,
+        session.total_size,
+        session.sha256,
+        expire=settings.DIRECT_UPLOAD_URL_EXPIRY,
+    )
+
+
+def chunk_bounds(session, index):
+    """Return (offset, length) of chunk ``index`` within the session"""
+    offset = index * session.chunk_size
+    if index < 0 or offset >= session.total_size:
+        raise UploadError(f'Chunk index out of range (0-{session.total_chunks - 1})', 416)
+    return offset, min(session.chunk_size, session.total_size - offset)
+
+
+def write_chunk(session, index, stream, content_length, declared_offset=None):
+    """Write one chunk from ``stream`` and return the new received offset.
+
+    Chunks must arrive in order; re-sending a chunk that was already stored is
+    a no-op so clients can blindly retry the last chunk after a reconnect.
+    The first chunk is sniffed before anything is written, so a non-video
+    upload is refused on its first request.
+    """
+    if session.status != 'active':
+        raise UploadError('Upload session is no longer active', 409)
+    if session.expires_at <= timezone.now():
+        raise UploadError('Upload session has expired', 410)
+    if session.mode != 'chunked':
+        raise UploadError('This upload goes directly to storage; use its upload URL', 409)
+
+    offset, length = chunk_bounds(session, index)
+    if declared_offset is not None and declared_offset != offset:
+        raise UploadError(f'Upload-Offset for chunk {index} must be {offset}')
+    if content_length != length:
+        raise UploadError(f'Chunk {index} must be exactly {length} bytes')
+
+    if offset + length <= session.received_bytes:
+        return session.received_bytes
+    if offset > session.received_bytes:
+        raise UploadError(
+            f'Chunk {index} is ahead of the received offset; resume from chunk {session.next_chunk}', 409
+        )
+
+    written = 0
+    with open(partial_path(session), 'r+b') as fh:
+        fh.seek(offset)
+        while written < length:
+            data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+            if not data:
+                break
+            if offset == 0 and written == 0 and sniff_video_type(data[:SNIFF_BYTES]) not in ALLOWED_VIDEO_TYPES:
+                raise UploadError(f'Video file type not supported. Allowed types: {ALLOWED_VIDEO_TYPES}', 415)
+            fh.write(data)
+            written += len(data)
+
+    if written != length:
+        raise UploadError(f'Chunk {index} was truncated after {written} bytes; resend it')
+
+    # Only advance the offset if nobody else stored this chunk in the meantime
+    updated = UploadSession.objects.filter(
+        pk=session.pk, status='active', received_bytes=offset
+    ).update(received_bytes=offset + length, updated_at=timezone.now())
+    if updated:
+        session.received_bytes = offset + length
+    else:
+        session.refresh_from_db()
+    return session.received_bytes
+
+
+def _claim_finalize(session, **conditions):
+    """Mark the session as finalizing so a concurrent request cannot finalize it too"""
+    now = timezone.now()
+    return UploadSession.objects.filter(
+        Q(status='active') | Q(status='finalizing', updated_at__lt=now - FINALIZE_TIMEOUT),
+        pk=session.pk, **conditions
+    ).update(status='finalizing', updated_at=now)
+
+
+def _not_claimed(session):
+    session.refresh_from_db()
+    if session.status == 'completed':
+        return session.booking
+    if session.status == 'finalizing':
+        raise UploadError('Upload is already being finalized; retry shortly', 409)
+    raise UploadError('Upload session is no longer active', 409)
+
+
+def _complete(session, **changes):
+    UploadSession.objects.filter(pk=session.pk).update(status='completed', updated_at=timezone.now(), **changes)
+    session.status = 'completed'
+
+
+def _release(session):
+    """Give a session back after a failed finalize so the client can retry it"""
+    if UploadSession.objects.filter(pk=session.pk, status='finalizing').update(
+        status='active', updated_at=timezone.now()
+    ):
+        session.status = 'active'
+
+
+def finalize_session(session):
+    """Move the assembled file into ``Booking.video_file`` and close the session.
+
+    The session is only marked completed once the video is attached; if any
+    step fails it goes back to active and the finalize can be retried.
+    """
+    booking = session.booking
+    if session.status == 'completed':
+        return booking
+    if session.status not in ('active', 'finalizing'):
+        raise UploadError('Upload session is no longer active', 409)
+    if session.mode == 'direct':
+        return _finalize_direct_session(session)
+    if session.received_bytes != session.total_size:
+        raise UploadError(
+            f'Upload incomplete: {session.received_bytes} of {session.total_size} bytes received', 409
+        )
+
+    if not _claim_finalize(session, received_bytes=session.total_size):
+        return _not_claimed(session)
+
+    try:
+        path = partial_path(session)
+        digest = video_store.file_digest(path)
+        if session.sha256 and digest != session.sha256:
+            UploadSession.objects.filter(pk=session.pk).update(status='aborted', updated_at=timezone.now())
+            session.status = 'aborted'
+            os.remove(path)
+            raise UploadError('Uploaded bytes do not match the announced sha256; start a new upload', 422)
+
+        with open(path, 'rb') as fh:
+            detected_type = sniff_video_type(fh.read(SNIFF_BYTES))
+        blob = video_store.ingest(path, digest, session.total_size, detected_type)
+        video_store.attach(booking, blob)
+    except BaseException:
+        _release(session)
+        raise
+    _complete(session)
+    return booking
+
+
+def object_in_use(session):
+    """Whether a direct session's object is owned by a stored video or awaited by another open session"""
+    # Sessions for the same video share its content address
+    if StoredVideo.objects.filter(file=session.object_name).exists():
+        return True
+    return UploadSession.objects.filter(
+        object_name=session.object_name, status__in=('active', 'finalizing')
+    ).exclude(pk=session.pk).exists()
+
+
+def _abort(session, message, status_code):
+    UploadSession.objects.filter(pk=session.pk).update(status='aborted', updated_at=timezone.now())
+    session.status = 'aborted'
+    # Only remove the object if no stored video or other open session needs that content address
+    if not object_in_use(session):
+        video_store.video_storage().delete(session.object_name)
+    raise UploadError(message, status_code)
+
+
+def _finalize_direct_session(session):
+    """Verify the object the client uploaded to storage and attach it"""
+    booking = session.booking
+    storage = video_store.video_storage()
+    try:
+        size = storage.size(session.object_name)
+    except FileNotFoundError:
+        raise UploadError('The video has not been uploaded to storage yet', 409)
+
+    if not _claim_finalize(session):
+        return _not_claimed(session)
+
+    try:
+        if size != session.total_size:
+            _abort(session, f'Uploaded {size} bytes but {session.total_size} were announced; start a new upload', 422)
+
+        # The bucket checked the signed checksum on upload; hash it here only if it kept none
+        digest = storage.checksum_sha256(session.object_name) or video_store.storage_digest(session.object_name)
+        if digest != session.sha256:
+            _abort(session, 'Uploaded bytes do not match the announced sha256; start a new upload', 422)
+
+        with storage.open(session.object_name, 'rb') as fh:
+            detected_type = sniff_video_type(fh.read(SNIFF_BYTES))
+        if detected_type not in ALLOWED_VIDEO_TYPES:
+            _abort(session, f'Video file type not supported. Allowed types: {ALLOWED_VIDEO_TYPES}', 415)
+
+        blob = video_store.adopt(session.object_name, digest, size, detected_type)
+        video_store.attach(booking, blob)
+    except BaseException:
+        _release(session)
+        raise
+    _complete(session, received_bytes=size)
+    session.received_bytes = size
+    return booking
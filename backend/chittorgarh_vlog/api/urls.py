@@ -3,14 +3,25 @@ from . import views
 
 urlpatterns = [
     # Video booking endpoints
+    path('preflight/', views.preflight_booking, name='preflight_booking'),
     path('create/', views.create_booking, name='create_booking'),
     path('create-order/', views.create_order, name='create_order'),
     path('verify-payment/', views.verify_payment, name='verify_payment'),
     path('submit-manual-payment/', views.submit_manual_payment, name='submit_manual_payment'),
     path('send-thank-you/', views.send_thank_you_email, name='send_thank_you_email'),
+    path('webhooks/razorpay/', views.razorpay_webhook, name='razorpay_webhook'),
     path('status/<str:booking_id>/', views.booking_status, name='booking_status'),
     path('pdf/<str:booking_id>/', views.generate_pdf, name='generate_pdf'),
     path('bookings/', views.list_bookings, name='list_bookings'),
+    path('upload-metrics/', views.upload_metrics, name='upload_metrics'),
+    path('gateway-metrics/', views.gateway_metrics, name='gateway_metrics'),
+    path('top-talkers/', views.top_talkers, name='top_talkers'),
+
+    # Resumable video upload endpoints
+    path('uploads/', views.create_upload_session, name='create_upload_session'),
+    path('uploads/<str:upload_id>/', views.upload_status, name='upload_status'),
+    path('uploads/<str:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<str:upload_id>/finalize/', views.finalize_upload, name='finalize_upload'),
     
     # PDF download endpoints
     path('pdf-info/', views.get_pdf_info, name='get_pdf_info'),
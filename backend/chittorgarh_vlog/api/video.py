@@ -0,0 +1,59 @@
+"""
+Video upload rules shared by the booking views, serializer, model validator
+and upload handlers.
+
+The container type is detected from the file's leading bytes rather than the
+client-supplied ``Content-Type``, so a renamed or mislabelled file is rejected
+as soon as its first few bytes arrive.
+"""
+
+MAX_VIDEO_SIZE = 500 * 1024 * 1024  # 500MB
+ALLOWED_VIDEO_TYPES = ['video/mp4', 'video/mpeg', 'video/quicktime', 'video/x-msvideo']
+
+# Enough for an ftyp/RIFF header plus the second MPEG-TS sync byte
+SNIFF_BYTES = 512
+
+# QuickTime files written by older tools start with one of these atoms instead of ftyp
+_QUICKTIME_LEADING_ATOMS = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+_MPEG_TS_PACKET = 188
+
+
+def sniff_video_type(head):
+    """Return the MIME type of a video container from its leading bytes, or None"""
+    if len(head) >= 12 and head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:12] == b'qt  ' else 'video/mp4'
+    if len(head) >= 8 and head[4:8] in _QUICKTIME_LEADING_ATOMS:
+        return 'video/quicktime'
+    if len(head) >= 12 and head[0:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    if head[0:4] in (b'\x00\x00\x01\xba', b'\x00\x00\x01\xb3'):
+        return 'video/mpeg'  # MPEG program stream pack / sequence header
+    if head[0:1] == b'\x47' and head[_MPEG_TS_PACKET:_MPEG_TS_PACKET + 1] == b'\x47':
+        return 'video/mpeg'  # MPEG transport stream
+    return None
+
+
+def read_head(file_obj):
+    """Read the sniffable head of a file object without moving its position"""
+    position = file_obj.tell()
+    file_obj.seek(0)
+    head = file_obj.read(SNIFF_BYTES)
+    file_obj.seek(position)
+    return head
+
+
+def video_file_error(value):
+    """Return a user-facing error for an unacceptable video upload, or None.
+
+    Files received through ``StreamingVideoUploadHandler`` were already sniffed
+    while streaming; anything else is sniffed here from its first bytes.
+    """
+    detected_type = getattr(value, 'detected_type', None)
+    if detected_type is None:
+        detected_type = sniff_video_type(read_head(value))
+    if detected_type not in ALLOWED_VIDEO_TYPES:
+        return f'Video file type not supported. Allowed types: {ALLOWED_VIDEO_TYPES}'
+
+    if value.size > MAX_VIDEO_SIZE:
+        return 'Video file size too large. Maximum size is 500MB'
+    return None
@@ -0,0 +1,169 @@
+"""
+Content-addressed, reference-counted store for booking videos.
+
+Every uploaded video is kept once under ``uploaded_videos/sha256/<ab>/<digest><ext>``
+and shared by all bookings that uploaded the same bytes. ``StoredVideo.ref_count``
+tracks how many bookings point at a file; the file is deleted when the last
+booking lets go of it.
+
+Because the key is the SHA-256 of the content, a client that already knows the
+digest of its video can ask whether the server holds it and skip the transfer.
+
+Uploads are assembled in local scratch space under MEDIA_ROOT. With the
+filesystem storage adopting one is a rename; with a remote storage it is
+uploaded once and the scratch file removed.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import StoredVideo
+from .storage import local_path
+
+
+BLOB_DIR = 'uploaded_videos/sha256'
+INCOMING_DIR = 'uploaded_videos/incoming'
+HASH_BUFFER_SIZE = 1024 * 1024
+
+EXTENSIONS = {
+    'video/mp4': '.mp4',
+    'video/quicktime': '.mov',
+    'video/mpeg': '.mpg',
+    'video/x-msvideo': '.avi',
+}
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def normalize_digest(value):
+    """Return a lowercase hex SHA-256 digest, or None if ``value`` is not one"""
+    value = str(value or '').strip().lower()
+    return value if _SHA256_RE.match(value) else None
+
+
+def blob_name(sha256, content_type):
+    return f'{BLOB_DIR}/{sha256[:2]}/{sha256}{EXTENSIONS.get(content_type, "")}'
+
+
+def scratch_path(name):
+    """Local path for a file that is still being written, whatever the storage backend"""
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+
+def video_storage():
+    return StoredVideo._meta.get_field('file').storage
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a local file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def storage_digest(name):
+    """SHA-256 hex digest of a file in video storage, read through the Storage API"""
+    digest = hashlib.sha256()
+    with video_storage().open(name, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def lookup(sha256):
+    """Return the stored video for a digest if its file is still present"""
+    sha256 = normalize_digest(sha256)
+    if not sha256:
+        return None
+    blob = StoredVideo.objects.filter(sha256=sha256).first()
+    if blob is None or not video_storage().exists(blob.file.name):
+        return None
+    return blob
+
+
+def ingest(path, sha256, size, content_type):
+    """Adopt a fully written local file as the stored copy of its content.
+
+    With local storage the file is renamed into place, never copied. If the
+    content is already stored, the new file is simply deleted.
+    """
+    storage = video_storage()
+    name = blob_name(sha256, content_type)
+
+    existing = StoredVideo.objects.filter(sha256=sha256).first()
+    if existing is not None and storage.exists(existing.file.name):
+        os.remove(path)
+        return existing
+
+    destination = local_path(storage, name)
+    if destination is not None:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+    else:
+        with open(path, 'rb') as fh:
+            storage.save(name, File(fh, name=name))
+        os.remove(path)
+    blob, _ = StoredVideo.objects.get_or_create(
+        sha256=sha256,
+        defaults={'file': name, 'size': size, 'content_type': content_type, 'content_sha256': sha256},
+    )
+    return blob
+
+
+def adopt(name, sha256, size, content_type):
+    """Register a file that was uploaded straight into storage under its content address.
+
+    If the content is already stored under another name, the new copy is deleted.
+    """
+    blob, _ = StoredVideo.objects.get_or_create(
+        sha256=sha256,
+        defaults={'file': name, 'size': size, 'content_type': content_type, 'content_sha256': sha256},
+    )
+    if blob.file.name != name:
+        video_storage().delete(name)
+    return blob
+
+
+def attach(booking, blob):
+    """Point a booking's video at a stored video, releasing any previous one"""
+    previous_id = booking.stored_video_id
+    if previous_id == blob.pk:
+        return booking
+
+    with transaction.atomic():
+        # Lock the row so a concurrent release cannot delete it underneath us
+        StoredVideo.objects.select_for_update().get(pk=blob.pk)
+        StoredVideo.objects.filter(pk=blob.pk).update(
+            ref_count=F('ref_count') + 1, last_referenced_at=timezone.now()
+        )
+        booking.stored_video = blob
+        booking.video_file.name = blob.file.name
+        if booking.pk:
+            booking.save(update_fields=['stored_video', 'video_file'])
+        else:
+            booking.save()
+        if previous_id:
+            release(previous_id)
+    return booking
+
+
+def release(blob_id):
+    """Drop one reference to a stored video, deleting the file on the last one"""
+    with transaction.atomic():
+        blob = StoredVideo.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            StoredVideo.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+            return
+        name = blob.file.name
+        blob.delete()
+        transaction.on_commit(lambda: video_storage().delete(name))
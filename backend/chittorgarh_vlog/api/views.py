@@ -1,57 +1,48 @@
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from django.conf import settings
-from django.core.cache import cache
 import razorpay
 from reportlab.pdfgen import canvas
 from django.http import HttpResponse
 from django.contrib.auth.decorators import login_required
 from rest_framework.permissions import IsAuthenticated
-from .models import Booking
+from .models import Booking, UploadSession
 from .serializers import BookingSerializer
+from . import admission, emails, heavyhitters, lifecycle, ratelimit, transitions, uploads, video_store, webhooks
+from .upload_handlers import MULTIPART_OVERHEAD, StoredVideoUpload, StreamingVideoUploadHandler
+from .tickets import issue_ticket
+from .idempotency import idempotent
+from .payments import mark_booking_paid, mark_pdf_purchase_paid
+from .ratelimit import get_client_ip, trusted_client_ip
+from .statements import normalize_transaction_id
+from .video import video_file_error
+from .pipeline import after_upload
+from .gateway import GatewayUnavailable, gateway
+from django.utils import timezone
+from datetime import timedelta
 import uuid
 import logging
+import os
 import re
-import time
-
 
-# Initialize clients
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 def check_rate_limit(request, key_prefix, max_requests=10, window=300):  # 10 requests per 5 minutes
-    """Check rate limit for a given key prefix"""
-    client_ip = get_client_ip(request)
-    cache_key = f"{key_prefix}_{client_ip}"
-
-    requests_data = cache.get(cache_key, {'count': 0, 'start_time': time.time()})
-    current_time = time.time()
-
-    # Reset if window has passed
-    if current_time - requests_data['start_time'] > window:
-        requests_data = {'count': 1, 'start_time': current_time}
-    else:
-        # Increment request count
-        requests_data['count'] += 1
-
-    cache.set(cache_key, requests_data, timeout=int(window))
+    """Check rate limit for a given key prefix (shared by all workers, see api/ratelimit.py)"""
+    return ratelimit.hit(key_prefix, trusted_client_ip(request), max_requests, window).allowed
 
-    if requests_data['count'] > max_requests:
-        return False  # Rate limit exceeded
-
-    return True
-
-def get_client_ip(request):
-    """Get the real client IP address from request"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+def _gateway_unavailable(error):
+    """503 telling the client to retry once the payment gateway has recovered"""
+    response = Response(
+        {'error': 'Payment gateway is temporarily unavailable. Please try again shortly.'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    if error.retry_after:
+        response['Retry-After'] = str(error.retry_after)
+    return response
 
 
 def sanitize_input(value):
@@ -70,11 +61,56 @@ def sanitize_input(value):
     return clean.strip()
 
 
+def _validate_booking_fields(data):
+    """Validate the booking form fields shared by create_booking and preflight_booking.
+
+    Returns (fields, error): the stripped fields, and an error message for a
+    400 response or None.
+    """
+    fields = {key: str(data.get(key) or '').strip() for key in ('name', 'email', 'contact', 'plan', 'amount')}
+
+    # Validate required fields
+    if not all(fields.values()):
+        return fields, 'Missing required fields: name, email, contact, plan, amount'
+
+    # Sanitize inputs to prevent XSS and injection
+    if not re.match(r'^[a-zA-Z\s\-\'\.]+$', fields['name']):
+        return fields, 'Name contains invalid characters'
+
+    if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', fields['email']):
+        return fields, 'Invalid email format'
+
+    # Validate amount is a positive number
+    try:
+        if float(fields['amount']) <= 0:
+            return fields, 'Amount must be a positive number'
+    except (ValueError, TypeError):
+        return fields, 'Amount must be a valid number'
+
+    # Validate contact format
+    contact = fields['contact']
+    if not contact.isdigit() or len(contact) < 10 or len(contact) > 15:
+        return fields, 'Contact number must be 10-15 digits'
+
+    return fields, None
+
+
 @api_view(['POST'])
+@idempotent('create_booking')
 def create_booking(request):
     """Create a booking record and save the video file locally.
 
-    Returns: { booking_id, amount }
+    The video is streamed straight into media storage by
+    StreamingVideoUploadHandler while the request body is parsed. Instead of
+    a file, the client may send ``video_sha256``: if that video is already
+    stored it is attached without being uploaded again.
+
+    With ``video_upload=direct`` plus ``video_sha256``, ``video_size``,
+    ``video_content_type`` and ``video_filename`` (and no file), the response
+    also carries ``upload``: an upload session whose presigned target the
+    client PUTs the video to, then finalizes via /api/uploads/<id>/finalize/.
+
+    Returns: { booking_id, amount, video_attached, upload? }
     """
     # Rate limiting: max 5 bookings per IP per 10 minutes
     if not check_rate_limit(request, 'create_booking', max_requests=5, window=600):
@@ -83,99 +119,355 @@ def create_booking(request):
             status=status.HTTP_429_TOO_MANY_REQUESTS
         )
 
+    # Must be installed before request.data / request.FILES are first touched
+    video_handler = StreamingVideoUploadHandler(request)
+    request.upload_handlers.insert(0, video_handler)
+    video_file = None
+    booking = None
+
     try:
         # Validate required fields
         data = request.data
-        name = data.get('name', '').strip()
-        email = data.get('email', '').strip()
-        contact = data.get('contact', '').strip()
-        plan = data.get('plan', '').strip()
-        amount = data.get('amount', '').strip()
+        video_file = request.FILES.get('video_file')
 
-        # Validate required fields
-        if not name or not email or not contact or not plan or not amount:
-            return Response(
-                {'error': 'Missing required fields: name, email, contact, plan, amount'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # The upload handler stops reading the body as soon as the video is rejected
+        upload_error = getattr(request, 'video_upload_error', None)
+        if upload_error:
+            return Response({'error': upload_error}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Sanitize inputs to prevent XSS and injection
-        import re
-        if not re.match(r'^[a-zA-Z\s\-\'\.]+$', name):
-            return Response(
-                {'error': 'Name contains invalid characters'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        fields, field_error = _validate_booking_fields(data)
+        if field_error:
+            return Response({'error': field_error}, status=status.HTTP_400_BAD_REQUEST)
+        name, email, contact, plan, amount = (
+            fields['name'], fields['email'], fields['contact'], fields['plan'], fields['amount']
+        )
 
-        if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
-            return Response(
-                {'error': 'Invalid email format'},
-                status=status.HTTP_400_BAD_REQUEST
+        # Validate file type (from its leading bytes) and size
+        if video_file:
+            video_error = video_file_error(video_file)
+            if video_error:
+                return Response({'error': video_error}, status=status.HTTP_400_BAD_REQUEST)
+
+        video_sha256 = data.get('video_sha256', '').strip()
+        if video_sha256 and not video_store.normalize_digest(video_sha256):
+            return Response({'error': 'video_sha256 must be a hex SHA-256 digest'}, status=status.HTTP_400_BAD_REQUEST)
+        video_sha256 = video_store.normalize_digest(video_sha256) or ''
+
+        # Announced video for an upload that happens after the booking exists
+        video_upload = data.get('video_upload', '').strip()
+        if video_upload and not video_file:
+            if video_upload not in ('direct', 'chunked'):
+                return Response({'error': 'video_upload must be "direct" or "chunked"'}, status=status.HTTP_400_BAD_REQUEST)
+            video_filename = os.path.basename(str(data.get('video_filename', '')).strip())
+            video_content_type = str(data.get('video_content_type', '')).strip()
+            try:
+                video_size = int(data.get('video_size'))
+                uploads.check_upload(video_content_type, video_size)
+            except (ValueError, TypeError):
+                return Response({'error': 'video_size must be a whole number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+            except uploads.UploadError as e:
+                return Response({'error': e.message}, status=e.status_code)
+            if not video_filename:
+                return Response({'error': 'video_filename is required'}, status=status.HTTP_400_BAD_REQUEST)
+            if video_upload == 'direct' and not video_sha256:
+                return Response({'error': 'video_sha256 is required for direct uploads'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Identical videos share one stored file
+        blob = None
+        if isinstance(video_file, StoredVideoUpload):
+            blob = video_store.ingest(video_file.path, video_file.sha256, video_file.size, video_file.detected_type)
+        elif video_sha256:
+            blob = video_store.lookup(video_sha256)
+
+        new_booking = Booking(
+            name=name,
+            email=email,
+            contact=contact,
+            plan=plan,
+            amount=amount,
+            status='pending'
+        )
+        if blob:
+            video_store.attach(new_booking, blob)
+            after_upload(new_booking)
+            lifecycle.maybe_run()
+        else:
+            new_booking.save()
+        booking = new_booking
+
+        payload = {
+            'booking_id': booking.booking_id,
+            'amount': booking.amount,
+            'video_attached': blob is not None,
+        }
+        if video_upload and not video_file and blob is None:
+            session = _open_upload_session(
+                booking, video_upload, video_filename, video_content_type, video_size, video_sha256
             )
+            payload['upload'] = _upload_session_payload(session)
+
+        logger.info(f"Successfully created booking: {booking.booking_id}")
+        return Response(payload, status=status.HTTP_201_CREATED)
+    except Exception as e:
+        logger.error(f"Error creating booking: {str(e)}")
+        # Don't expose internal error details to client
+        return Response({'error': 'An error occurred while creating the booking'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        # Don't leave orphaned videos behind for rejected or interrupted bookings
+        if video_handler.active:
+            video_handler.cleanup()
+        if booking is None and isinstance(video_file, StoredVideoUpload):
+            video_file.discard()
+
+
+@api_view(['POST'])
+def preflight_booking(request):
+    """Validate a booking and the video it will carry before any of it is uploaded.
+
+    Expects JSON { name, email, contact, plan, amount, video_filename?,
+    video_size? } and checks them exactly as create_booking would; the
+    video's type is checked from its leading bytes once it arrives. The returned ticket must be sent as the
+    ``X-Upload-Ticket`` header of the create_booking request carrying the
+    video; without one, UploadAdmissionMiddleware refuses large bodies.
+
+    Returns: { ticket, expires_in, max_body_size }
+    """
+    if not check_rate_limit(request, 'preflight_booking', max_requests=10, window=600):
+        return Response(
+            {'error': 'Rate limit exceeded. Please try again later.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+    data = request.data
+    _, field_error = _validate_booking_fields(data)
+    if field_error:
+        return Response({'error': field_error}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Validate amount is a positive number
+    video_size = 0
+    if data.get('video_size') not in (None, ''):
+        # Only the size: browsers often send an empty or generic type, and the upload is sniffed anyway
         try:
-            float_amount = float(amount)
-            if float_amount <= 0:
-                return Response(
-                    {'error': 'Amount must be a positive number'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            video_size = int(data.get('video_size'))
+            uploads.check_upload_size(video_size)
         except (ValueError, TypeError):
+            return Response({'error': 'video_size must be a whole number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+        except uploads.UploadError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        if not os.path.basename(str(data.get('video_filename', '')).strip()):
+            return Response({'error': 'video_filename is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_body_size = video_size + MULTIPART_OVERHEAD
+    return Response({
+        'ticket': issue_ticket(max_body_size),
+        'expires_in': settings.UPLOAD_TICKET_TTL,
+        'max_body_size': max_body_size,
+    })
+
+
+def _open_upload_session(booking, mode, filename, content_type, total_size, sha256):
+    """Open a direct-to-storage session when the storage supports it, else a chunked one"""
+    if mode == 'direct' and uploads.direct_uploads_supported():
+        return uploads.open_direct_session(booking, filename, content_type, total_size, sha256)
+    return uploads.open_session(booking, filename, content_type, total_size, sha256)
+
+
+def _upload_session_payload(session):
+    payload = {
+        'upload_required': True,
+        'upload_id': session.upload_id,
+        'mode': session.mode,
+        'booking_id': session.booking.booking_id,
+        'status': session.status,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received_bytes': session.received_bytes,
+        'next_chunk': session.next_chunk,
+        'expires_at': session.expires_at,
+    }
+    if session.mode == 'direct' and session.status == 'active':
+        # Re-signed on every call, so polling the status refreshes an expired URL
+        payload['upload_target'] = uploads.upload_target(session)
+    return payload
+
+
+@api_view(['POST'])
+def create_upload_session(request):
+    """Open (or resume) a resumable upload for a booking's video.
+
+    Expects JSON { booking_id, filename, content_type, total_size, sha256?, mode? }.
+    Returns the session with chunk_size and the offset to resume from, or
+    { upload_required: false } when a video with that sha256 is already stored.
+
+    ``mode: "direct"`` (requires sha256) asks for a presigned ``upload_target``
+    in storage instead of chunk uploads; the response's ``mode`` says which one
+    the storage backend granted.
+    """
+    if not check_rate_limit(request, 'upload_session', max_requests=10, window=600):
+        return Response(
+            {'error': 'Rate limit exceeded. Please try again later.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+    try:
+        data = request.data
+        booking_id = str(data.get('booking_id', '')).strip()
+        filename = os.path.basename(str(data.get('filename', '')).strip())
+        content_type = str(data.get('content_type', '')).strip()
+
+        if not booking_id or not filename or not content_type or not data.get('total_size'):
             return Response(
-                {'error': 'Amount must be a valid number'},
+                {'error': 'Missing required fields: booking_id, filename, content_type, total_size'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Validate contact format
-        if not contact.isdigit() or len(contact) < 10 or len(contact) > 15:
+        try:
+            total_size = int(data.get('total_size'))
+        except (ValueError, TypeError):
+            return Response({'error': 'total_size must be a whole number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+
+        sha256 = ''
+        if data.get('sha256'):
+            sha256 = video_store.normalize_digest(data.get('sha256'))
+            if not sha256:
+                return Response({'error': 'sha256 must be a hex SHA-256 digest'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            booking = Booking.objects.get(booking_id=booking_id)
+        except Booking.DoesNotExist:
+            return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Short-circuit: the server already holds this exact video
+        blob = video_store.lookup(sha256) if sha256 else None
+        if blob and booking.status == 'pending':
+            video_store.attach(booking, blob)
+            after_upload(booking)
+            logger.info(f"Attached stored video {sha256[:12]} to booking {booking.booking_id} without upload")
+            return Response({'upload_required': False, 'booking_id': booking.booking_id, 'video_attached': True})
+
+        mode = str(data.get('mode', 'chunked')).strip()
+        if mode not in ('direct', 'chunked'):
+            return Response({'error': 'mode must be "direct" or "chunked"'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session = _open_upload_session(booking, mode, filename, content_type, total_size, sha256)
+        except uploads.UploadError as e:
+            return Response({'error': e.message}, status=e.status_code)
+
+        logger.info(f"Upload session {session.upload_id} opened for booking {booking.booking_id}")
+        return Response(_upload_session_payload(session), status=status.HTTP_201_CREATED)
+    except Exception as e:
+        logger.error(f"Error creating upload session: {str(e)}")
+        return Response({'error': 'An error occurred while creating the upload session'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def upload_status(request, upload_id):
+    """Report how many bytes of an upload have been received so the client can resume"""
+    try:
+        session = UploadSession.objects.select_related('booking').get(upload_id=upload_id)
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(_upload_session_payload(session))
+
+
+@api_view(['PUT'])
+def upload_chunk(request, upload_id, index):
+    """Store chunk ``index`` of an upload. The body is the raw chunk bytes.
+
+    An optional ``Upload-Offset`` header must match ``index * chunk_size``.
+    """
+    try:
+        try:
+            session = UploadSession.objects.select_related('booking').get(upload_id=upload_id)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            declared_offset = request.META.get('HTTP_UPLOAD_OFFSET')
+            declared_offset = int(declared_offset) if declared_offset is not None else None
+        except ValueError:
+            return Response({'error': 'Invalid Content-Length or Upload-Offset header'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            received = uploads.write_chunk(session, index, request.stream, content_length, declared_offset)
+        except uploads.UploadError as e:
             return Response(
-                {'error': 'Contact number must be 10-15 digits'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': e.message, 'received_bytes': session.received_bytes, 'next_chunk': session.next_chunk},
+                status=e.status_code
             )
 
-        # Handle video file upload
-        video_file = request.FILES.get('video_file')
+        return Response({
+            'upload_id': session.upload_id,
+            'received_bytes': received,
+            'next_chunk': session.next_chunk,
+            'complete': received == session.total_size,
+        })
+    except Exception as e:
+        logger.error(f"Error storing chunk {index} of upload {upload_id}: {str(e)}")
+        return Response({'error': 'An error occurred while storing the chunk'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Optionally validate file type and size
-        if video_file:
-            # Check file type
-            allowed_types = ['video/mp4', 'video/mpeg', 'video/quicktime', 'video/x-msvideo']
-            if video_file.content_type not in allowed_types:
-                return Response(
-                    {'error': f'Video file type not supported. Allowed types: {allowed_types}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
 
-            # Check file size (limit to 500MB as per frontend)
-            max_size = 500 * 1024 * 1024  # 500MB
-            if video_file.size > max_size:
-                return Response(
-                    {'error': 'Video file size too large. Maximum size is 500MB'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+@api_view(['POST'])
+def finalize_upload(request, upload_id):
+    """Attach a fully received upload to its booking's video_file.
 
-        booking = Booking.objects.create(
-            name=name,
-            email=email,
-            contact=contact,
-            plan=plan,
-            amount=amount,
-            video_file=video_file,  # Save the uploaded file locally
-            status='pending'
-        )
+    Direct uploads are checked against the announced size and sha256 first.
+    """
+    try:
+        try:
+            session = UploadSession.objects.select_related('booking').get(upload_id=upload_id)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        logger.info(f"Successfully created booking: {booking.booking_id}")
-        return Response({'booking_id': booking.booking_id, 'amount': booking.amount}, status=status.HTTP_201_CREATED)
+        try:
+            booking = uploads.finalize_session(session)
+        except uploads.UploadError as e:
+            return Response(
+                {'error': e.message, 'received_bytes': session.received_bytes, 'next_chunk': session.next_chunk},
+                status=e.status_code
+            )
+        # Direct uploads never pass through our servers; don't pull the whole file in to remux it
+        after_upload(booking, metadata_only=session.mode == 'direct')
+        lifecycle.maybe_run()
+
+        logger.info(f"Upload {session.upload_id} finalized into booking {booking.booking_id}")
+        return Response({'success': True, 'booking_id': booking.booking_id, 'upload_id': session.upload_id})
     except Exception as e:
-        logger.error(f"Error creating booking: {str(e)}")
-        # Don't expose internal error details to client
-        return Response({'error': 'An error occurred while creating the booking'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logger.error(f"Error finalizing upload {upload_id}: {str(e)}")
+        return Response({'error': 'An error occurred while finalizing the upload'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _booking_order(booking, amount):
+    """The booking's open Razorpay order for ``amount`` paise, created only if there is none"""
+    now = timezone.now()
+    if (booking.razorpay_order_id and booking.razorpay_order_amount == amount
+            and booking.razorpay_order_expires_at and booking.razorpay_order_expires_at > now):
+        return {'id': booking.razorpay_order_id, 'amount': amount, 'currency': 'INR'}
+
+    order = gateway().create_order(amount, receipt=booking.booking_id)
+    # Only replace the order we looked at; a concurrent checkout may have stored one first
+    stored = Booking.objects.filter(pk=booking.pk, razorpay_order_id=booking.razorpay_order_id).update(
+        razorpay_order_id=order['id'],
+        razorpay_order_amount=amount,
+        razorpay_order_expires_at=now + timedelta(minutes=settings.RAZORPAY_ORDER_TTL_MINUTES),
+    )
+    if not stored:
+        booking.refresh_from_db()
+        if booking.razorpay_order_id and booking.razorpay_order_amount == amount:
+            return {'id': booking.razorpay_order_id, 'amount': amount, 'currency': 'INR'}
+    return order
 
 
 @api_view(['POST'])
+@idempotent('create_order')
 def create_order(request):
     """Create a Razorpay order for a booking. Expects JSON { booking_id } or { amount }.
+
+    A booking keeps its order: repeat checkouts get the same order back from
+    the database, without a gateway call, until it expires or the amount changes.
     """
     # Rate limiting: max 10 orders per IP per 10 minutes
     if not check_rate_limit(request, 'create_order', max_requests=10, window=600):
@@ -208,14 +500,13 @@ def create_order(request):
             except (ValueError, TypeError):
                 return Response({'error': 'Amount must be a valid number'}, status=status.HTTP_400_BAD_REQUEST)
 
-        order_data = {
-            'amount': amount,
-            'currency': 'INR',
-            'payment_capture': 1
-        }
-
         try:
-            order = razorpay_client.order.create(data=order_data)
+            if booking_id:
+                order = _booking_order(booking, amount)
+            else:
+                order = gateway().create_order(amount)
+        except GatewayUnavailable as e:
+            return _gateway_unavailable(e)
         except Exception as e:
             logger.error(f"Error creating Razorpay order: {str(e)}")
             return Response({'error': 'Payment gateway error. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -261,7 +552,7 @@ def verify_payment(request):
 
         # Verify signature only after confirming booking exists and not already processed
         try:
-            razorpay_client.utility.verify_payment_signature({
+            gateway().verify_payment_signature({
                 'razorpay_order_id': razorpay_order_id,
                 'razorpay_payment_id': razorpay_payment_id,
                 'razorpay_signature': razorpay_signature
@@ -270,110 +561,7 @@ def verify_payment(request):
             logger.warning(f"Payment signature verification failed: {str(e)}")
             return Response({'error': 'Payment verification failed. Invalid signature.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update booking status
-        booking.status = 'payment_received'
-        booking.save()
-
-        logger.info(f"Payment verified and booking updated: {booking.booking_id}")
-
-        # Send confirmation email if configured (using proper HTML escaping)
-        try:
-            from django.core.mail import send_mail
-            from django.utils.html import escape
-            from datetime import datetime, timedelta
-            
-            # Calculate expected go-live time (within 24 hours)
-            now = datetime.now()
-            go_live_time = now + timedelta(hours=24)
-            go_live_formatted = go_live_time.strftime("%B %d, %Y at %I:%M %p")
-            
-            # 1. Send Congratulations Email to Customer
-            if booking.email and settings.EMAIL_HOST_USER:
-                sanitized_booking_id = escape(booking.booking_id)
-                customer_email_message = f"""
-🎉 CONGRATULATIONS! 🎉
-
-Dear {booking.name},
-
-Thank you for choosing ChittorgarhVlog! Your payment has been successfully received.
-
-═══════════════════════════════════════
-📋 ORDER DETAILS
-═══════════════════════════════════════
-• Booking ID: {sanitized_booking_id}
-• Plan: {booking.plan}
-• Amount Paid: ₹{booking.amount}
-• Payment Status: ✅ CONFIRMED
-• Order Date: {now.strftime("%B %d, %Y at %I:%M %p")}
-
-═══════════════════════════════════════
-📅 WHEN WILL YOUR VIDEO GO LIVE?
-═══════════════════════════════════════
-Your story/post will be published on our official Instagram page:
-📸 @chittorgarhvlog
-
-Expected Go-Live Time: {go_live_formatted}
-(Within 24 hours of payment confirmation)
-
-You will receive a notification once your content is live!
-
-═══════════════════════════════════════
-📞 NEED HELP?
-═══════════════════════════════════════
-• WhatsApp: +91 63775 95978
-• Email: narendrakumar9664@gmail.com
-• Instagram: @chittorgarh_vlog
-
-Thank you for trusting ChittorgarhVlog to share your story with Chittorgarh!
-
-Warm regards,
-Team ChittorgarhVlog
-"""
-                send_mail(
-                    subject=f'🎉 Congratulations! Your Order #{sanitized_booking_id} is Confirmed - ChittorgarhVlog',
-                    message=customer_email_message,
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[booking.email],
-                    fail_silently=True,
-                )
-            
-            # 2. Send to Admin (You)
-            if settings.EMAIL_HOST_USER:
-                video_url = "No video uploaded"
-                if booking.video_file:
-                    # Generate full download URL
-                    video_url = request.build_absolute_uri(booking.video_file.url)
-                
-                send_mail(
-                    subject=f'💰 New Booking: {booking.name} - ₹{booking.amount}',
-                    message=f"""
-                    New Booking Received!
-                    
-                    Name: {booking.name}
-                    Email: {booking.email}
-                    Phone: {booking.contact}
-                    Plan: {booking.plan}
-                    Amount: ₹{booking.amount}
-                    
-                    ----------------------------------------
-                    VIDEO DOWNLOAD LINK (Valid for ~24h on Railway):
-                    {video_url}
-                    ----------------------------------------
-                    
-                    ACTION REQUIRED:
-                    1. Download the video immediately
-                    2. Post on @chittorgarhvlog by {go_live_formatted}
-                    3. Send confirmation to customer
-                    
-                    If the video is missing or link is broken, contact the user immediately via WhatsApp: {booking.contact}
-                    """,
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[settings.EMAIL_HOST_USER], # Send to yourself
-                    fail_silently=True,
-                )
-                
-        except Exception as email_error:
-            logger.warning(f"Failed to send confirmation email: {str(email_error)}")
+        mark_booking_paid(booking, razorpay_payment_id, request.build_absolute_uri('/'))
 
         return Response({'success': True, 'booking_id': booking.booking_id, 'message': 'Payment verified and booking updated'})
     except Exception as e:
@@ -382,6 +570,7 @@ Team ChittorgarhVlog
 
 
 @api_view(['POST'])
+@idempotent('submit_manual_payment')
 def submit_manual_payment(request):
     """Submit manual payment details (Transaction ID)"""
     # Rate limiting
@@ -400,20 +589,25 @@ def submit_manual_payment(request):
         except Booking.DoesNotExist:
             return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        booking.payment_method = 'manual'
-        booking.transaction_id = transaction_id
+        transaction_id = normalize_transaction_id(transaction_id)
         # We keep status as pending or move to payment_received? 
         # For manual, we want admin to verify. But to stop the user from worrying, we can say "Payment Submitted".
         # Let's set it to 'payment_received' so it shows up in the list as paid/processed, 
         # but the admin knows it's manual via payment_method.
-        booking.status = 'payment_received' 
-        booking.save()
+        # The payment is checked against the bank statement by `manage.py import_bank_statement`.
+        if not transitions.booking_status.apply(
+            booking, 'submit_manual',
+            payment_method='manual', transaction_id=transaction_id, payment_verification='unverified',
+        ):
+            booking.refresh_from_db(fields=['status'])
+            return Response({
+                'error': f'Payment already processed for this booking with status: {booking.status}'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         logger.info(f"Manual payment submitted for booking: {booking.booking_id}, txn: {transaction_id}")
 
         # Send confirmation email
         try:
-            from django.core.mail import send_mail
             from django.utils.html import escape
             from datetime import datetime, timedelta
             
@@ -466,21 +660,22 @@ Thank you for trusting ChittorgarhVlog to share your story with Chittorgarh!
 Warm regards,
 Team ChittorgarhVlog
 """
-                send_mail(
+                emails.queue(
                     subject=f'🎉 Congratulations! Your Order #{sanitized_booking_id} is Confirmed - ChittorgarhVlog',
                     message=customer_email_message,
                     from_email=settings.EMAIL_HOST_USER,
                     recipient_list=[booking.email],
-                    fail_silently=True,
+                    booking=booking,
+                    kind='manual_payment_customer',
                 )
             
             # 2. Send to Admin
             if settings.EMAIL_HOST_USER:
                 video_url = "No video uploaded"
                 if booking.video_file:
-                    video_url = request.build_absolute_uri(booking.video_file.url)
+                    video_url = request.build_absolute_uri(media_url(booking.video_file.name))
                 
-                send_mail(
+                emails.notify_admin(
                     subject=f'💰 Manual Payment: {booking.name} - ₹{booking.amount}',
                     message=f"""
                     Manual Payment Submitted!
@@ -505,9 +700,8 @@ Team ChittorgarhVlog
                     
                     WhatsApp contact: {booking.contact}
                     """,
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[settings.EMAIL_HOST_USER],
-                    fail_silently=True,
+                    booking=booking,
+                    kind='manual_payment_admin',
                 )
         except Exception as email_error:
             logger.warning(f"Failed to send confirmation email: {str(email_error)}")
@@ -558,13 +752,12 @@ def send_thank_you_email(request):
         except Booking.DoesNotExist:
             return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Update status to completed
-        booking.status = 'completed'
-        booking.save()
+        # Update status to completed; only the request that does so sends the email
+        if not transitions.booking_status.apply(booking, 'complete'):
+            return Response({'success': True, 'message': 'Booking was already completed'})
         
         # Send thank you + feedback email
         try:
-            from django.core.mail import send_mail
             from django.utils.html import escape
             from datetime import datetime
             
@@ -627,15 +820,16 @@ With gratitude,
 Pawan Salvi
 Founder, ChittorgarhVlog
 """
-                send_mail(
+                emails.queue(
                     subject=f'🙏 Thank You! Your Content is Now Live - Order #{sanitized_booking_id}',
                     message=thank_you_message,
                     from_email=settings.EMAIL_HOST_USER,
                     recipient_list=[booking.email],
-                    fail_silently=True,
+                    booking=booking,
+                    kind='thank_you',
                 )
                 
-                logger.info(f"Thank you email sent for booking: {booking.booking_id}")
+                logger.info(f"Thank you email queued for booking: {booking.booking_id}")
                 
         except Exception as email_error:
             logger.warning(f"Failed to send thank you email: {str(email_error)}")
@@ -701,6 +895,9 @@ def generate_pdf(request, booking_id):
         return Response({'error': 'An error occurred while generating the PDF'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+BOOKING_ORDERING_FIELDS = ['created_at', 'amount', 'video_duration', 'video_width', 'video_height', 'video_bitrate']
+
+
 @permission_classes([IsAuthenticated])
 @api_view(['GET'])
 def list_bookings(request):
@@ -710,7 +907,28 @@ def list_bookings(request):
         return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
 
     try:
-        bookings = Booking.objects.all().order_by('-created_at')
+        bookings = Booking.objects.all()
+
+        # Filter and sort on the video metadata probed at upload time
+        codec = request.GET.get('video_codec')
+        if codec:
+            bookings = bookings.filter(video_codec=codec)
+        try:
+            if request.GET.get('min_duration'):
+                bookings = bookings.filter(video_duration__gte=float(request.GET['min_duration']))
+            if request.GET.get('max_duration'):
+                bookings = bookings.filter(video_duration__lte=float(request.GET['max_duration']))
+        except ValueError:
+            return Response({'error': 'Duration filters must be numbers of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ordering = request.GET.get('ordering', '-created_at')
+        if ordering.lstrip('-') not in BOOKING_ORDERING_FIELDS:
+            return Response(
+                {'error': f'ordering must be one of: {", ".join(BOOKING_ORDERING_FIELDS)} (prefix - for descending)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        bookings = bookings.order_by(ordering, '-created_at')
+
         # Add pagination for performance
         from django.core.paginator import Paginator
         paginator = Paginator(bookings, 50)  # 50 bookings per page
@@ -734,16 +952,100 @@ def list_bookings(request):
         return Response({'error': 'An error occurred while retrieving bookings'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def upload_metrics(request):
+    """Upload admission counters for admins.
+
+    Returns: { in_flight, max_concurrent, max_concurrent_per_process,
+    queue_depth, admitted, queued, rejected }
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(admission.metrics())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def gateway_metrics(request):
+    """Razorpay call latency, failures and circuit breaker state of this worker, for admins"""
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(gateway().stats())
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def top_talkers(request):
+    """Heaviest clients of the public write endpoints seen by this worker, and the shared deny-list.
+
+    POST { action: 'deny' | 'allow', kind: 'ip' | 'prefix' | 'agent', value, seconds? }
+    denies or re-allows a client by hand.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+
+    if request.method == 'POST':
+        action = request.data.get('action')
+        kind = request.data.get('kind')
+        value = str(request.data.get('value') or '').strip()
+        if action not in ('deny', 'allow') or kind not in heavyhitters.DIMENSIONS or not value:
+            return Response(
+                {'error': 'action (deny/allow), kind (ip/prefix/agent) and value are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if action == 'deny':
+            try:
+                seconds = int(request.data.get('seconds') or settings.HEAVY_HITTER_DENY_SECONDS)
+            except (TypeError, ValueError):
+                return Response({'error': 'seconds must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+            heavyhitters.deny_list().deny(kind, value, seconds)
+        else:
+            heavyhitters.deny_list().allow(kind, value)
+        logger.info(f"Admin {request.user.username} {action} {kind} {value}")
+
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), settings.HEAVY_HITTER_CAPACITY)
+    except ValueError:
+        limit = 20
+    return Response(heavyhitters.report(limit))
+
+
+
+@api_view(['POST'])
+@throttle_classes([])
+def razorpay_webhook(request):
+    """Receive a Razorpay webhook (payment.captured, order.paid).
+
+    Only verifies the X-Razorpay-Signature, stores the event in the inbox and
+    acknowledges it; the background worker applies it (api/webhooks.py).
+    """
+    if not settings.RAZORPAY_WEBHOOK_SECRET:
+        return Response({'error': 'Webhooks are not configured'}, status=status.HTTP_404_NOT_FOUND)
+
+    body = request.body
+    if not webhooks.verify_signature(body, request.META.get('HTTP_X_RAZORPAY_SIGNATURE', '')):
+        logger.warning("Rejected Razorpay webhook with an invalid signature")
+        return Response({'error': 'Invalid signature'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        stored = webhooks.ingest(request.META.get('HTTP_X_RAZORPAY_EVENT_ID', ''), body)
+    except ValueError:
+        return Response({'error': 'Invalid webhook payload'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'status': 'accepted' if stored else 'ignored'})
+
 # ==================== PDF DOWNLOAD ENDPOINTS ====================
 
 from .models import PDFPurchase, MediaKitDownload
-from django.http import FileResponse
+from .media import file_response, media_url
 import os
 from datetime import datetime, timedelta
 import secrets
 
 
 @api_view(['POST'])
+@idempotent('create_pdf_purchase')
 def create_pdf_purchase(request):
     """
     Create Razorpay order for paid PDF (₹9 Chittorgarh Guide)
@@ -773,15 +1075,30 @@ def create_pdf_purchase(request):
             return Response({'error': 'Invalid phone number'}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
-        # Create Razorpay order
         pdf_amount = 9  # ₹9
-        order_data = {
-            'amount': pdf_amount * 100,  # Convert to paise
-            'currency': 'INR',
-            'payment_capture': 1
-        }
-        
-        razorpay_order = razorpay_client.order.create(data=order_data)
+
+        # Reopened checkout: hand back the open order instead of creating another
+        open_purchase = PDFPurchase.objects.filter(
+            email=email,
+            phone=phone,
+            pdf_name='chittorgarh-guide.pdf',
+            amount=pdf_amount,
+            payment_status='pending',
+            order_expires_at__gt=timezone.now(),
+        ).first()
+        if open_purchase:
+            return Response({
+                'order_id': open_purchase.razorpay_order_id,
+                'amount': pdf_amount,
+                'currency': 'INR',
+                'purchase_id': open_purchase.id
+            })
+
+        # Create Razorpay order
+        try:
+            razorpay_order = gateway().create_order(pdf_amount * 100)  # Convert to paise
+        except GatewayUnavailable as e:
+            return _gateway_unavailable(e)
         
         # Create PDF purchase record
         pdf_purchase = PDFPurchase.objects.create(
@@ -791,6 +1108,7 @@ def create_pdf_purchase(request):
             pdf_name='chittorgarh-guide.pdf',
             amount=pdf_amount,
             razorpay_order_id=razorpay_order['id'],
+            order_expires_at=timezone.now() + timedelta(minutes=settings.RAZORPAY_ORDER_TTL_MINUTES),
             payment_status='pending',
             ip_address=get_client_ip(request)
         )
@@ -832,7 +1150,7 @@ def verify_pdf_payment(request):
         }
         
         try:
-            razorpay_client.utility.verify_payment_signature(params_dict)
+            gateway().verify_payment_signature(params_dict)
         except razorpay.errors.SignatureVerificationError:
             logger.warning(f"Invalid payment signature for order {razorpay_order_id}")
             return Response({'error': 'Invalid payment signature'}, 
@@ -854,30 +1172,8 @@ def verify_pdf_payment(request):
                 'pdf_name': pdf_purchase.pdf_name
             })
         
-        # Generate one-time download token
-        download_token = secrets.token_urlsafe(32)
-        
-        # Update purchase record
-        pdf_purchase.razorpay_payment_id = razorpay_payment_id
-        pdf_purchase.payment_status = 'completed'
-        pdf_purchase.download_token = download_token
-        pdf_purchase.save()
-        
-        logger.info(f"PDF payment verified: {pdf_purchase.id}")
-        
-        # Send confirmation email (optional)
-        try:
-            from django.core.mail import send_mail
-            send_mail(
-                subject='Chittorgarh Guide - Download Ready',
-                message=f'Thank you for your purchase! Your download is ready.',
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[pdf_purchase.email],
-                fail_silently=True
-            )
-        except:
-            pass  # Don't fail if email fails
-        
+        download_token = mark_pdf_purchase_paid(pdf_purchase, razorpay_payment_id)
+
         return Response({
             'success': True,
             'download_token': download_token,
@@ -909,29 +1205,26 @@ def submit_pdf_manual_payment(request):
             return Response({'error': 'Purchase record not found'}, 
                           status=status.HTTP_404_NOT_FOUND)
         
-        # Check if already completed
-        if pdf_purchase.payment_status == 'completed':
+        # Update record; if it was already completed, return the existing token
+        download_token = secrets.token_urlsafe(32)
+        if not transitions.pdf_payment_status.apply(
+            pdf_purchase, 'submit_manual',
+            razorpay_payment_id=f"manual_{normalize_transaction_id(transaction_id)}",
+            payment_verification='unverified',
+            download_token=download_token,
+        ):
+            pdf_purchase.refresh_from_db()
             return Response({
                 'success': True,
                 'download_token': pdf_purchase.download_token,
                 'pdf_name': pdf_purchase.pdf_name
             })
-            
-        # Update record
-        pdf_purchase.razorpay_payment_id = f"manual_{transaction_id}"
-        pdf_purchase.payment_status = 'completed'
-        
-        # Generate download token
-        download_token = secrets.token_urlsafe(32)
-        pdf_purchase.download_token = download_token
-        pdf_purchase.save()
         
         logger.info(f"Manual PDF payment submitted: {pdf_purchase.id}, txn: {transaction_id}")
         
         # Send admin notification
         try:
-            from django.core.mail import send_mail
-            send_mail(
+            emails.notify_admin(
                 subject=f'💰 Manual PDF Purchase: {pdf_purchase.name} - ₹{pdf_purchase.amount}',
                 message=f"""
                 Manual PDF Payment Submitted!
@@ -945,9 +1238,8 @@ def submit_pdf_manual_payment(request):
                 
                 Please verify this transaction in your bank account.
                 """,
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[settings.EMAIL_HOST_USER],
-                fail_silently=True
+                pdf_purchase=pdf_purchase,
+                kind='pdf_manual_admin',
             )
         except:
             pass
@@ -984,23 +1276,20 @@ def download_paid_pdf(request, token):
                 return Response({'error': 'Download link has expired. Please contact support if you need assistance.'}, 
                               status=status.HTTP_410_GONE)
         
-        # Mark as downloaded
+        # Mark as downloaded (the first download only)
         if not pdf_purchase.downloaded_at:
-            pdf_purchase.downloaded_at = datetime.now()
-            pdf_purchase.save()
+            transitions.update_if(pdf_purchase, {'downloaded_at__isnull': True}, downloaded_at=timezone.now())
         
-        # Local Storage
-        pdf_path = os.path.join(settings.MEDIA_ROOT, 'pdfs', 'paid', pdf_purchase.pdf_name)
+        pdf_path = f'pdfs/paid/{pdf_purchase.pdf_name}'
         
-        if not os.path.exists(pdf_path):
+        # Serve file
+        try:
+            response = file_response(pdf_path, 'application/pdf', pdf_purchase.pdf_name)
+        except FileNotFoundError:
             logger.error(f"PDF file not found: {pdf_path}")
             return Response({'error': 'PDF file not found'}, 
                           status=status.HTTP_404_NOT_FOUND)
         
-        # Serve file
-        response = FileResponse(open(pdf_path, 'rb'), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{pdf_purchase.pdf_name}"'
-        
         logger.info(f"PDF downloaded: {pdf_purchase.pdf_name} by {pdf_purchase.email}")
         
         return response
@@ -1052,19 +1341,18 @@ def download_mediakit_pdf(request, filename):
     try:
         # Sanitize filename to prevent directory traversal
         safe_filename = os.path.basename(filename)
-        pdf_path = os.path.join(settings.MEDIA_ROOT, 'pdfs', 'free', safe_filename)
-        
-        if not os.path.exists(pdf_path):
-            return Response({'error': 'PDF file not found'}, 
-                          status=status.HTTP_404_NOT_FOUND)
+        pdf_path = f'pdfs/free/{safe_filename}'
         
         # Serve file
         content_type = 'application/pdf'
         if safe_filename.endswith('.zip'):
             content_type = 'application/zip'
             
-        response = FileResponse(open(pdf_path, 'rb'), content_type=content_type)
-        response['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
+        try:
+            response = file_response(pdf_path, content_type, safe_filename)
+        except FileNotFoundError:
+            return Response({'error': 'PDF file not found'}, 
+                          status=status.HTTP_404_NOT_FOUND)
         
         logger.info(f"Media kit downloaded: {safe_filename}")
         
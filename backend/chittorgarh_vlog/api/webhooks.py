@@ -0,0 +1,153 @@
+"""
+Razorpay webhook inbox.
+
+The webhook view only checks the signature, stores the event and answers
+200. Razorpay retries deliveries it considers failed, so the view stays
+fast and never depends on our own processing. An event is inserted with
+``bulk_create(ignore_conflicts=True)`` on its unique event id, so
+redeliveries are dropped by the database.
+
+``process_pending()`` works through pending events in batches. A stored
+event queues it as a background task (api/tasks.py); at most one such task
+waits at a time, and it covers every event stored before it runs. The
+``process_webhooks`` command runs it by hand or from cron. For each batch it looks up the affected bookings
+and PDF purchases in one query each, then applies the same state changes as
+the verify views through api/payments.py. A payment the browser already
+verified is simply marked processed. Events that fail are retried up to
+``RAZORPAY_WEBHOOK_MAX_ATTEMPTS`` times.
+"""
+import hashlib
+import hmac
+import json
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Booking, PDFPurchase, RazorpayWebhookEvent
+from . import tasks
+from .payments import mark_booking_paid, mark_pdf_purchase_paid
+
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EVENTS = ('payment.captured', 'order.paid')
+
+
+def verify_signature(body, signature):
+    """Check X-Razorpay-Signature, the hex HMAC-SHA256 of the raw body"""
+    secret = settings.RAZORPAY_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def parse(body):
+    """Return (event, order_id, payment_id, payload) from a webhook body; ValueError if malformed"""
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError('Webhook body is not a JSON object')
+    entities = payload.get('payload') or {}
+    payment = (entities.get('payment') or {}).get('entity') or {}
+    order = (entities.get('order') or {}).get('entity') or {}
+    order_id = payment.get('order_id') or order.get('id') or ''
+    return str(payload.get('event', '')), str(order_id), str(payment.get('id') or ''), payload
+
+
+def ingest(event_id, body):
+    """Store a verified delivery; returns False for events we do not handle"""
+    event, order_id, payment_id, payload = parse(body)
+    if event not in SUPPORTED_EVENTS:
+        return False
+    # Razorpay always sends an event id; fall back to the body's digest just in case
+    event_id = event_id or hashlib.sha256(body).hexdigest()
+    RazorpayWebhookEvent.objects.bulk_create(
+        [RazorpayWebhookEvent(
+            event_id=event_id, event=event, order_id=order_id, payment_id=payment_id, payload=payload
+        )],
+        ignore_conflicts=True,
+    )
+    tasks.enqueue(process_inbox, unique_key='webhooks.process_inbox')
+    return True
+
+
+def _receipt(event):
+    order = ((event.payload.get('payload') or {}).get('order') or {}).get('entity') or {}
+    return order.get('receipt') or ''
+
+
+def _apply(event, bookings, purchases):
+    """Apply one event; returns the status to record"""
+    booking = bookings.get(event.order_id) or bookings.get(_receipt(event))
+    if booking is not None:
+        if booking.status == 'pending':
+            mark_booking_paid(booking, event.payment_id)
+        return 'processed'
+
+    purchase = purchases.get(event.order_id)
+    if purchase is not None:
+        mark_pdf_purchase_paid(purchase, event.payment_id)
+        return 'processed'
+
+    event.error = f'No booking or PDF purchase for order {event.order_id}'
+    return 'ignored'
+
+
+def process_batch(batch_size=None, exclude=()):
+    """Process up to ``batch_size`` pending events; returns the events handled"""
+    batch_size = batch_size or settings.RAZORPAY_WEBHOOK_BATCH_SIZE
+    pending = RazorpayWebhookEvent.objects.filter(status='pending').exclude(pk__in=exclude)
+    events = list(pending.order_by('received_at')[:batch_size])
+    if not events:
+        return []
+
+    order_ids = {event.order_id for event in events if event.order_id}
+    receipts = {_receipt(event) for event in events} - {''}
+    bookings = {}
+    for booking in Booking.objects.filter(razorpay_order_id__in=order_ids):
+        bookings[booking.razorpay_order_id] = booking
+    for booking in Booking.objects.filter(booking_id__in=receipts):
+        bookings.setdefault(booking.booking_id, booking)
+    purchases = {
+        purchase.razorpay_order_id: purchase
+        for purchase in PDFPurchase.objects.filter(razorpay_order_id__in=order_ids)
+    }
+
+    now = timezone.now()
+    for event in events:
+        event.attempts += 1
+        try:
+            event.status = _apply(event, bookings, purchases)
+            event.processed_at = now
+        except Exception as e:
+            logger.error(f"Error processing webhook event {event.event_id}: {str(e)}")
+            event.error = str(e)
+            if event.attempts >= settings.RAZORPAY_WEBHOOK_MAX_ATTEMPTS:
+                event.status = 'failed'
+    RazorpayWebhookEvent.objects.bulk_update(events, ['status', 'attempts', 'error', 'processed_at'])
+    return events
+
+
+def process_pending(batch_size=None, max_batches=None):
+    """Process pending events batch by batch until none are left; returns how many were handled.
+
+    An event that fails is retried on the next run, not again within this one.
+    """
+    seen, batches = [], 0
+    while max_batches is None or batches < max_batches:
+        events = process_batch(batch_size, exclude=seen)
+        if not events:
+            break
+        seen.extend(event.pk for event in events)
+        batches += 1
+    return len(seen)
+
+
+@tasks.task()
+def process_inbox():
+    """Apply pending events in the worker; raises, to be retried, while some keep failing"""
+    process_pending()
+    failing = RazorpayWebhookEvent.objects.filter(status='pending', attempts__gt=0).count()
+    if failing:
+        raise RuntimeError(f'{failing} webhook events failed and are still pending')
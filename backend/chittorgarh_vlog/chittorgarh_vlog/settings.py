@@ -10,6 +10,7 @@ Notes:
 from pathlib import Path
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +52,12 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    # Refuses clients flooding the public write endpoints before any database work
+    'api.middleware.HeavyHitterMiddleware',
+    # Refuses oversized or un-ticketed video uploads before their body is read
+    'api.middleware.UploadAdmissionMiddleware',
+    # Caps concurrent uploads so payment endpoints always find a free worker
+    'api.middleware.UploadConcurrencyMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +101,49 @@ else:
         }
     }
 
+# Cache shared by all gunicorn workers: rate limits (api/ratelimit.py), upload slots,
+# tickets. A database table by default (`manage.py createcachetable`); set
+# MEMCACHED_LOCATION (e.g. memcached:11211) to use memcached instead.
+MEMCACHED_LOCATION = os.environ.get('MEMCACHED_LOCATION', '')
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache.DatabaseCache',
+            'LOCATION': 'api_cache',
+            'OPTIONS': {
+                # Expired entries are culled first once the table holds this many
+                'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 100000)),
+            },
+        }
+    }
+# Closed rate-limit windows remembered per process, to skip re-reading them
+RATE_LIMIT_LOCAL_KEYS = int(os.environ.get('RATE_LIMIT_LOCAL_KEYS', 10000))
+
+# Proxies in front of the app that append to X-Forwarded-For (nginx, or Railway's edge).
+# Client addresses that cannot be forged are read that many entries from the end; 0
+# uses the socket address.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+
+# Heavy-hitter detection on the public write endpoints (api/heavyhitters.py). Counts
+# are per worker per window; a key reaching its threshold is denied on all workers.
+# 0 disables a dimension (User-Agent is off by default: browsers share them).
+HEAVY_HITTER_WINDOW = int(os.environ.get('HEAVY_HITTER_WINDOW', 600))
+HEAVY_HITTER_CAPACITY = int(os.environ.get('HEAVY_HITTER_CAPACITY', 256))  # counters per dimension
+HEAVY_HITTER_THRESHOLDS = {
+    'ip': int(os.environ.get('HEAVY_HITTER_IP_THRESHOLD', 60)),
+    'prefix': int(os.environ.get('HEAVY_HITTER_PREFIX_THRESHOLD', 200)),
+    'agent': int(os.environ.get('HEAVY_HITTER_AGENT_THRESHOLD', 0)),
+}
+HEAVY_HITTER_DENY_SECONDS = int(os.environ.get('HEAVY_HITTER_DENY_SECONDS', 3600))
+HEAVY_HITTER_DENY_MAX = int(os.environ.get('HEAVY_HITTER_DENY_MAX', 1000))
+HEAVY_HITTER_SYNC_INTERVAL = float(os.environ.get('HEAVY_HITTER_SYNC_INTERVAL', 5))
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -122,17 +172,122 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
-# Media files (user uploads)
 # Media files (user uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Where videos and PDFs live (see api/storage.py). 'filesystem' keeps them under
+# MEDIA_ROOT on this node; 's3' keeps them in an S3-compatible bucket shared by all
+# nodes. MEDIA_ROOT is still used as local scratch space for uploads in progress.
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'filesystem')
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.S3Storage' if MEDIA_STORAGE == 's3' else 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+AWS_S3_BUCKET = os.environ.get('AWS_S3_BUCKET', '')
+AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL', '')  # empty for AWS itself
+AWS_S3_REGION = os.environ.get('AWS_S3_REGION', 'us-east-1')
+AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID', '')
+AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY', '')
+AWS_S3_URL_EXPIRY = int(os.environ.get('AWS_S3_URL_EXPIRY', 3600))
+AWS_S3_TIMEOUT = int(os.environ.get('AWS_S3_TIMEOUT', 30))
+# Lifetime of the presigned link a PDF download redirects to
+MEDIA_DOWNLOAD_URL_EXPIRY = int(os.environ.get('MEDIA_DOWNLOAD_URL_EXPIRY', 300))
+# Lifetime of the presigned PUT a client uploads a video to in direct mode
+DIRECT_UPLOAD_URL_EXPIRY = int(os.environ.get('DIRECT_UPLOAD_URL_EXPIRY', 900))
+
+# Resumable video uploads (see api/uploads.py)
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 2 * 1024 * 1024))  # 2MB per chunk
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+
+# Booking pre-flight tickets (api/tickets.py): create_booking bodies larger than
+# the threshold need a ticket from /api/preflight/, valid for UPLOAD_TICKET_TTL seconds
+UPLOAD_TICKET_TTL = int(os.environ.get('UPLOAD_TICKET_TTL', 3600))
+UPLOAD_TICKET_THRESHOLD = int(os.environ.get('UPLOAD_TICKET_THRESHOLD', 1024 * 1024))  # 1MB
+
+# Idempotency-Key replay (api/idempotency.py)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 5))  # retry waiting on the first request
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = int(os.environ.get('IDEMPOTENCY_IN_FLIGHT_TIMEOUT', 1800))
+
+# Upload admission control (api/admission.py). Keep UPLOAD_MAX_CONCURRENT below the
+# gunicorn worker count so payment and status requests always find a free worker.
+UPLOAD_MAX_CONCURRENT = int(os.environ.get('UPLOAD_MAX_CONCURRENT', 2))
+UPLOAD_MAX_CONCURRENT_PER_PROCESS = int(os.environ.get('UPLOAD_MAX_CONCURRENT_PER_PROCESS', 1))
+# Seconds to wait for a slot. Keep 0 with sync workers: a waiting request blocks its worker
+UPLOAD_QUEUE_TIMEOUT = float(os.environ.get('UPLOAD_QUEUE_TIMEOUT', 0))
+# A slot is leased for the time its body takes at UPLOAD_MIN_RATE bytes/s (a slow mobile
+# link), and at least UPLOAD_SLOT_LEASE seconds; a 500MB upload gets about 70 minutes
+UPLOAD_MIN_RATE = int(os.environ.get('UPLOAD_MIN_RATE', 128 * 1024))
+UPLOAD_SLOT_LEASE = int(os.environ.get('UPLOAD_SLOT_LEASE', 900))
+UPLOAD_RETRY_AFTER = int(os.environ.get('UPLOAD_RETRY_AFTER', 30))
+
+# Stored video lifecycle (api/lifecycle.py, `manage.py prune_videos`).
+# Days a booking's video is kept, by booking status; None keeps it indefinitely.
+VIDEO_RETENTION_DAYS = {
+    'pending': int(os.environ.get('VIDEO_RETENTION_PENDING_DAYS', 7)),
+    'payment_received': int(os.environ['VIDEO_RETENTION_PAID_DAYS']) if os.environ.get('VIDEO_RETENTION_PAID_DAYS') else None,
+    'completed': int(os.environ.get('VIDEO_RETENTION_COMPLETED_DAYS', 30)),
+}
+# Above the high-water mark (fraction of the media volume, or of the quota if set),
+# the oldest videos of these statuses are evicted until usage is under the low-water mark
+VIDEO_STORAGE_HIGH_WATER = float(os.environ.get('VIDEO_STORAGE_HIGH_WATER', 0.85))
+VIDEO_STORAGE_LOW_WATER = float(os.environ.get('VIDEO_STORAGE_LOW_WATER', 0.75))
+VIDEO_STORAGE_QUOTA_BYTES = int(os.environ.get('VIDEO_STORAGE_QUOTA_BYTES', 0))  # 0 = no quota
+VIDEO_EVICTABLE_STATUSES = ('pending', 'completed')
+VIDEO_EVICTION_MIN_AGE_HOURS = int(os.environ.get('VIDEO_EVICTION_MIN_AGE_HOURS', 24))
+VIDEO_ORPHAN_GRACE_HOURS = int(os.environ.get('VIDEO_ORPHAN_GRACE_HOURS', 6))
+# Run a lifecycle pass after a video is stored at most this often (seconds); 0 disables
+VIDEO_LIFECYCLE_INTERVAL = int(os.environ.get('VIDEO_LIFECYCLE_INTERVAL', 3600))
+
+# Hand file downloads to the front proxy instead of streaming them through gunicorn.
+# '' serves from Python, 'nginx' sends X-Accel-Redirect, 'sendfile' sends X-Sendfile
+# (Apache mod_xsendfile / lighttpd). See nginx/nginx.conf for the matching location.
+MEDIA_OFFLOAD_MODE = os.environ.get('MEDIA_OFFLOAD_MODE', '')
+MEDIA_OFFLOAD_PREFIX = os.environ.get('MEDIA_OFFLOAD_PREFIX', '/protected-media/')
+
+# Keep descriptors of the downloadable PDFs open between requests (api/hotfiles.py)
+MEDIA_HOT_FILES = os.environ.get('MEDIA_HOT_FILES', 'True') == 'True'
+
 
 # Razorpay and other env-based configuration
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', '')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', '')
+# Gateway client (api/gateway.py): timeouts in seconds, retries apply to GETs only
+RAZORPAY_CONNECT_TIMEOUT = float(os.environ.get('RAZORPAY_CONNECT_TIMEOUT', 3.05))
+RAZORPAY_READ_TIMEOUT = float(os.environ.get('RAZORPAY_READ_TIMEOUT', 10))
+RAZORPAY_RETRIES = int(os.environ.get('RAZORPAY_RETRIES', 2))
+RAZORPAY_POOL_SIZE = int(os.environ.get('RAZORPAY_POOL_SIZE', 4))
+# Fail fast for RAZORPAY_BREAKER_RESET seconds after this many consecutive failures
+RAZORPAY_BREAKER_THRESHOLD = int(os.environ.get('RAZORPAY_BREAKER_THRESHOLD', 5))
+RAZORPAY_BREAKER_RESET = int(os.environ.get('RAZORPAY_BREAKER_RESET', 30))
+RAZORPAY_SLOW_CALL_MS = int(os.environ.get('RAZORPAY_SLOW_CALL_MS', 2000))
+# Razorpay webhooks (api/webhooks.py); the endpoint is disabled without a secret
+RAZORPAY_WEBHOOK_SECRET = os.environ.get('RAZORPAY_WEBHOOK_SECRET', '')
+RAZORPAY_WEBHOOK_BATCH_SIZE = int(os.environ.get('RAZORPAY_WEBHOOK_BATCH_SIZE', 100))
+RAZORPAY_WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('RAZORPAY_WEBHOOK_MAX_ATTEMPTS', 5))
+# Public root of this API, for links in emails sent outside a request (webhooks)
+BACKEND_URL = os.environ.get('BACKEND_URL', '')
+# How long create_order / create_pdf_purchase keep handing out the same open order
+RAZORPAY_ORDER_TTL_MINUTES = int(os.environ.get('RAZORPAY_ORDER_TTL_MINUTES', 60))
+# Payments fetched per gateway request by reconcile_payments (Razorpay allows at most 100)
+RAZORPAY_RECONCILE_PAGE_SIZE = int(os.environ.get('RAZORPAY_RECONCILE_PAGE_SIZE', 100))
+
+# Background tasks (api/tasks.py), run by `manage.py run_tasks`
+TASK_BATCH_SIZE = int(os.environ.get('TASK_BATCH_SIZE', 20))
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 5))
+# Retry n waits TASK_RETRY_DELAY * 2**(n-1) seconds, capped at TASK_RETRY_MAX_DELAY
+TASK_RETRY_DELAY = int(os.environ.get('TASK_RETRY_DELAY', 30))
+TASK_RETRY_MAX_DELAY = int(os.environ.get('TASK_RETRY_MAX_DELAY', 3600))
+# A task still running after this long is assumed lost with its worker and run again
+TASK_LEASE_SECONDS = int(os.environ.get('TASK_LEASE_SECONDS', 1800))
+# Finished tasks are deleted after this many days; failed ones are kept
+TASK_KEEP_DAYS = int(os.environ.get('TASK_KEEP_DAYS', 7))
 
 # Email (optional)
 EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
@@ -141,6 +296,21 @@ EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587)) if os.environ.get('EMAIL_POR
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
+# Seconds before a stalled SMTP connection is given up on (the worker would hang otherwise)
+EMAIL_TIMEOUT = int(os.environ.get('EMAIL_TIMEOUT', 30))
+# Delivery by the background worker (api/emails.py): emails claimed per batch on one connection
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+# Temporary SMTP failures are retried after EMAIL_RETRY_DELAY * 2**(n-1) seconds, up to this many sends
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+EMAIL_RETRY_DELAY = int(os.environ.get('EMAIL_RETRY_DELAY', 60))
+# Mail due for longer than this many seconds means no run_tasks worker is running; the admin warns
+EMAIL_STALE_AFTER = int(os.environ.get('EMAIL_STALE_AFTER', 900))
+# Admin notifications about new bookings and purchases: 'immediate' (one email each)
+# or 'digest' (one summary every ADMIN_DIGEST_INTERVAL seconds, if anything happened)
+ADMIN_NOTIFICATIONS = os.environ.get('ADMIN_NOTIFICATIONS', 'immediate')
+ADMIN_DIGEST_INTERVAL = int(os.environ.get('ADMIN_DIGEST_INTERVAL', 3600))
+# In digest mode, amounts (₹) at or above this are still announced at once; 0 holds everything
+ADMIN_DIGEST_IMMEDIATE_AMOUNT = int(os.environ.get('ADMIN_DIGEST_IMMEDIATE_AMOUNT', 5000))
 
 
 
@@ -150,8 +320,9 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        # DRF's throttles, counted in the shared cache (api/ratelimit.py)
+        'api.ratelimit.AnonRateThrottle',
+        'api.ratelimit.UserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
@@ -179,6 +350,9 @@ if frontend_url:
 # Fallback to allow all origins ONLY in development
 CORS_ALLOW_ALL_ORIGINS = os.environ.get('CORS_ALLOW_ALL_ORIGINS', 'True' if DEBUG else 'False') == 'True'
 
+# Custom request headers the frontend sends
+CORS_ALLOW_HEADERS = (*default_headers, 'x-upload-ticket', 'idempotency-key')
+
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -25,11 +25,10 @@ urlpatterns = [
 ]
 
 # Serve media files (Enable for Railway Local Storage)
+# Supports Range requests and conditional GETs so videos can seek and downloads resume
 from django.urls import re_path
-from django.views.static import serve
+from api.media import serve_media
 
 urlpatterns += [
-    re_path(r'^media/(?P<path>.*)$', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }),
+    re_path(r'^media/(?P<path>.*)$', serve_media),
 ]
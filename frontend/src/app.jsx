@@ -251,8 +251,36 @@ const App = () => {
     formData.append('amount', bookingData.amount);
 
     try {
+      // Validate everything before the video is sent; the ticket admits the upload
+      const preflightResponse = await fetch(`${API_URL}/api/preflight/`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+          name: bookingData.name,
+          email: bookingData.email,
+          contact: bookingData.contact,
+          plan: bookingData.plan,
+          amount: bookingData.amount,
+          video_filename: bookingData.videoFile?.name,
+          video_content_type: bookingData.videoFile?.type,
+          video_size: bookingData.videoFile?.size
+        })
+      });
+
+      const preflight = await preflightResponse.json();
+      if (!preflightResponse.ok) {
+        alert(`Booking failed: ${preflight.error || 'Unknown error'}`);
+        setBookingStatus('error');
+        return;
+      }
+
       const response = await fetch(`${API_URL}/api/create/`, {
         method: 'POST',
+        headers: {
+          'X-Upload-Ticket': preflight.ticket
+        },
         body: formData
       });
 